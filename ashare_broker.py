@@ -2,6 +2,145 @@ import math
 import pandas as pd
 import numpy as np
 
+class TradeLog:
+    """
+    列式的成交流水缓冲区：每个字段一块预分配的定长 numpy 数组，满了按倍数扩容。
+    取代“每笔成交一个 8 键字典”的列表，长历史回测不再产生成千上万个小对象，pickle 体积也小得多。
+    对外仍像原来的字典列表一样使用 (len / 下标 / 切片 / 遍历都返回同结构的字典)，
+    需要表格时调用 to_frame() 一次性转换。
+    """
+    __slots__ = ("_n", "_date", "_type", "_price", "_shares", "_amount", "_commission", "_stamp_duty", "_cash_left")
+
+    COLUMNS = ["Date", "Type", "Price", "Shares", "Amount", "Commission", "Stamp_Duty", "Cash_Left"]
+    TYPE_NAMES = ("BUY", "SELL")
+    _TYPE_CODES = {"BUY": 0, "SELL": 1}
+    _FIELDS = (("_date", "datetime64[ns]"), ("_type", np.int8), ("_price", float), ("_shares", np.int64),
+               ("_amount", float), ("_commission", float), ("_stamp_duty", float), ("_cash_left", float))
+
+    def __init__(self, capacity=64):
+        self._n = 0
+        for name, dtype in self._FIELDS:
+            setattr(self, name, np.empty(capacity, dtype=dtype))
+
+    def _grow(self):
+        capacity = max(64, 2 * len(self._price))
+        for name, _ in self._FIELDS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def append(self, date, trade_type, price, shares, amount, commission, stamp_duty, cash_left):
+        """追加一笔成交 (字段含义同原来的交易字典)"""
+        i = self._n
+        if i == len(self._price):
+            self._grow()
+        self._date[i] = np.datetime64(pd.Timestamp(date), "ns")
+        self._type[i] = self._TYPE_CODES[trade_type]
+        self._price[i] = price
+        self._shares[i] = shares
+        self._amount[i] = amount
+        self._commission[i] = commission
+        self._stamp_duty[i] = stamp_duty
+        self._cash_left[i] = cash_left
+        self._n = i + 1
+
+    def column(self, name):
+        """某一列的只读视图 (Date 为 datetime64，Type 为 0=BUY / 1=SELL 的整数码)"""
+        view = getattr(self, "_" + name.lower())[:self._n]
+        view.flags.writeable = False
+        return view
+
+    def _record(self, i):
+        return {
+            "Date": pd.Timestamp(self._date[i]),
+            "Type": self.TYPE_NAMES[self._type[i]],
+            "Price": float(self._price[i]),
+            "Shares": int(self._shares[i]),
+            "Amount": float(self._amount[i]),
+            "Commission": float(self._commission[i]),
+            "Stamp_Duty": float(self._stamp_duty[i]),
+            "Cash_Left": float(self._cash_left[i])
+        }
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._record(i) for i in range(*key.indices(self._n))]
+        if key < 0:
+            key += self._n
+        if not 0 <= key < self._n:
+            raise IndexError("TradeLog index out of range")
+        return self._record(key)
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._record(i)
+
+    def __eq__(self, other):
+        if isinstance(other, (TradeLog, list)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"TradeLog({self._n} trades)"
+
+    def __getstate__(self):
+        # 落盘 / 跨进程传输时只带有效部分
+        return {name: getattr(self, name)[:self._n].copy() for name, _ in self._FIELDS}
+
+    def __setstate__(self, state):
+        for name, _ in self._FIELDS:
+            setattr(self, name, state[name])
+        self._n = len(state["_price"])
+
+    def copy(self):
+        clone = TradeLog.__new__(TradeLog)
+        clone.__setstate__(self.__getstate__())
+        return clone
+
+    @classmethod
+    def from_records(cls, records):
+        """由旧式的交易字典列表构造"""
+        log = cls(capacity=max(64, len(records)))
+        for t in records:
+            log.append(t["Date"], t["Type"], t["Price"], t["Shares"], t["Amount"],
+                       t["Commission"], t["Stamp_Duty"], t["Cash_Left"])
+        return log
+
+    @classmethod
+    def from_frame(cls, df):
+        """由 to_frame() 的结果原样还原 (回测档案从磁盘读回时使用)"""
+        log = cls.__new__(cls)
+        log.__setstate__({
+            "_date": df["Date"].to_numpy(dtype="datetime64[ns]"),
+            "_type": np.where(df["Type"].to_numpy() == "SELL", 1, 0).astype(np.int8),
+            "_price": df["Price"].to_numpy(dtype=float),
+            "_shares": df["Shares"].to_numpy(dtype=np.int64),
+            "_amount": df["Amount"].to_numpy(dtype=float),
+            "_commission": df["Commission"].to_numpy(dtype=float),
+            "_stamp_duty": df["Stamp_Duty"].to_numpy(dtype=float),
+            "_cash_left": df["Cash_Left"].to_numpy(dtype=float)
+        })
+        return log
+
+    def to_frame(self):
+        """一次性转成 DataFrame (列与原来 pd.DataFrame(trades) 的结果一致)"""
+        n = self._n
+        return pd.DataFrame({
+            "Date": self._date[:n].copy(),
+            "Type": np.array(self.TYPE_NAMES, dtype=object)[self._type[:n]],
+            "Price": self._price[:n].copy(),
+            "Shares": self._shares[:n].copy(),
+            "Amount": self._amount[:n].copy(),
+            "Commission": self._commission[:n].copy(),
+            "Stamp_Duty": self._stamp_duty[:n].copy(),
+            "Cash_Left": self._cash_left[:n].copy()
+        })
+
+
 class AShareBroker:
     """
     符合 A 股实战规则的底层交易回测引擎
@@ -11,6 +150,16 @@ class AShareBroker:
     3. 支持佣金与印花税双重扣除
     4. 完美识别涨跌停板熔断机制，并在无法买卖时宣告指令失败
     """
+    # 交易规则常量 (组合引擎等批量撮合器与单票 Broker 共用同一套口径)
+    LOT_SIZE = 100                  # 一手 = 100 股
+    MIN_COMMISSION = 5.0            # 单笔最低佣金 5 元
+    LIMIT_UP_TOLERANCE = 0.999      # 触及涨停判定 (考虑0.1分的浮点误差)
+    LIMIT_DOWN_TOLERANCE = 1.001    # 触及跌停判定
+
+    __slots__ = ("initial_cash", "cash", "total_shares", "available_shares",
+                 "commission_rate", "stamp_duty_rate", "slippage", "trades",
+                 "current_idx", "current_date", "last_close", "order_stats")
+
     def __init__(self, initial_cash=200000.0, commission=0.00025, stamp_duty=0.0005, slippage=0.001):
         self.initial_cash = initial_cash
         self.cash = initial_cash
@@ -24,24 +173,47 @@ class AShareBroker:
         self.stamp_duty_rate = stamp_duty
         self.slippage = slippage    # 以百分比表示的隐形成本，默认千分之一
         
-        # 交易记录流水
-        self.trades = []
+        # 交易记录流水 (列式缓冲区，用法同字典列表)
+        self.trades = TradeLog()
         
         # 状态追踪
         self.current_idx = 0        # 整个回测时间线的进度游标
         self.current_date = None
         self.last_close = None      # 记录上一日收盘价用于计算滑点/涨跌停备用
+        # 本次撮合的订单统计 (提交 / 被拒)，只用于性能与行为分析，不进入断点状态
+        self.order_stats = {"buy_attempted": 0, "buy_rejected": 0, "sell_attempted": 0, "sell_rejected": 0}
+
+    # 断点续跑需要保存的账户状态字段 (交易流水单独处理)
+    STATE_FIELDS = ("initial_cash", "cash", "total_shares", "available_shares",
+                    "commission_rate", "stamp_duty_rate", "slippage",
+                    "current_idx", "current_date", "last_close")
+
+    def get_state(self):
+        """导出账户的完整状态 (现金、总/可用持股、最后有效价、交易流水)，可直接 pickle 落盘"""
+        state = {field: getattr(self, field) for field in self.STATE_FIELDS}
+        state["trades"] = self.trades.copy()
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """由 get_state 导出的状态还原出一个可以继续撮合的 Broker"""
+        broker = cls(state["initial_cash"], state["commission_rate"], state["stamp_duty_rate"], state["slippage"])
+        for field in cls.STATE_FIELDS:
+            setattr(broker, field, state[field])
+        trades = state["trades"]
+        broker.trades = trades.copy() if isinstance(trades, TradeLog) else TradeLog.from_records(trades)
+        return broker
 
     def _calc_commission(self, trade_amount):
         """A 股佣金计算，实盘一般有最低 5 元的限制"""
         fee = trade_amount * self.commission_rate
-        return max(fee, 5.0)
+        return max(fee, self.MIN_COMMISSION)
 
     def _get_lots_to_buy(self, cash_available, price):
         """计算能买多少股，强制要求为 100 股的整数倍"""
         max_shares = cash_available / price
-        lots = math.floor(max_shares / 100)
-        return lots * 100
+        lots = math.floor(max_shares / self.LOT_SIZE)
+        return lots * self.LOT_SIZE
 
     def daily_update_t1_lock(self):
         """
@@ -65,6 +237,22 @@ class AShareBroker:
             self.last_close = price
 
     def submit_buy_order(self, date, trigger_price, limit_up_price, current_high, is_open_auction=False):
+        """提交全仓买入指令，并计入订单统计 (参数与返回值见 _execute_buy_order)"""
+        success, msg = self._execute_buy_order(date, trigger_price, limit_up_price, current_high, is_open_auction)
+        self.order_stats["buy_attempted"] += 1
+        if not success:
+            self.order_stats["buy_rejected"] += 1
+        return success, msg
+
+    def submit_sell_order(self, date, trigger_price, limit_down_price, current_low, is_open_auction=False):
+        """提交清仓卖出指令，并计入订单统计 (参数与返回值见 _execute_sell_order)"""
+        success, msg = self._execute_sell_order(date, trigger_price, limit_down_price, current_low, is_open_auction)
+        self.order_stats["sell_attempted"] += 1
+        if not success:
+            self.order_stats["sell_rejected"] += 1
+        return success, msg
+
+    def _execute_buy_order(self, date, trigger_price, limit_up_price, current_high, is_open_auction=False):
         """
         提交全仓买入指令 (All-in 模型)。
         参数:
@@ -79,11 +267,11 @@ class AShareBroker:
         # 1. 检查熔断机制 (涨停买不进)
         if is_open_auction:
             # 开盘买入：如果开盘价一字涨停，无法买入
-            if trigger_price >= limit_up_price * 0.999: # 考虑0.1分的浮点误差
+            if trigger_price >= limit_up_price * self.LIMIT_UP_TOLERANCE: # 考虑0.1分的浮点误差
                 return False, f"开盘一字涨停，无法买入 ({trigger_price} 触及涨停 {limit_up_price})"
         else:
             # 尾盘买入：如果全天封死涨停，或者尾盘刚好卡在涨停，普通单排不进去
-            if trigger_price >= limit_up_price * 0.999 or current_high >= limit_up_price * 0.999:
+            if trigger_price >= limit_up_price * self.LIMIT_UP_TOLERANCE or current_high >= limit_up_price * self.LIMIT_UP_TOLERANCE:
                  return False, f"遇涨停板筹码封锁，指令作废 ({current_high} 触及涨停 {limit_up_price})"
 
         # 2. 施加滑点 (抢筹成本增加)
@@ -91,7 +279,7 @@ class AShareBroker:
 
         # 3. 计算实际可买数量 (向下取整百股)
         shares_to_buy = self._get_lots_to_buy(self.cash, execution_price)
-        if shares_to_buy < 100:
+        if shares_to_buy < self.LOT_SIZE:
             return False, f"全部资金({self.cash:.2f})买不起1手股票(需{execution_price*100:.2f})"
 
         # 4. 执行扣款并锁定份额 (T日买入，此时份额进 total_shares, 不进 available)
@@ -102,8 +290,8 @@ class AShareBroker:
 
         if self.cash < total_cost: 
             # 理论上不会发生，但在极边缘情况下加上印花税后金额超限，稍微再减一手重试
-            shares_to_buy -= 100
-            if shares_to_buy < 100: return False, "加上手续费与印花税后不足以买1手"
+            shares_to_buy -= self.LOT_SIZE
+            if shares_to_buy < self.LOT_SIZE: return False, "加上手续费与印花税后不足以买1手"
             trade_amount = shares_to_buy * execution_price
             comm = self._calc_commission(trade_amount)
             stamp = trade_amount * self.stamp_duty_rate
@@ -114,20 +302,19 @@ class AShareBroker:
         self.total_shares += shares_to_buy
         # 注意: available_shares 此时不增加，等到明天 daily_update 时解锁
 
-        trade_record = {
-            "Date": date,
-            "Type": "BUY",
-            "Price": execution_price, # 已含滑点
-            "Shares": shares_to_buy,
-            "Amount": trade_amount,
-            "Commission": comm,
-            "Stamp_Duty": stamp,
-            "Cash_Left": self.cash
-        }
-        self.trades.append(trade_record)
+        self.trades.append(
+            date=date,
+            trade_type="BUY",
+            price=execution_price, # 已含滑点
+            shares=shares_to_buy,
+            amount=trade_amount,
+            commission=comm,
+            stamp_duty=stamp,
+            cash_left=self.cash
+        )
         return True, f"成功买入 {shares_to_buy} 股，成交价 {execution_price:.2f}"
 
-    def submit_sell_order(self, date, trigger_price, limit_down_price, current_low, is_open_auction=False):
+    def _execute_sell_order(self, date, trigger_price, limit_down_price, current_low, is_open_auction=False):
         """
         提交全仓卖出指令。
         """
@@ -138,11 +325,11 @@ class AShareBroker:
 
         # 1. 检查熔断机制 (跌停卖不出)
         if is_open_auction:
-             if trigger_price <= limit_down_price * 1.001:
+             if trigger_price <= limit_down_price * self.LIMIT_DOWN_TOLERANCE:
                  return False, f"开盘一字跌停，无法逃离 ({trigger_price} 触及跌停 {limit_down_price})"
         else:
              # 如果最低价摸到了跌停板并且收盘价也在跌停板附近，或者触发止损价但被跌停板压制
-             if trigger_price <= limit_down_price * 1.001 or current_low <= limit_down_price * 1.001:
+             if trigger_price <= limit_down_price * self.LIMIT_DOWN_TOLERANCE or current_low <= limit_down_price * self.LIMIT_DOWN_TOLERANCE:
                  return False, f"遇跌停板封锁，卖单无法撮合 ({current_low} 触及跌停 {limit_down_price})"
 
         # 2. 施加滑点 (砸盘滑价，卖得更贱)
@@ -162,15 +349,14 @@ class AShareBroker:
         self.total_shares -= shares_to_sell
         self.available_shares -= shares_to_sell
 
-        trade_record = {
-            "Date": date,
-            "Type": "SELL",
-            "Price": execution_price,
-            "Shares": shares_to_sell,
-            "Amount": trade_amount,
-            "Commission": comm,
-            "Stamp_Duty": stamp,
-            "Cash_Left": self.cash
-        }
-        self.trades.append(trade_record)
+        self.trades.append(
+            date=date,
+            trade_type="SELL",
+            price=execution_price, # 已含滑点
+            shares=shares_to_sell,
+            amount=trade_amount,
+            commission=comm,
+            stamp_duty=stamp,
+            cash_left=self.cash
+        )
         return True, f"成功卖出 {shares_to_sell} 股，成交价 {execution_price:.2f}"
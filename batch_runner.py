@@ -0,0 +1,159 @@
+import os
+import io
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from strategy_runner import StrategyRunner
+
+# 夜间批量复算的断点目录：每个 (股票, 策略参数) 一个断点文件，外加同名的 .curve 净值曲线分段目录
+CHECKPOINT_DIR = "backtest_data/checkpoints"
+# 后台批量回测按任务队列每个工作进程切几块：块多一些，各进程负载更均衡，别的用户的任务也能插空执行
+BATCH_CHUNKS_PER_WORKER = 4
+
+
+def run_single_backtest(code, data_path, runner_kwargs, checkpoint_dir=None):
+    """
+    子进程里执行的单票回测任务。
+    任何异常都在这里被截获并作为该票的失败结果返回，绝不拖垮整批任务。
+    给出 checkpoint_dir 时走断点续跑，只推进上次之后新增的交易日。
+    :return: {"code", "ok", "report", "trades", "profile"} 或 {"code", "ok": False, "error"}
+             profile 为 StrategyRunner.profile_summary() 的分阶段耗时与订单计数
+    """
+    try:
+        # 多进程并发时大循环的控制台日志只会互相刷屏，这里统一吞掉
+        with contextlib.redirect_stdout(io.StringIO()):
+            # 断点续跑时先不读整个时间窗口，由 run_incremental 只读断点之后的新增行
+            runner = StrategyRunner(data_path=data_path, load_data=not checkpoint_dir, **runner_kwargs)
+            if checkpoint_dir:
+                checkpoint_path = os.path.join(checkpoint_dir, f"{code}_{runner.checkpoint_key()}.pkl")
+                curve_df, trades = runner.run_incremental(checkpoint_path)
+            else:
+                curve_df, trades = runner.run()
+            report = runner.generate_report(curve_df)
+        return {"code": code, "ok": True, "report": report, "trades": trades, "profile": runner.profile_summary()}
+    except Exception as e:
+        return {"code": code, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+def iter_batch_backtests(codes, vault_dir, runner_kwargs, max_workers=None, checkpoint_dir=None):
+    """
+    把一批股票的回测分发到进程池，按完成先后逐个产出结果 (生成器)，
+    调用方可以边收结果边刷新进度条。
+
+    :param codes: 股票代码列表
+    :param vault_dir: Final Vault 目录
+    :param runner_kwargs: 透传给 StrategyRunner 的参数 (资金、费率、买卖逻辑、风控、时间窗口)
+    :param max_workers: 进程数，默认使用全部 CPU 核心；为 1 时直接在当前进程串行执行
+    :param checkpoint_dir: 断点目录 (如 CHECKPOINT_DIR)，夜间复算同一批策略时只处理新增交易日
+    """
+    tasks = [(code, os.path.join(vault_dir, f"{code}.parquet")) for code in codes]
+    workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+
+    if workers <= 1:
+        for code, data_path in tasks:
+            yield run_single_backtest(code, data_path, runner_kwargs, checkpoint_dir)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(run_single_backtest, code, data_path, runner_kwargs, checkpoint_dir): code
+            for code, data_path in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # 子进程被系统杀掉 (如内存不足) 时 future 本身会抛错
+                yield {"code": futures[future], "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+# ------ 后台任务 (job_queue) ------
+def single_backtest_job(ctx, stock_code, data_path, runner_kwargs, profile_memory=False, registry_key=None):
+    """
+    专业回测舱的单票回测任务 (在 job_queue 的工作进程里执行)。
+    各阶段之间检查取消标记；给出 registry_key 时跑完顺手存入回测档案。
+    :return: 与页面 session_state.backtest_results 同结构的字典
+    """
+    import time
+    from run_registry import RunRegistry, run_spec
+
+    t0 = time.perf_counter()
+    ctx.progress(0, 3, f"{stock_code}: 编译表达式并加载行情")
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner = StrategyRunner(data_path=data_path, profile_memory=profile_memory, **runner_kwargs)
+        ctx.check_cancelled()
+        ctx.progress(1, 3, f"{stock_code}: 逐日撮合 ({len(runner.df)} 个交易日)")
+        curve_df, trades = runner.run()
+        ctx.check_cancelled()
+        ctx.progress(2, 3, f"{stock_code}: 生成战报")
+        report = runner.generate_report(curve_df)
+    profile = runner.profile_summary()
+    if registry_key:
+        RunRegistry().save_single(registry_key, run_spec(runner_kwargs), stock_code, curve_df, trades, report,
+                                  profile=profile, seconds=time.perf_counter() - t0)
+    ctx.progress(3, 3, f"{stock_code}: 完成")
+    return {"curve_df": curve_df, "trades": trades, "report": report, "stock_code": stock_code,
+            "profile": profile, "registry_key": registry_key}
+
+
+def split_batch(codes, n_chunks):
+    """把股票列表按原顺序切成至多 n_chunks 个大小相近的连续块 (批量回测拆成多个后台任务并行)"""
+    n_chunks = max(1, min(n_chunks, len(codes)))
+    size, extra = divmod(len(codes), n_chunks)
+    chunks, start = [], 0
+    for k in range(n_chunks):
+        end = start + size + (1 if k < extra else 0)
+        chunks.append(list(codes[start:end]))
+        start = end
+    return [c for c in chunks if c]
+
+
+def batch_backtest_job(ctx, codes, vault_dir, runner_kwargs, stock_names=None):
+    """
+    策略全景阅兵场的多股回测任务 (一块股票)。页面把整批股票用 split_batch 切块，每块一个后台任务，
+    各块由 job_queue 的进程池并行执行 (并发度受 JOB_MAX_WORKERS 统一控制)；块内逐只执行，
+    每只股票之后回报进度并检查取消标记。各块的结果用 merge_batch_results 按原顺序合并。
+    :return: {"results": 逐股结果列表, "errors": [(代码, 错误)], "profiles"}
+    """
+    stock_names = stock_names or {}
+    results, errors, profiles = [], [], []
+    for i, res in enumerate(iter_batch_backtests(codes, vault_dir, runner_kwargs, max_workers=1)):
+        code = res["code"]
+        if not res["ok"]:
+            errors.append((code, res["error"]))
+        else:
+            report = res["report"]
+            if res.get("profile"):
+                profiles.append(res["profile"])
+            results.append({
+                "标的代码": code,
+                "股票名称": stock_names.get(code, code),
+                "策略绝对收益": report['Total_Return'],
+                "被动死拿收益": report['Benchmark_Return'],
+                "🔥 超额 Alpha": report['Total_Return'] - report['Benchmark_Return'],
+                "战斗胜率": report['Win_Rate'],
+                "深渊回撤 (MaxDD)": report['Max_Drawdown'],
+                "交易拔枪次数": report['Total_Trades_Pairs'],
+                "Tear_Sheet_Monthly": report.get('Tear_Sheet_Monthly'),
+                "trades": res["trades"]
+            })
+        ctx.progress(i + 1, len(codes), f"{code} 推演完毕 ({i + 1}/{len(codes)})")
+        ctx.check_cancelled()
+    return {"results": results, "errors": errors, "profiles": profiles}
+
+
+def merge_batch_results(chunks, outputs):
+    """
+    按块顺序合并 batch_backtest_job 的输出。
+    :param chunks: split_batch 切出的股票块
+    :param outputs: 与 chunks 一一对应的任务返回值；整块失败时传入错误信息字符串，块内每只股票都记为该错误
+    :return: {"results", "errors", "profiles", "total_stocks"}
+    """
+    merged = {"results": [], "errors": [], "profiles": [], "total_stocks": sum(len(c) for c in chunks)}
+    for codes, out in zip(chunks, outputs):
+        if isinstance(out, str):
+            merged["errors"].extend((code, out) for code in codes)
+            continue
+        merged["results"].extend(out["results"])
+        merged["errors"].extend(out["errors"])
+        merged["profiles"].extend(out["profiles"])
+    return merged
@@ -0,0 +1,554 @@
+import os
+import io
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow
+from vault_io import write_vault
+
+# 合成股票池与测评结果的落盘位置
+BENCH_DATA_DIR = "backtest_data/bench_universe"
+BENCH_RESULTS_DIR = "backtest_data/benchmarks"
+RESULTS_SCHEMA_VERSION = 1
+
+# 合成日历固定截止日 (不随“今天”漂移，保证同一组参数生成的数据逐位一致)
+BENCH_END_DATE = "2025-12-31"
+TRADING_DAYS_PER_YEAR = 250
+# 代码前缀覆盖主板 / 创业板 / 科创板，涨跌停规则的各个分支都会被走到
+CODE_PREFIXES = ("600", "000", "300", "688", "601", "002", "603")
+
+# 各层 Vault 的列 (与 data_fetcher_v2 / super_factor_engine / fundamental_engine 的产出一致)
+RAW_COLUMNS = ['Date', 'Open_Raw', 'High_Raw', 'Low_Raw', 'Close_Raw', 'Volume', 'Turnover', 'Turnover_Rate',
+               'Pct_Chg_Raw', 'Open_Qfq', 'High_Qfq', 'Low_Qfq', 'Close_Qfq', 'Code']
+VAULT_COLUMNS = RAW_COLUMNS + ['Prev_Close_Raw', 'limit_up', 'limit_down', 'is_trading']
+TECH_COLUMNS = ['MA_5', 'MA_10', 'MA_20', 'MA_60', 'MA_120', 'MA_250', 'MA_6', 'MA_12',
+                'BIAS_6', 'BIAS_12', 'BIAS_20', 'BIAS_60', 'Price_Loc_250',
+                'MACD', 'MACD_Signal', 'MACD_Hist', 'MACD_Golden_Cross', 'MACD_Dead_Cross', 'RSI_14',
+                'KDJ_K', 'KDJ_D', 'KDJ_J', 'BOLL_Lower', 'BOLL_Mid', 'BOLL_Upper', 'ATR_14', 'ATR_Ratio',
+                'Turnover_ZScore', 'Vol_Ratio_5D', 'Vol_Shrink_20D',
+                'Limit_Up_Count_5', 'Limit_Up_Count_10', 'Limit_Down_Count_5', 'Limit_Up_Seal_Ratio']
+FUNDAMENTAL_COLUMNS = ['PE_TTM', 'PB', 'Total_MV', 'PE_Percentile_3Y',
+                       'ROE', 'NetProfit_YOY', 'DeductedNetProfit_YOY', 'Revenue_YOY', 'Debt_Ratio']
+
+# 回测与雷达选股的代表性负载
+BENCH_STRATEGY = {
+    "buy_logic": "Close_Qfq > MA_20 and MACD_Hist > 0",
+    "sell_logic": "Close_Qfq < MA_10",
+    "stop_loss_pct": 0.08,
+    "max_hold_days": 20
+}
+# 分钟线流式回测的代表性负载 (10:30 之后突破日内高点)
+MINUTE_BENCH_STOCKS = 2
+MINUTE_BENCH_STRATEGY = {
+    "buy_logic": "Time >= 1030 and Close > Prior_High and Close > VWAP",
+    "sell_logic": "Close < VWAP * 0.98",
+    "stop_loss_pct": 0.05,
+    "max_hold_days": 5
+}
+SCANNER_QUERIES = [
+    "(Close_Qfq > MA_20)",
+    "(MA_5 > MA_10 and MA_10 > MA_20 and MA_20 > MA_60)",
+    "(MACD_Golden_Cross == True) and (RSI_14 < 70)",
+    "(KDJ_J < 0 and KDJ_K < 20 and KDJ_D < 20) or (Close_Qfq <= BOLL_Lower)",
+    "(PE_TTM > 0 and PE_TTM < 30) and (PB < 3) and (Total_MV >= 5000000000 and Total_MV <= 100000000000)",
+    "(Turnover_ZScore > 2) and (Vol_Ratio_5D > 1.5) and (Limit_Down_Count_5 == 0)"
+]
+
+
+# ---------------- 合成股票池 ----------------
+
+def _universe_codes(n_stocks):
+    return [CODE_PREFIXES[i % len(CODE_PREFIXES)] + f"{i // len(CODE_PREFIXES):03d}" for i in range(n_stocks)]
+
+
+def _limit_pct(code, dates):
+    """与 calc_daily_limits_and_flags 相同的板块涨跌幅规则 (不含 ST 识别)"""
+    if code.startswith('688'):
+        return np.full(len(dates), 0.20)
+    if code.startswith('300'):
+        return np.where(dates >= pd.Timestamp('2020-08-24'), 0.20, 0.10)
+    return np.full(len(dates), 0.10)
+
+
+def _synth_vault(code, calendar, rng):
+    """一只股票的基础 Vault：随机游走的不复权价格 + 分红前复权 + 停牌 + 涨跌停，列与真实 Vault 一致"""
+    # 约三成股票在区间中途上市
+    listed = int(rng.integers(0, len(calendar) * 3 // 10 + 1)) if rng.random() < 0.3 else 0
+    dates = calendar[listed:]
+    n = len(dates)
+    trading = rng.random(n) > 0.02
+    trading[0] = True
+    t_dates = dates[trading]
+    m = len(t_dates)
+
+    lim = _limit_pct(code, t_dates)
+    r = np.clip(rng.standard_t(4, m) * 0.012 + 0.0003, -lim * 0.98, lim * 0.98)
+    close = np.round(rng.uniform(3, 150) * np.cumprod(1 + r), 2)
+    prev = np.concatenate([[np.nan], close[:-1]])
+    limit_up = np.round(prev * (1 + lim), 2)
+    limit_down = np.round(prev * (1 - lim), 2)
+    # 约 1% 的交易日封死涨停 (其中一半是一字板)，约 0.5% 的交易日跌停
+    hit = rng.random(m) < 0.01
+    hit[0] = False
+    drop = ~hit & (rng.random(m) < 0.005)
+    drop[0] = False
+    close = np.where(hit, limit_up, np.where(drop, limit_down, close))
+    open_ = np.clip(np.round(np.where(np.isnan(prev), close, prev) * (1 + rng.normal(0, 0.008, m)), 2),
+                    np.nan_to_num(limit_down, nan=-np.inf), np.nan_to_num(limit_up, nan=np.inf))
+    one_line = hit & (rng.random(m) < 0.5)
+    open_ = np.where(one_line, close, open_)
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, m)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, m)))
+    high = np.round(np.minimum(high, np.nan_to_num(limit_up, nan=np.inf)), 2)
+    low = np.round(np.maximum(low, np.nan_to_num(limit_down, nan=-np.inf)), 2)
+    high = np.where(one_line, close, high)
+    low = np.where(one_line, close, low)
+    # 上市首日没有前收盘，涨跌停取当日最高最低 (同 calc_daily_limits_and_flags)
+    limit_up[0], limit_down[0] = high[0], low[0]
+
+    volume = np.round(rng.lognormal(np.log(2e5), 0.6, m))
+    turnover_rate = np.round(rng.lognormal(np.log(1.5), 0.6, m), 2)
+    # 每年约一次分红除息，前复权因子在除息日前按比例打折
+    div = np.where(rng.random(m) < 1 / TRADING_DAYS_PER_YEAR, 1 - rng.uniform(0.005, 0.03, m), 1.0)
+    adj = np.append(np.cumprod(div[::-1])[::-1][1:], 1.0)
+
+    def spread(values, fill=np.nan):
+        out = np.full(n, fill, dtype=float)
+        out[trading] = values
+        return out
+
+    return pd.DataFrame({
+        'Date': dates,
+        'Open_Raw': spread(open_),
+        'High_Raw': spread(high),
+        'Low_Raw': spread(low),
+        'Close_Raw': spread(close),
+        'Volume': spread(volume, 0.0),
+        'Turnover': spread(np.round(volume * close * 100, 2), 0.0),
+        'Turnover_Rate': spread(turnover_rate),
+        'Pct_Chg_Raw': spread(np.round((close / prev - 1) * 100, 2)),
+        'Open_Qfq': spread(np.round(open_ * adj, 2)),
+        'High_Qfq': spread(np.round(high * adj, 2)),
+        'Low_Qfq': spread(np.round(low * adj, 2)),
+        'Close_Qfq': spread(np.round(close * adj, 2)),
+        'Code': code,
+        'Prev_Close_Raw': spread(prev),
+        'limit_up': spread(limit_up),
+        'limit_down': spread(limit_down),
+        'is_trading': trading
+    })
+
+
+def _synth_tech_features(vault_df):
+    """
+    技术因子的近似实现 (不依赖 ta 库)，只为得到真实 schema、真实量级的 C 表数据，
+    不追求与 calculate_super_features 逐位一致。
+    """
+    v = vault_df[vault_df['is_trading']]
+    c, h, l = v['Close_Qfq'], v['High_Qfq'], v['Low_Qfq']
+    f = pd.DataFrame(index=v.index)
+    for w in (5, 10, 20, 60, 120, 250, 6, 12):
+        f[f'MA_{w}'] = c.rolling(w).mean()
+    for w in (6, 12, 20, 60):
+        f[f'BIAS_{w}'] = (c - f[f'MA_{w}']) / f[f'MA_{w}'] * 100
+    hi250, lo250 = c.rolling(250, min_periods=60).max(), c.rolling(250, min_periods=60).min()
+    f['Price_Loc_250'] = (c - lo250) / (hi250 - lo250)
+
+    f['MACD'] = c.ewm(span=12, adjust=False, min_periods=12).mean() - c.ewm(span=26, adjust=False, min_periods=26).mean()
+    f['MACD_Signal'] = f['MACD'].ewm(span=9, adjust=False, min_periods=9).mean()
+    f['MACD_Hist'] = f['MACD'] - f['MACD_Signal']
+    f['MACD_Golden_Cross'] = (f['MACD_Hist'] > 0) & (f['MACD_Hist'].shift(1) <= 0)
+    f['MACD_Dead_Cross'] = (f['MACD_Hist'] < 0) & (f['MACD_Hist'].shift(1) >= 0)
+
+    diff = c.diff()
+    up = diff.clip(lower=0).ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+    down = (-diff).clip(lower=0).ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+    f['RSI_14'] = 100 - 100 / (1 + up / down)
+
+    ll9, hh9 = l.rolling(9).min(), h.rolling(9).max()
+    f['KDJ_K'] = (c - ll9) / (hh9 - ll9) * 100
+    f['KDJ_D'] = f['KDJ_K'].rolling(3).mean()
+    f['KDJ_J'] = 3 * f['KDJ_K'] - 2 * f['KDJ_D']
+
+    std20 = c.rolling(20).std(ddof=0)
+    f['BOLL_Mid'] = f['MA_20']
+    f['BOLL_Lower'] = f['MA_20'] - 2 * std20
+    f['BOLL_Upper'] = f['MA_20'] + 2 * std20
+    tr = pd.concat([h - l, (h - c.shift(1)).abs(), (l - c.shift(1)).abs()], axis=1).max(axis=1)
+    f['ATR_14'] = tr.rolling(14).mean()
+    f['ATR_Ratio'] = f['ATR_14'] / c
+
+    # 以下 A 股特色因子与 super_factor_engine 的公式相同
+    turnover = v['Turnover_Rate']
+    f['Turnover_ZScore'] = (turnover - turnover.rolling(20, min_periods=5).mean()) / turnover.rolling(20, min_periods=5).std()
+    volume = v['Volume']
+    f['Vol_Ratio_5D'] = volume / volume.rolling(5, min_periods=2).mean().shift(1)
+    f['Vol_Shrink_20D'] = volume < volume.rolling(20, min_periods=5).mean() * 0.5
+    is_limit_up = v['Close_Raw'] >= v['limit_up']
+    is_limit_down = v['Close_Raw'] <= v['limit_down']
+    f['Limit_Up_Count_5'] = is_limit_up.rolling(5, min_periods=1).sum()
+    f['Limit_Up_Count_10'] = is_limit_up.rolling(10, min_periods=1).sum()
+    f['Limit_Down_Count_5'] = is_limit_down.rolling(5, min_periods=1).sum()
+    one_line = (v['Low_Raw'] == v['High_Raw']) & is_limit_up
+    f['Limit_Up_Seal_Ratio'] = np.where(one_line, 5.0, np.where(is_limit_up, 1.0, 0.0))
+
+    # 停牌日留空 (布尔列因此变成含缺失的 object 列，与真实流水线 merge 回大表后的形态一致)
+    f = f.reindex(vault_df.index)
+    return pd.concat([vault_df, f[TECH_COLUMNS]], axis=1)
+
+
+def synth_valuation_table(vault_df, rng):
+    """stock_value_em 原始格式的每日估值表 (只含交易日)，供 merge_valuation 使用"""
+    v = vault_df[vault_df['is_trading']]
+    m = len(v)
+    # 每股收益 / 每股净资产按季度阶梯变化，约一成股票处于亏损
+    quarters = np.repeat(rng.normal(1.0, 0.6, m // 60 + 1), 60)[:m]
+    eps = np.where(rng.random() < 0.1, -0.5, 1.0) * np.abs(quarters) * v['Close_Raw'].iloc[-1] / 25
+    bps = np.abs(quarters) * v['Close_Raw'].iloc[-1] / 3 + 0.5
+    total_shares = rng.lognormal(np.log(1e9), 1.0)
+    return pd.DataFrame({
+        '数据日期': v['Date'].to_numpy(),
+        'PE(TTM)': np.round(v['Close_Raw'].to_numpy() / eps, 2),
+        '市净率': np.round(v['Close_Raw'].to_numpy() / bps, 2),
+        '总市值': np.round(v['Close_Raw'].to_numpy() * total_shares, 0)
+    })
+
+
+def synth_financial_table(vault_df, rng):
+    """stock_financial_abstract_ths 原始格式的报告期财务摘要 (带 % 的字符串，偶有 '--')，供 merge_financial_reports 使用"""
+    first, last = vault_df['Date'].iloc[0], vault_df['Date'].iloc[-1]
+    report_dates = pd.date_range(first - pd.DateOffset(years=1), last, freq='QE-DEC')
+    k = len(report_dates)
+
+    def pct(loc, scale):
+        values = np.char.add(np.round(rng.normal(loc, scale, k), 2).astype(str), '%').astype(object)
+        values[rng.random(k) < 0.03] = '--'
+        return values
+
+    return pd.DataFrame({
+        '报告期': report_dates.astype('datetime64[ns]').to_numpy(),
+        '净资产收益率': pct(8, 6),
+        '净利润同比增长率': pct(10, 30),
+        '扣非净利润同比增长率': pct(8, 30),
+        '营业总收入同比增长率': pct(10, 20),
+        '资产负债率': pct(50, 15)
+    })
+
+
+def _synth_fundamentals(super_df, rng):
+    """D 表列：估值按日期直接对齐 (分位用滚动极值近似，避免生成阶段跑慢速的 rolling.apply)，财报走真实的 as-of 合并"""
+    from fundamental_engine import merge_financial_reports
+    val = synth_valuation_table(super_df, rng)
+    val_cols = pd.DataFrame({
+        'Date': pd.to_datetime(val['数据日期']),
+        'PE_TTM': val['PE(TTM)'],
+        'PB': val['市净率'],
+        'Total_MV': val['总市值']
+    })
+    pe = val_cols['PE_TTM']
+    pe_min, pe_max = pe.rolling(750, min_periods=250).min(), pe.rolling(750, min_periods=250).max()
+    val_cols['PE_Percentile_3Y'] = (pe - pe_min) / (pe_max - pe_min) * 100
+    df = pd.merge(super_df, val_cols, on='Date', how='left')
+    return merge_financial_reports(df, synth_financial_table(super_df, rng))
+
+
+def universe_dir(n_stocks, years, seed, root=BENCH_DATA_DIR):
+    return os.path.join(root, f"{n_stocks}x{years}y_seed{seed}")
+
+
+def generate_universe(n_stocks=11, years=5, seed=42, root=BENCH_DATA_DIR, force=False):
+    """
+    生成合成股票池：vault / super_vault / final_vault 三层 Parquet 与 today_scanner.parquet，
+    目录结构、列名、列类型都与真实数据一致。同一组 (股票数, 年数, 种子) 的数据逐位可复现，
+    已生成过的股票池直接复用 (force=True 强制重建)。
+    :return: 股票池清单 dict
+    """
+    base = universe_dir(n_stocks, years, seed, root)
+    manifest_path = os.path.join(base, "universe.json")
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as fp:
+            return json.load(fp)
+
+    layers = {name: os.path.join(base, name) for name in ("vault", "super_vault", "final_vault")}
+    for path in layers.values():
+        os.makedirs(path, exist_ok=True)
+    calendar = pd.bdate_range(end=BENCH_END_DATE, periods=years * TRADING_DAYS_PER_YEAR).astype('datetime64[ns]')
+    codes = _universe_codes(n_stocks)
+
+    print(f"正在生成合成股票池: {n_stocks} 只 x {years} 年 (seed={seed}) -> {base}")
+    t0 = time.perf_counter()
+    snapshots = []
+    total_rows = 0
+    for i, code in enumerate(codes):
+        rng = np.random.default_rng([seed, i])
+        vault_df = _synth_vault(code, calendar, rng)
+        super_df = _synth_tech_features(vault_df)
+        final_df = _synth_fundamentals(super_df, rng)
+        write_vault(vault_df, os.path.join(layers["vault"], f"{code}.parquet"))
+        write_vault(super_df, os.path.join(layers["super_vault"], f"{code}.parquet"))
+        write_vault(final_df, os.path.join(layers["final_vault"], f"{code}.parquet"))
+        total_rows += len(final_df)
+
+        last = final_df[final_df['is_trading']].iloc[-1].to_dict()
+        last['Stock_Name'] = f"合成{code}"
+        snapshots.append(last)
+        if (i + 1) % 500 == 0:
+            print(f"  ... {i + 1}/{n_stocks}")
+
+    scanner_path = os.path.join(base, "today_scanner.parquet")
+    pd.DataFrame(snapshots).to_parquet(scanner_path, engine="pyarrow", index=False)
+
+    manifest = {
+        "n_stocks": n_stocks,
+        "years": years,
+        "seed": seed,
+        "end_date": BENCH_END_DATE,
+        "rows": total_rows,
+        "codes": codes,
+        "dirs": layers,
+        "scanner_file": scanner_path,
+        "generate_seconds": round(time.perf_counter() - t0, 3)
+    }
+    with open(manifest_path, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, ensure_ascii=False, indent=2)
+    print(f"  [√] 生成完毕，共 {total_rows} 行，用时 {manifest['generate_seconds']}s")
+    return manifest
+
+
+# ---------------- 测评项 ----------------
+# 每个测评项：setup(股票池清单, 抽样代码) -> (无参的待测函数, 处理的行数)
+# setup 阶段的读盘与准备不计入耗时
+
+def _layer_paths(universe, layer, codes):
+    return [os.path.join(universe["dirs"][layer], f"{code}.parquet") for code in codes]
+
+
+def _setup_daily_limits(universe, codes):
+    from data_fetcher_v2 import calc_daily_limits_and_flags
+    frames = []
+    for path in _layer_paths(universe, "vault", codes):
+        df = pd.read_parquet(path, columns=RAW_COLUMNS)
+        frames.append(df[df['Close_Raw'].notna()].reset_index(drop=True))
+    return (lambda: [calc_daily_limits_and_flags(f) for f in frames]), sum(len(f) for f in frames)
+
+
+def _setup_super_features(universe, codes):
+    from super_factor_engine import calculate_super_features
+    frames = [pd.read_parquet(path) for path in _layer_paths(universe, "vault", codes)]
+    return (lambda: [calculate_super_features(f) for f in frames]), sum(len(f) for f in frames)
+
+
+def _setup_fundamental_merge(universe, codes):
+    from fundamental_engine import merge_valuation, merge_financial_reports
+    jobs = []
+    for i, path in enumerate(_layer_paths(universe, "super_vault", codes)):
+        df = pd.read_parquet(path)
+        rng = np.random.default_rng([universe["seed"], i, 1])
+        jobs.append((df, synth_valuation_table(df, rng), synth_financial_table(df, rng)))
+
+    def work():
+        # 与 fetch_and_merge_fundamentals 拿到原始表后的处理完全相同 (只是不联网)
+        return [merge_financial_reports(merge_valuation(df, val.copy()), fin.copy()) for df, val, fin in jobs]
+    return work, sum(len(j[0]) for j in jobs)
+
+
+def _setup_strategy_runner(universe, codes):
+    from strategy_runner import StrategyRunner
+    paths = _layer_paths(universe, "final_vault", codes)
+
+    def work():
+        # 关闭进程级 Vault 缓存与信号缓存，测的是冷启动：读盘 + 信号 + 撮合
+        for path in paths:
+            runner = StrategyRunner(path, use_signal_cache=False, use_vault_cache=False, **BENCH_STRATEGY)
+            runner.run()
+    rows = sum(len(pd.read_parquet(p, columns=['Date'])) for p in paths)
+    return work, rows
+
+
+def _setup_minute_stream(universe, codes):
+    from minute_vault import build_synthetic_minute_vault, list_months, open_month
+    from minute_runner import MinuteStrategyRunner
+    # 分钟线量级远大于日线 (每天 240 根)，只取前 MINUTE_BENCH_STOCKS 只，合成数据生成一次后复用
+    minute_dir = os.path.join(os.path.dirname(universe["scanner_file"]), "minute_vault")
+    start = pd.Timestamp(universe["end_date"]) - pd.DateOffset(years=universe["years"])
+    picked = codes[:MINUTE_BENCH_STOCKS]
+    for code in picked:
+        if not list_months(code, minute_dir):
+            build_synthetic_minute_vault(code, start, universe["end_date"], vault_dir=minute_dir, seed=universe["seed"])
+
+    def work():
+        for code in picked:
+            MinuteStrategyRunner(code, vault_dir=minute_dir, **MINUTE_BENCH_STRATEGY).run()
+    rows = sum(len(open_month(code, month, minute_dir)) for code in picked for month in list_months(code, minute_dir))
+    return work, rows
+
+
+def _setup_scanner_query(universe, codes):
+    # 雷达选股器对全池截面做 query，不抽样
+    df = pd.read_parquet(universe["scanner_file"])
+    return (lambda: [df.copy().query(q) for q in SCANNER_QUERIES]), len(df) * len(SCANNER_QUERIES)
+
+
+BENCHMARKS = {
+    "calc_daily_limits_and_flags": _setup_daily_limits,
+    "calculate_super_features": _setup_super_features,
+    "fundamental_merge": _setup_fundamental_merge,
+    "strategy_runner_run": _setup_strategy_runner,
+    "minute_stream_backtest": _setup_minute_stream,
+    "scanner_query": _setup_scanner_query
+}
+
+
+def _measure(work, repeat):
+    """先纯计时 repeat 次 (不开 tracemalloc，避免拖慢)，再单独跑一次记录 Python 侧分配的峰值内存"""
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            gc.collect()
+            t0 = time.perf_counter()
+            work()
+            timings.append(time.perf_counter() - t0)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            work()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return timings, peak
+
+
+def _git_info():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_benchmarks(n_stocks=11, years=5, seed=42, sample=50, repeat=3, only=None, out_path=None):
+    """
+    跑全部 (或指定的) 测评项，结果写成 JSON，便于不同提交之间对比。
+    :param sample: 逐股处理的测评项最多抽多少只股票 (按代码顺序取前 N 只，保证可复现)；截面查询始终用全池
+    :param only: 只跑这些测评项名
+    :return: 结果 dict
+    """
+    universe = generate_universe(n_stocks, years, seed)
+    codes = universe["codes"][:sample] if sample else universe["codes"]
+    commit, dirty = _git_info()
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        print(f"▶ {name} ...", end=" ", flush=True)
+        try:
+            work, rows = setup(universe, codes)
+            timings, peak = _measure(work, repeat)
+        except Exception as e:
+            # 缺少可选依赖 (例如 ta) 等情况记为失败，不影响其他测评项
+            results[name] = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            print(f"失败 ({type(e).__name__}: {e})")
+            continue
+        median = float(np.median(timings))
+        results[name] = {
+            "status": "ok",
+            "rows": int(rows),
+            "seconds_min": round(min(timings), 6),
+            "seconds_median": round(median, 6),
+            "rows_per_sec": round(rows / median, 1) if median > 0 else None,
+            "peak_mem_mb": round(peak / 1024 / 1024, 3)
+        }
+        print(f"{median:.3f}s, {results[name]['rows_per_sec']} 行/秒, 峰值 {results[name]['peak_mem_mb']} MB")
+
+    report = {
+        "schema_version": RESULTS_SCHEMA_VERSION,
+        "created_at": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "pyarrow": pyarrow.__version__
+        },
+        "universe": {k: universe[k] for k in ("n_stocks", "years", "seed", "end_date", "rows")},
+        "config": {"sample": len(codes), "repeat": repeat},
+        "results": results
+    }
+    if out_path is None:
+        os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+        stamp = pd.Timestamp.now().strftime("%Y%m%d_%H%M%S")
+        out_path = os.path.join(BENCH_RESULTS_DIR, f"{stamp}_{(commit or 'nogit')[:8]}_{n_stocks}x{years}y.json")
+    with open(out_path, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, ensure_ascii=False, indent=2)
+    print(f"测评结果已写入 -> {out_path}")
+    return report
+
+
+def compare_results(base_path, new_path):
+    """
+    对比两份测评结果：speedup > 1 表示新结果更快，mem_ratio < 1 表示峰值内存更小。
+    两份结果的股票池参数不同时照样对比 (以吞吐量为准)，但会给出提示。
+    """
+    with open(base_path, encoding="utf-8") as fp:
+        base = json.load(fp)
+    with open(new_path, encoding="utf-8") as fp:
+        new = json.load(fp)
+    if base["universe"] != new["universe"] or base["config"] != new["config"]:
+        print("⚠️ 两份结果的股票池或抽样参数不同，请以吞吐量 (行/秒) 为准")
+
+    rows = []
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        a, b = base["results"].get(name, {}), new["results"].get(name, {})
+        ok = a.get("status") == "ok" and b.get("status") == "ok"
+        rows.append({
+            "benchmark": name,
+            "base_rows_per_sec": a.get("rows_per_sec"),
+            "new_rows_per_sec": b.get("rows_per_sec"),
+            "speedup": round(b["rows_per_sec"] / a["rows_per_sec"], 3) if ok else None,
+            "base_peak_mb": a.get("peak_mem_mb"),
+            "new_peak_mb": b.get("peak_mem_mb"),
+            "mem_ratio": round(b["peak_mem_mb"] / a["peak_mem_mb"], 3) if ok and a["peak_mem_mb"] else None
+        })
+    return pd.DataFrame(rows)
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回测热点路径性能测评 (离线，合成股票池)")
+    sub = parser.add_subparsers(dest="command")
+    run_p = sub.add_parser("run", help="生成/复用合成股票池并跑测评")
+    run_p.add_argument("--stocks", type=int, default=11, help="股票数 (11 ~ 5000)")
+    run_p.add_argument("--years", type=int, default=5, help="历史年数 (1 ~ 20)")
+    run_p.add_argument("--seed", type=int, default=42)
+    run_p.add_argument("--sample", type=int, default=50, help="逐股测评项最多抽样的股票数，0 表示全部")
+    run_p.add_argument("--repeat", type=int, default=3)
+    run_p.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="只跑指定的测评项")
+    run_p.add_argument("--out", help="结果 JSON 路径 (默认写入 backtest_data/benchmarks/)")
+    cmp_p = sub.add_parser("compare", help="对比两份测评结果")
+    cmp_p.add_argument("base")
+    cmp_p.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        print(compare_results(args.base, args.new).to_string(index=False))
+    elif args.command == "run":
+        if not 1 <= args.stocks <= 5000 or not 1 <= args.years <= 20:
+            sys.exit("股票数需在 1 ~ 5000 之间，年数需在 1 ~ 20 之间")
+        run_benchmarks(args.stocks, args.years, args.seed, args.sample, args.repeat, args.only, args.out)
+    else:
+        parser.print_help()
@@ -1,10 +1,9 @@
 import os
 import pandas as pd
 import numpy as np
-import akshare as ak
 import datetime
-from tqdm import tqdm
 import time
+from vault_io import write_vault
 
 # 定义存储路径
 DATA_DIR = "backtest_data"
@@ -19,6 +18,7 @@ def get_trading_calendar(start_date="20070101"):
     """
     获取真实的交易日历作为绝对的对齐基准 (Master Calendar)
     """
+    import akshare as ak  # 延迟导入：离线使用本模块的纯计算函数时不需要 akshare
     print("正在获取 A股 交易日历...")
     calendar_df = ak.tool_trade_date_hist_sina()
     calendar_df['trade_date'] = pd.to_datetime(calendar_df['trade_date']).dt.date
@@ -34,6 +34,7 @@ def fetch_stock_history_dual(code, start_date="20070101", end_date=None):
     """
     针对单只股票，分别获取【不复权(Raw)】和【前复权(Qfq)】的数据，并进行横向拼接拼接入库。
     """
+    import akshare as ak
     if end_date is None:
         end_date = datetime.datetime.now().strftime("%Y%m%d")
         
@@ -190,7 +191,7 @@ def build_single_stock_vault(code, master_calendar_df, start_date="20070101"):
     
     # 4. 追加保存入 Vault 目录
     out_path = os.path.join(VAULT_DIR, f"{code}.parquet")
-    final_df.to_parquet(out_path, engine="pyarrow", index=False)
+    write_vault(final_df, out_path)
     print(f" ---> {code} 数据已经成功入库 (包含 {len(final_df)} 个历史交易日，包含停牌)，路径：{out_path}")
     return True
 
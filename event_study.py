@@ -0,0 +1,213 @@
+import os
+import io
+import contextlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import signal_cache
+from strategy_expr import compile_expression, read_vault_columns
+from strategy_runner import load_backtest_frame
+
+DEFAULT_HORIZONS = (1, 5, 10, 20)
+SUMMARY_QUANTILES = (0.05, 0.25, 0.75, 0.95)
+
+
+def growth_index(pct_chg):
+    """
+    交易日序列上的累计对数净值：g[0] = 0，g[i + 1] = Σ log(1 + Pct_Chg_Raw[0..i] / 100)。
+    第 i 个交易日收盘买入、持有 k 个交易日的收益 = expm1(g[i + 1 + k] - g[i + 1])。
+    """
+    return np.concatenate([[0.0], np.cumsum(np.log1p(np.asarray(pct_chg, dtype=float) / 100.0))])
+
+
+def forward_paths(growth, rows, max_horizon):
+    """
+    给定事件所在的交易日行号，返回每个事件之后第 1..max_horizon 个交易日的累计收益 (事件数 x max_horizon)。
+    样本尾部不够 k 天的位置为 NaN。
+    """
+    n_days = len(growth) - 1
+    steps = np.arange(1, max_horizon + 1)
+    idx = rows[:, None] + 1 + steps[None, :]
+    valid = idx <= n_days
+    ends = growth[np.minimum(idx, n_days)]
+    paths = np.expm1(ends - growth[rows + 1][:, None])
+    paths[~valid] = np.nan
+    return paths
+
+
+def study_stock(code, data_path, expr, max_horizon, start_date=None, end_date=None, cooldown=0,
+                use_signal_cache=True):
+    """
+    单票事件研究：找出窗口内所有触发日，计算事件后的逐日累计收益路径，并附带无条件基准的合计量。
+    只在 is_trading 的交易日序列上计数：停牌日既不能触发事件，也不计入持有天数。
+
+    :param cooldown: 同一只股票两次事件之间至少间隔的交易日数 (0 表示每个触发日都算)
+    :return: {"code", "dates", "paths", "base_sum", "base_count", "base_wins"}
+    """
+    schema_columns = read_vault_columns(data_path)
+    expr.validate(schema_columns, context=code)
+    wanted = {'Date', 'is_trading', 'Pct_Chg_Raw'} | set(expr.columns)
+    df, vault_rows = load_backtest_frame(data_path, [c for c in schema_columns if c in wanted],
+                                         start_date=start_date, end_date=end_date)
+
+    if use_signal_cache:
+        signal = signal_cache.get_signal(data_path, expr)[vault_rows]
+    else:
+        signal = expr.evaluate(df).to_numpy().astype(bool)
+
+    trading = df['is_trading'].to_numpy().astype(bool) & df['Pct_Chg_Raw'].notna().to_numpy()
+    dates = df['Date'].to_numpy()[trading]
+    growth = growth_index(df['Pct_Chg_Raw'].to_numpy(dtype=float)[trading])
+    rows = np.flatnonzero(signal[trading])
+
+    if cooldown > 0 and len(rows):
+        kept = [rows[0]]
+        for r in rows[1:].tolist():
+            if r - kept[-1] > cooldown:
+                kept.append(r)
+        rows = np.asarray(kept)
+
+    # 无条件基准：窗口内每个交易日都当作一次“事件”
+    all_paths = forward_paths(growth, np.arange(len(dates)), max_horizon)
+    return {
+        "code": code,
+        "dates": dates[rows],
+        "paths": forward_paths(growth, rows, max_horizon).astype(np.float32),
+        "base_sum": np.nansum(all_paths, axis=0),
+        "base_count": np.sum(~np.isnan(all_paths), axis=0),
+        "base_wins": np.sum(all_paths > 0, axis=0)
+    }
+
+
+def _run_stock(code, data_path, expr, max_horizon, start_date, end_date, cooldown):
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = study_stock(code, data_path, expr, max_horizon, start_date, end_date, cooldown)
+        result["ok"] = True
+        return result
+    except Exception as e:
+        return {"code": code, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+def run_event_study(codes, vault_dir, expression, horizons=DEFAULT_HORIZONS, start_date=None, end_date=None,
+                    cooldown=0, max_workers=1, progress=None):
+    """
+    全 Vault 事件研究：表达式只编译一次，各股票的触发日与前瞻收益路径汇总成一份分布。
+    默认在当前进程串行 (单票只读 3~4 列、信号走缓存，全池也只需数秒)；max_workers > 1 时分发到进程池。
+
+    :param horizons: 需要统计分布的持有期 (交易日)
+    :param progress: 可选回调 progress(已完成数, 总数, 代码)
+    :return: dict，见 summarize_event_study
+    :raises StrategyExpressionError: 表达式语法错误
+    """
+    expr = compile_expression(expression) if not hasattr(expression, "normalized") else expression
+    horizons = sorted(set(int(h) for h in horizons))
+    max_horizon = horizons[-1]
+    tasks = [(code, os.path.join(vault_dir, f"{code}.parquet")) for code in codes]
+    workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+
+    results = []
+    if workers <= 1:
+        for code, data_path in tasks:
+            results.append(_run_stock(code, data_path, expr, max_horizon, start_date, end_date, cooldown))
+            if progress:
+                progress(len(results), len(tasks), code)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_run_stock, code, data_path, expr, max_horizon, start_date, end_date, cooldown): code
+                       for code, data_path in tasks}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append({"code": futures[future], "ok": False, "error": f"{type(e).__name__}: {e}"})
+                if progress:
+                    progress(len(results), len(tasks), futures[future])
+    return summarize_event_study(results, horizons, expr.source)
+
+
+def summarize_event_study(results, horizons, expression=""):
+    """
+    汇总各股票的事件路径：
+      - summary: 每个持有期的事件数、平均 / 中位收益、胜率、分位数、同期无条件基准与超额；
+      - path: 事件后第 1..N 日的平均 / 中位累计收益路径 (与基准路径对照)；
+      - by_year / by_stock: 主持有期 (horizons 里居中的那个) 的逐年、逐股拆分；
+      - events: 事件明细长表；errors: 失败的股票。
+    """
+    ok = [r for r in results if r.get("ok")]
+    errors = [{"股票代码": r["code"], "错误": r["error"]} for r in results if not r.get("ok")]
+    max_horizon = max(horizons)
+    main_h = horizons[len(horizons) // 2]
+
+    paths = np.concatenate([r["paths"] for r in ok]) if ok else np.zeros((0, max_horizon), dtype=np.float32)
+    codes = np.concatenate([np.full(len(r["dates"]), r["code"], dtype=object) for r in ok]) if ok else np.zeros(0, dtype=object)
+    dates = np.concatenate([r["dates"] for r in ok]) if ok else np.zeros(0, dtype="datetime64[ns]")
+    base_sum = np.sum([r["base_sum"] for r in ok], axis=0) if ok else np.zeros(max_horizon)
+    base_count = np.sum([r["base_count"] for r in ok], axis=0) if ok else np.zeros(max_horizon)
+    base_wins = np.sum([r["base_wins"] for r in ok], axis=0) if ok else np.zeros(max_horizon)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        base_mean = base_sum / base_count
+        base_win_rate = base_wins / base_count
+
+    events = pd.DataFrame({"股票代码": codes, "Date": pd.to_datetime(dates)})
+    for h in horizons:
+        events[f"R{h}"] = paths[:, h - 1].astype(float) if len(paths) else np.zeros(0)
+
+    rows = []
+    for h in horizons:
+        r = events[f"R{h}"].dropna()
+        row = {"持有期": f"{h} 日", "事件数": len(r), "平均收益": r.mean(), "中位收益": r.median(),
+               "胜率": (r > 0).mean() if len(r) else np.nan, "标准差": r.std(),
+               "基准平均": base_mean[h - 1], "基准胜率": base_win_rate[h - 1]}
+        for q in SUMMARY_QUANTILES:
+            row[f"P{int(q * 100)}"] = r.quantile(q) if len(r) else np.nan
+        row["超额收益"] = row["平均收益"] - row["基准平均"]
+        rows.append(row)
+    summary = pd.DataFrame(rows)
+
+    with np.errstate(invalid="ignore"):
+        path = pd.DataFrame({
+            "交易日": np.arange(1, max_horizon + 1),
+            "事件平均": np.nanmean(paths, axis=0) if len(paths) else np.full(max_horizon, np.nan),
+            "事件中位": np.nanmedian(paths, axis=0) if len(paths) else np.full(max_horizon, np.nan),
+            "基准平均": base_mean
+        })
+
+    main_col = f"R{main_h}"
+    if len(events):
+        by_year = events.groupby(events["Date"].dt.year)[main_col].agg(
+            事件数="count", 平均收益="mean", 胜率=lambda s: (s.dropna() > 0).mean()).reset_index().rename(columns={"Date": "年份"})
+        by_stock = events.groupby("股票代码")[main_col].agg(
+            事件数="count", 平均收益="mean", 胜率=lambda s: (s.dropna() > 0).mean()).reset_index()
+        by_stock = by_stock.sort_values("平均收益", ascending=False).reset_index(drop=True)
+    else:
+        by_year = pd.DataFrame(columns=["年份", "事件数", "平均收益", "胜率"])
+        by_stock = pd.DataFrame(columns=["股票代码", "事件数", "平均收益", "胜率"])
+
+    return {
+        "expression": expression,
+        "horizons": horizons,
+        "main_horizon": main_h,
+        "summary": summary,
+        "path": path,
+        "by_year": by_year,
+        "by_stock": by_stock,
+        "events": events,
+        "errors": pd.DataFrame(errors),
+        "n_stocks": len(ok)
+    }
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import time
+    vault_dir = "backtest_data/final_vault"
+    if os.path.exists(vault_dir):
+        codes = sorted(f.replace(".parquet", "") for f in os.listdir(vault_dir) if f.endswith(".parquet"))
+        t0 = time.perf_counter()
+        study = run_event_study(codes, vault_dir, "MACD_Golden_Cross == True and Close_Qfq > MA_60")
+        print(f"{study['n_stocks']} 只股票，{len(study['events'])} 个事件，耗时 {time.perf_counter() - t0:.2f}s")
+        print(study["summary"].round(4).to_string())
+        print(study["by_year"].round(4).tail().to_string())
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
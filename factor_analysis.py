@@ -0,0 +1,314 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from strategy_runner import load_backtest_frame
+from event_study import growth_index, forward_paths
+from panel_store import PanelStore
+
+DEFAULT_IC_HORIZONS = (1, 2, 3, 5, 10, 20)
+# 价格水平类的列 (各股之间不可比)，不作为截面因子参与打分
+NON_FACTOR_COLUMNS = {'Open_Raw', 'High_Raw', 'Low_Raw', 'Close_Raw', 'Open_Qfq', 'High_Qfq', 'Low_Qfq', 'Close_Qfq',
+                      'Prev_Close_Raw', 'limit_up', 'limit_down'}
+NON_FACTOR_PREFIXES = ('MA_', 'BOLL_')
+
+
+def numeric_factor_columns(data_path):
+    """某个 Vault 里可做截面分析的数值因子列 (按表结构顺序，剔除价格水平列与布尔列)"""
+    schema = pq.read_schema(data_path)
+    columns = []
+    for name, dtype in zip(schema.names, schema.types):
+        if name in NON_FACTOR_COLUMNS or name.startswith(NON_FACTOR_PREFIXES):
+            continue
+        if str(dtype) in ("double", "float", "int64", "int32"):
+            columns.append(name)
+    return columns
+
+
+class FactorPanel:
+    """
+    日期 x 股票的面板矩阵 (float32，行 = 主日历交易日，列 = 股票代码)。
+    非交易日 (停牌 / 未上市) 一律为 NaN，远期收益只在各股自己的交易日序列上平移。
+    """
+    def __init__(self, dates, codes, factors, forward):
+        self.dates = dates          # DatetimeIndex
+        self.codes = codes          # [代码, ...]
+        self.factors = factors      # {列名: (日期数, 股票数) 矩阵}
+        self.forward = forward      # {持有期: (日期数, 股票数) 远期收益矩阵}
+        # 最近一次用到的样本掩码及其对应的远期收益截面排名：
+        # 大部分因子在所有交易日都有值，掩码相同，远期收益就不必每个因子重新排名
+        self._forward_rank_cache = (None, {})
+
+    def forward_ranks(self, valid, horizon):
+        """在样本掩码 valid 内对远期收益逐日排名 (同一掩码只排一次)"""
+        key = hashlib.blake2b(np.packbits(valid).tobytes(), digest_size=16).digest()
+        if self._forward_rank_cache[0] != key:
+            self._forward_rank_cache = (key, {})
+        cache = self._forward_rank_cache[1]
+        if horizon not in cache:
+            cache[horizon] = rank_rows(np.where(valid, self.forward[horizon], np.nan)).astype(np.float32)
+        return cache[horizon]
+
+    @property
+    def nbytes(self):
+        return sum(m.nbytes for m in self.factors.values()) + sum(m.nbytes for m in self.forward.values())
+
+
+def load_panel(codes, vault_dir, factor_columns, horizons=(), start_date=None, end_date=None,
+               calendar=None, progress=None):
+    """
+    逐只读取 Vault (只读需要的列)，拼成日期 x 股票面板。
+    :param horizons: 需要的远期收益持有期 (为空则不算远期收益，只拼因子列)
+    :param calendar: 指定主日历 (分批加载因子时沿用第一批的日历，保证各批矩阵逐行对齐)；默认取所有股票交易日的并集
+    :param progress: 可选回调 progress(已完成数, 总数, 代码)
+    """
+    horizons = sorted(set(int(h) for h in horizons))
+    frames = []
+    for k, code in enumerate(codes):
+        data_path = os.path.join(vault_dir, f"{code}.parquet")
+        schema = set(pq.read_schema(data_path).names)
+        columns = [c for c in ['is_trading', 'Pct_Chg_Raw'] + list(factor_columns) if c in schema]
+        df, _ = load_backtest_frame(data_path, list(dict.fromkeys(columns)), start_date=start_date, end_date=end_date)
+        df = df[df['is_trading'].astype(bool) & df['Pct_Chg_Raw'].notna()].reset_index(drop=True)
+        entry = {"code": code, "dates": df['Date'].to_numpy(dtype="datetime64[ns]"),
+                 "factors": {c: df[c].to_numpy(dtype=np.float32) for c in factor_columns if c in df.columns}}
+        if horizons:
+            paths = forward_paths(growth_index(df['Pct_Chg_Raw'].to_numpy(dtype=float)), np.arange(len(df)), horizons[-1])
+            entry["forward"] = {h: paths[:, h - 1].astype(np.float32) for h in horizons}
+        frames.append(entry)
+        if progress:
+            progress(k + 1, len(codes), code)
+
+    if calendar is None:
+        all_dates = [f["dates"] for f in frames if len(f["dates"])]
+        calendar = pd.DatetimeIndex(np.unique(np.concatenate(all_dates)) if all_dates else np.array([], dtype="datetime64[ns]"))
+    cal = calendar.to_numpy(dtype="datetime64[ns]")
+    shape = (len(cal), len(codes))
+
+    factors = {c: np.full(shape, np.nan, dtype=np.float32) for c in factor_columns}
+    forward = {h: np.full(shape, np.nan, dtype=np.float32) for h in horizons}
+    for j, f in enumerate(frames):
+        rows = np.searchsorted(cal, f["dates"])
+        ok = (rows < len(cal))
+        ok[ok] &= cal[rows[ok]] == f["dates"][ok]
+        rows = rows[ok]
+        for c, values in f["factors"].items():
+            factors[c][rows, j] = values[ok]
+        for h, values in f.get("forward", {}).items():
+            forward[h][rows, j] = values[ok]
+    return FactorPanel(calendar, list(codes), factors, forward)
+
+
+def load_panel_from_store(store, codes, factor_columns, horizons=(), start_date=None, end_date=None, calendar=None):
+    """
+    与 load_panel 同口径，但直接从面板库 (panel_store.PanelStore) 一次读出二维数组，不再逐只打开 Vault。
+    远期收益仍按每只股票自己的交易日序列计算。
+    """
+    horizons = sorted(set(int(h) for h in horizons))
+    columns = [c for c in factor_columns if c in store.columns]
+    data = store.read(list(dict.fromkeys(['is_trading', 'Pct_Chg_Raw'] + columns)), start_date, end_date,
+                      codes=codes, dtype=np.float32)
+    trading = data['is_trading'] & ~np.isnan(data['Pct_Chg_Raw'])
+    if calendar is None:
+        calendar = data.dates[trading.any(axis=1)]
+    src = data.dates.get_indexer(calendar)
+    shape = (len(calendar), len(codes))
+
+    def take_rows(matrix):
+        out = np.full(shape, np.nan, dtype=np.float32)
+        out[src >= 0] = matrix[src[src >= 0]]
+        return out
+
+    factors = {c: take_rows(np.where(trading, data[c], np.nan)) if c in data.values else np.full(shape, np.nan, dtype=np.float32)
+               for c in factor_columns}
+    forward = {}
+    if horizons:
+        full = {h: np.full(trading.shape, np.nan, dtype=np.float32) for h in horizons}
+        pct = data['Pct_Chg_Raw'].astype(float)
+        for j in range(len(codes)):
+            rows = np.flatnonzero(trading[:, j])
+            paths = forward_paths(growth_index(pct[rows, j]), np.arange(len(rows)), horizons[-1])
+            for h in horizons:
+                full[h][rows, j] = paths[:, h - 1]
+        forward = {h: take_rows(m) for h, m in full.items()}
+    return FactorPanel(calendar, list(codes), factors, forward)
+
+
+def rank_rows(matrix):
+    """逐行 (逐日) 截面排名，NaN 保持为 NaN，并列取平均名次"""
+    return pd.DataFrame(matrix).rank(axis=1, method="average").to_numpy(dtype=np.float64)
+
+
+def rowwise_corr(x, y, min_count):
+    """逐行相关系数 (两矩阵 NaN 位置一致)，样本数不足 min_count 的行为 NaN"""
+    valid = ~np.isnan(x)
+    n = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xc = np.where(valid, x, 0.0)
+        yc = np.where(valid, y, 0.0)
+        xc -= (xc.sum(axis=1) / n)[:, None]
+        yc -= (yc.sum(axis=1) / n)[:, None]
+        xc[~valid] = 0.0
+        yc[~valid] = 0.0
+        corr = np.einsum("ij,ij->i", xc, yc) / np.sqrt(np.einsum("ij,ij->i", xc, xc) * np.einsum("ij,ij->i", yc, yc))
+    corr[n < min_count] = np.nan
+    return corr
+
+
+def quantile_buckets(ranks, n_quantiles, min_stocks):
+    """逐日按截面排名分成 n_quantiles 层 (1 = 因子最小，n = 最大)，无效或当日样本太少记 0"""
+    counts = np.sum(~np.isnan(ranks), axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct = (ranks - 0.5) / counts
+    buckets = np.where(np.isnan(pct), 0, np.floor(pct * n_quantiles) + 1).astype(np.int8)
+    buckets[(counts[:, 0] < max(min_stocks, n_quantiles)), :] = 0
+    return buckets
+
+
+def _bucket_means(buckets, values, n_quantiles):
+    """每天每层的平均值 (日期数 x 层数)，一次 bincount 完成全部分组"""
+    n_days = len(values)
+    mask = (buckets > 0) & ~np.isnan(values)
+    slots = (np.arange(n_days)[:, None] * n_quantiles + buckets - 1)[mask]
+    sums = np.bincount(slots, weights=values[mask], minlength=n_days * n_quantiles)
+    counts = np.bincount(slots, minlength=n_days * n_quantiles)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(n_days, n_quantiles)
+
+
+def _bucket_turnover(buckets, q):
+    """某一层的日换手：今天在该层、昨天不在该层的股票占今天该层股票数的比例"""
+    now = buckets[1:] == q
+    prev = buckets[:-1] == q
+    size = now.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        turnover = 1 - (now & prev).sum(axis=1) / size
+    turnover[(size == 0) | (prev.sum(axis=1) == 0)] = np.nan
+    return turnover
+
+
+def analyze_factor(panel, column, horizons=DEFAULT_IC_HORIZONS, n_quantiles=5, min_stocks=30):
+    """
+    单因子截面体检 (全部是日期 x 股票矩阵运算，不逐日循环)：
+      - 各持有期的逐日 Rank IC 及其均值 / ICIR / 胜率 / t 值 (IC 衰减)；
+      - 逐日分层：各层在各持有期的平均收益，1 日收益逐日复利得到的分层净值与多空 (顶层 - 底层) 净值；
+      - 顶层 / 底层的日换手，因子排名的日间自相关。
+    """
+    horizons = [h for h in horizons if h in panel.forward]
+    # 与 alphalens 一致：只保留因子与全部持有期远期收益都有效的 (日期, 股票)，
+    # 各持有期共用同一个样本，因子只需排名一次，IC 衰减也是在同一批股票上比较
+    valid = ~np.isnan(panel.factors[column])
+    for h in horizons:
+        valid &= ~np.isnan(panel.forward[h])
+    ranks = rank_rows(np.where(valid, panel.factors[column], np.nan))
+
+    ic = pd.DataFrame({h: rowwise_corr(ranks, panel.forward_ranks(valid, h), min_stocks) for h in horizons},
+                      index=panel.dates)
+    ic_rows = []
+    for h in horizons:
+        s = ic[h].dropna()
+        std = s.std()
+        ic_rows.append({
+            "持有期": h, "IC均值": s.mean(), "IC标准差": std,
+            "ICIR": s.mean() / std if std and std > 0 else np.nan,
+            "IC>0占比": (s > 0).mean() if len(s) else np.nan,
+            "t值": s.mean() / std * np.sqrt(len(s)) if std and std > 0 else np.nan,
+            "有效天数": len(s)
+        })
+    ic_summary = pd.DataFrame(ic_rows)
+
+    buckets = quantile_buckets(ranks, n_quantiles, min_stocks)
+    labels = [f"Q{q}" for q in range(1, n_quantiles + 1)]
+    quantile_returns = pd.DataFrame(
+        {h: pd.DataFrame(_bucket_means(buckets, panel.forward[h], n_quantiles)).mean().to_numpy() for h in horizons},
+        index=labels).T
+    quantile_returns.index.name = "持有期"
+
+    cum_quantile = pd.DataFrame(index=panel.dates, columns=labels + ["多空"], dtype=float)
+    if 1 in panel.forward:
+        daily = _bucket_means(buckets, panel.forward[1], n_quantiles)
+        # 信号日 t 收盘建仓，收益落在 t+1；逐日复利 (缺失记 0)
+        cum_quantile[labels] = np.cumprod(1 + np.nan_to_num(daily), axis=0)
+        cum_quantile["多空"] = np.cumprod(1 + np.nan_to_num(daily[:, -1] - daily[:, 0]))
+
+    turnover = pd.Series({f"Q{q}": pd.Series(_bucket_turnover(buckets, q)).mean() if len(buckets) > 1 else np.nan
+                          for q in (1, n_quantiles)})
+    if len(ranks) > 1:
+        both = ~np.isnan(ranks[1:]) & ~np.isnan(ranks[:-1])
+        autocorr = float(pd.Series(rowwise_corr(np.where(both, ranks[1:], np.nan),
+                                                 np.where(both, ranks[:-1], np.nan), min_stocks)).mean())
+    else:
+        autocorr = np.nan
+
+    return {
+        "column": column, "ic": ic, "ic_summary": ic_summary, "quantile_returns": quantile_returns,
+        "cum_quantile": cum_quantile, "turnover": turnover, "rank_autocorr": autocorr
+    }
+
+
+def _scorecard_row(result, main_horizon):
+    s = result["ic_summary"].set_index("持有期")
+    row = {"因子": result["column"]}
+    if main_horizon in s.index:
+        row.update({"IC均值": s.at[main_horizon, "IC均值"], "ICIR": s.at[main_horizon, "ICIR"],
+                    "IC>0占比": s.at[main_horizon, "IC>0占比"], "t值": s.at[main_horizon, "t值"]})
+    cum = result["cum_quantile"]["多空"].dropna()
+    if len(cum) > 1:
+        row["多空年化"] = cum.iloc[-1] ** (250 / len(cum)) - 1
+    row["顶层换手"] = result["turnover"].iloc[-1]
+    row["排名自相关"] = result["rank_autocorr"]
+    return row
+
+
+def score_factors(codes, vault_dir, factor_columns=None, horizons=DEFAULT_IC_HORIZONS, n_quantiles=5,
+                  min_stocks=30, start_date=None, end_date=None, batch_size=8, main_horizon=5, panel_dir=None,
+                  progress=None):
+    """
+    批量给一组因子打分。远期收益面板只建一次；因子列按 batch_size 分批加载，
+    常驻内存约为 (持有期数 + batch_size) 个日期 x 股票的 float32 矩阵。
+    :param factor_columns: 默认取第一只股票 Vault 里的全部数值因子列 (numeric_factor_columns)
+    :param panel_dir: 面板库目录；给定且存在时直接从面板库读二维数组，否则逐只读取 Vault
+    :return: (按 |ICIR| 排序的打分表, {因子: analyze_factor 明细})
+    """
+    if factor_columns is None:
+        factor_columns = numeric_factor_columns(os.path.join(vault_dir, f"{codes[0]}.parquet"))
+    factor_columns = list(factor_columns)
+    batches = [factor_columns[i:i + batch_size] for i in range(0, len(factor_columns), batch_size)] or [[]]
+
+    if panel_dir and PanelStore.exists(panel_dir):
+        store = PanelStore(panel_dir)
+        loader = lambda columns, **kw: load_panel_from_store(store, codes, columns, start_date=start_date,
+                                                             end_date=end_date, **kw)
+    else:
+        loader = lambda columns, **kw: load_panel(codes, vault_dir, columns, start_date=start_date,
+                                                  end_date=end_date, progress=progress, **kw)
+
+    panel = loader(batches[0], horizons=horizons)
+    results = {}
+    for b, batch in enumerate(batches):
+        if b > 0:
+            panel.factors = loader(batch, calendar=panel.dates).factors
+        for column in batch:
+            results[column] = analyze_factor(panel, column, horizons, n_quantiles, min_stocks)
+
+    scorecard = pd.DataFrame([_scorecard_row(r, main_horizon) for r in results.values()])
+    if "ICIR" in scorecard.columns:
+        scorecard = scorecard.reindex(scorecard["ICIR"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+    return scorecard, results
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import time
+    vault_dir = "backtest_data/final_vault"
+    if os.path.exists(vault_dir):
+        codes = sorted(f.replace(".parquet", "") for f in os.listdir(vault_dir) if f.endswith(".parquet"))
+        t0 = time.perf_counter()
+        scorecard, results = score_factors(codes, vault_dir, min_stocks=5, start_date="2012-01-01")
+        print(f"{len(results)} 个因子 x {len(codes)} 只股票，耗时 {time.perf_counter() - t0:.2f}s")
+        print(scorecard.round(4).to_string())
+        print(results["BIAS_12"]["ic_summary"].round(4).to_string())
+        print(results["BIAS_12"]["quantile_returns"].round(4).to_string())
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
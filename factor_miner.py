@@ -0,0 +1,266 @@
+import os
+import numpy as np
+import pandas as pd
+from strategy_expr import compile_expression, read_vault_columns
+from strategy_runner import load_backtest_frame
+from event_study import growth_index, forward_paths
+
+
+def _grid(family, label, expr, values):
+    return [{"family": family, "name": label.format(v), "expr": expr.format(v)} for v in values]
+
+
+# 专业回测舱 (第 7 页) 买入条件库的可挖掘版本：每个勾选项展开成几档阈值。
+# 同一 family 的几档阈值互为包含关系 (如 RSI<30 与 RSI<40)，枚举组合时同族最多选一个。
+CONDITION_LIBRARY = (
+    _grid("MA", "收盘站上{}", "Close_Qfq > {}", ["MA_5", "MA_10", "MA_20", "MA_60", "MA_120", "MA_250"])
+    + [{"family": "MA_Bull", "name": "经典多头排列", "expr": "MA_5 > MA_10 and MA_10 > MA_20 and MA_20 > MA_60"}]
+    + _grid("BIAS_12", "BIAS_12<{}", "BIAS_12 < {}", [-5, -10, -15])
+    + _grid("MACD", "MACD柱>{}", "MACD_Hist > {}", [0])
+    + [{"family": "MACD_GC", "name": "MACD金叉", "expr": "MACD_Golden_Cross == True"}]
+    + _grid("KDJ", "KDJ超卖(J<{})", "KDJ_J < {} and KDJ_K < 30 and KDJ_D < 30", [0, 20])
+    + _grid("RSI", "RSI<{}", "RSI_14 < {}", [20, 30, 40])
+    + [{"family": "BOLL", "name": "触及布林下轨", "expr": "Close_Qfq <= BOLL_Lower"},
+       {"family": "Vol_Shrink", "name": "百日地量", "expr": "Vol_Shrink_20D == True"},
+       {"family": "Limit_Down", "name": "近5日无跌停", "expr": "Limit_Down_Count_5 == 0"}]
+    + _grid("Turnover", "换手Z>{}", "Turnover_ZScore > {}", [1, 1.5, 2])
+    + _grid("Vol_Ratio", "5日量比>{}", "Vol_Ratio_5D > {}", [1.5, 2, 3])
+    + _grid("Limit_Up", "5日涨停≥{}", "Limit_Up_Count_5 >= {}", [1, 2])
+    + _grid("Seal", "封单强度≥{}", "Limit_Up_Seal_Ratio >= {}", [1])
+    + [{"family": "MV", "name": f"市值<{v}亿", "expr": f"Total_MV <= {v * 100000000}"} for v in (100, 500, 2000)]
+    + _grid("PE", "PE分位<{}", "PE_Percentile_3Y < {}", [20, 30, 50])
+    + _grid("PB", "PB<{}", "PB < {}", [1.5, 3])
+    + _grid("ROE", "ROE>{}", "ROE > {}", [10, 15, 20])
+    + _grid("NP_YOY", "净利YOY>{}", "NetProfit_YOY > {}", [0, 20, 50])
+    + _grid("DNP_YOY", "扣非YOY>{}", "DeductedNetProfit_YOY > {}", [0, 20, 50])
+    + _grid("REV_YOY", "营收YOY>{}", "Revenue_YOY > {}", [0, 20, 50])
+)
+
+# 远期收益的定点量化：截断到 [-RETURN_CLIP, RETURN_CLIP]，按 1bp 取整后拆成 RETURN_BITS 个位平面。
+# 组合命中样本的收益和 = Σ 2^b * popcount(组合位图 & 第 b 个位平面)，全程只有位运算。
+RETURN_CLIP = 1.0
+RETURN_SCALE = 10000
+RETURN_BITS = int(2 * RETURN_CLIP * RETURN_SCALE).bit_length()
+
+RANK_OPTIONS = {"z_score": "显著性 (Z)", "mean_return": "平均远期收益", "win_rate": "胜率"}
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount_rows(words):
+    """按最后一维统计置位数 (uint64 位图)，numpy>=2 用原生 bitwise_count，否则查 256 表"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def pack_bits(mask):
+    """布尔数组 -> uint64 位图 (小端位序，尾部补零)"""
+    packed = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    pad = (-len(packed)) % 8
+    if pad:
+        packed = np.concatenate([packed, np.zeros(pad, dtype=np.uint8)])
+    return packed.view(np.uint64)
+
+
+def unpack_bits(words, n_bits):
+    """uint64 位图 -> 布尔数组 (截掉尾部补零)"""
+    return np.unpackbits(words.view(np.uint8), bitorder="little", count=n_bits).astype(bool)
+
+
+class ConditionBitsets:
+    """
+    全 Vault 的“股票-交易日”样本轴上，每个条件一行位图 (每个条件在每只股票上只求值一次)。
+    样本按股票依次拼接，只保留有完整远期收益的交易日。
+    """
+    def __init__(self, conditions, bits, returns, return_planes, positive, codes, offsets, horizon):
+        self.conditions = conditions          # [{"family", "name", "expr"}, ...]
+        self.bits = bits                      # (条件数, 字数) uint64
+        self.returns = returns                # 每个样本的远期收益 (float32)，只给排名靠前的组合算精确统计
+        self.return_planes = return_planes    # (RETURN_BITS, 字数) 定点收益的位平面
+        self.positive = positive              # 远期收益 > 0 的位图
+        self.codes = codes
+        self.offsets = offsets                # 每只股票样本的起始位置 (长度 = 股票数 + 1)
+        self.horizon = horizon
+        self.n_samples = len(returns)
+        self.families = np.array([c["family"] for c in conditions])
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes + self.return_planes.nbytes + self.positive.nbytes + self.returns.nbytes
+
+
+def build_condition_bitsets(codes, vault_dir, conditions=CONDITION_LIBRARY, horizon=10,
+                            start_date=None, end_date=None, progress=None):
+    """
+    逐只读取 Vault，把每个条件求值一次并压成位图，同时算出每个交易日买入、持有 horizon 个交易日的远期收益。
+    远期收益 = 信号日收盘买入后 horizon 个交易日的真实涨跌幅 Pct_Chg_Raw 复利 (口径同基准收益，含除权修正)，
+    只在交易日序列上平移，停牌日不计入持有期。
+    Vault 缺少某条件引用的字段时，该条件在这只股票上视为不触发。
+
+    :param progress: 可选回调 progress(已完成数, 总数, 代码)
+    :return: ConditionBitsets
+    """
+    exprs = [compile_expression(c["expr"]) for c in conditions]
+    wanted = set(['Pct_Chg_Raw', 'is_trading']).union(*(e.columns for e in exprs))
+
+    masks = [[] for _ in conditions]
+    returns = []
+    kept_codes, offsets = [], [0]
+    for k, code in enumerate(codes):
+        data_path = os.path.join(vault_dir, f"{code}.parquet")
+        schema = read_vault_columns(data_path)
+        df, _ = load_backtest_frame(data_path, [c for c in schema if c in wanted],
+                                    start_date=start_date, end_date=end_date)
+        df = df[df['is_trading'].astype(bool) & df['Pct_Chg_Raw'].notna()].reset_index(drop=True)
+        growth = growth_index(df['Pct_Chg_Raw'].to_numpy(dtype=float))
+        fwd = forward_paths(growth, np.arange(len(df)), horizon)[:, -1]
+        valid = ~np.isnan(fwd)
+        if valid.any():
+            df = df[valid].reset_index(drop=True)
+            for i, expr in enumerate(exprs):
+                if all(c in df.columns for c in expr.columns):
+                    masks[i].append(expr.evaluate(df).to_numpy(dtype=bool, na_value=False))
+                else:
+                    masks[i].append(np.zeros(len(df), dtype=bool))
+            returns.append(fwd[valid])
+            kept_codes.append(code)
+            offsets.append(offsets[-1] + int(valid.sum()))
+        if progress:
+            progress(k + 1, len(codes), code)
+
+    all_returns = np.concatenate(returns) if returns else np.zeros(0)
+    bits = np.stack([pack_bits(np.concatenate(m) if m else np.zeros(0, dtype=bool)) for m in masks])
+
+    # 定点收益位平面：q = round((r + CLIP) * SCALE) ∈ [0, 2 * CLIP * SCALE]
+    q = np.rint((np.clip(all_returns, -RETURN_CLIP, RETURN_CLIP) + RETURN_CLIP) * RETURN_SCALE).astype(np.int64)
+    planes = np.stack([pack_bits((q >> b) & 1) for b in range(RETURN_BITS)])
+
+    return ConditionBitsets(list(conditions), bits, all_returns.astype(np.float32), planes,
+                            pack_bits(all_returns > 0), kept_codes, np.array(offsets), horizon)
+
+
+def _children_stats(children, bitsets, batch_bytes=64 * 1024 * 1024):
+    """一批组合位图的胜场数与定点收益和 (分批做 组合 x 位平面 的按位与，控制临时内存)"""
+    n_words = children.shape[1]
+    per_row = (RETURN_BITS + 1) * n_words * 8
+    step = max(1, batch_bytes // max(per_row, 1))
+    weights = (1 << np.arange(RETURN_BITS, dtype=np.int64))
+    wins = np.empty(len(children), dtype=np.int64)
+    sums = np.empty(len(children), dtype=np.int64)
+    for a in range(0, len(children), step):
+        block = children[a:a + step]
+        wins[a:a + step] = popcount_rows(block & bitsets.positive)
+        plane_counts = popcount_rows(block[:, None, :] & bitsets.return_planes[None, :, :])
+        sums[a:a + step] = plane_counts @ weights
+    return wins, sums
+
+
+def mine_combinations(bitsets, max_depth=3, min_hits=30, top_n=50, rank_by="z_score"):
+    """
+    枚举所有深度 ≤ max_depth 的 AND 组合 (同族条件不同时出现)：
+      - 组合位图 = 父组合位图 & 新条件位图，一个父节点的全部子组合一次向量化算完；
+      - 命中数 < min_hits 的组合直接剪枝，其所有超集也不再展开 (AND 只会让命中数变少)；
+      - 幸存组合的胜率与平均远期收益全部由位图 popcount 得出，不做任何逐组合回测。
+
+    :param rank_by: RANK_OPTIONS 中的键；z_score = (组合平均收益 - 全样本平均) / 全样本标准差 * sqrt(命中数)
+    :return: (排名靠前的 top_n 个组合, 统计信息 dict)
+    """
+    n = bitsets.n_samples
+    if n == 0:
+        return pd.DataFrame(), {"evaluated": 0, "survived": 0, "samples": 0}
+    base_mean = float(bitsets.returns.mean())
+    base_std = float(bitsets.returns.std()) or 1.0
+    families = bitsets.families
+    n_conds = len(families)
+
+    combos, hits_all, wins_all, sums_all = [], [], [], []
+    evaluated = 0
+
+    def expand(combo, parent, start, used):
+        nonlocal evaluated
+        cand = np.array([j for j in range(start, n_conds) if families[j] not in used], dtype=np.int64)
+        if len(cand) == 0:
+            return
+        children = bitsets.bits[cand] if parent is None else bitsets.bits[cand] & parent
+        hits = popcount_rows(children)
+        evaluated += len(cand)
+        keep = hits >= min_hits
+        if not keep.any():
+            return
+        cand, children, hits = cand[keep], children[keep], hits[keep]
+        wins, sums = _children_stats(children, bitsets)
+        for j, h, w, s in zip(cand.tolist(), hits.tolist(), wins.tolist(), sums.tolist()):
+            combos.append(combo + (j,))
+            hits_all.append(h)
+            wins_all.append(w)
+            sums_all.append(s)
+        if len(combo) + 1 < max_depth:
+            for row, j in enumerate(cand.tolist()):
+                expand(combo + (j,), children[row], j + 1, used | {families[j]})
+
+    expand((), None, 0, frozenset())
+
+    stats = {"evaluated": evaluated, "survived": len(combos), "samples": n,
+             "base_mean": base_mean, "base_win_rate": float((bitsets.returns > 0).mean())}
+    if not combos:
+        return pd.DataFrame(), stats
+
+    hits = np.array(hits_all, dtype=float)
+    mean = np.array(sums_all, dtype=float) / hits / RETURN_SCALE - RETURN_CLIP
+    win_rate = np.array(wins_all, dtype=float) / hits
+    z = (mean - base_mean) / base_std * np.sqrt(hits)
+    score = {"z_score": z, "mean_return": mean, "win_rate": win_rate}[rank_by]
+    top = np.argsort(-score, kind="stable")[:top_n]
+
+    rows = []
+    for idx in top.tolist():
+        combo = combos[idx]
+        detail = combination_detail(bitsets, combo)
+        rows.append({
+            "组合": " + ".join(bitsets.conditions[j]["name"] for j in combo),
+            "条件数": len(combo),
+            "触发次数": int(hits[idx]),
+            "覆盖股票数": detail["stocks"],
+            "胜率": win_rate[idx],
+            "平均收益": detail["mean"],
+            "中位收益": detail["median"],
+            "超额收益": detail["mean"] - base_mean,
+            "显著性(Z)": z[idx],
+            "买入表达式": " and ".join(f"({bitsets.conditions[j]['expr']})" for j in combo)
+        })
+    return pd.DataFrame(rows), stats
+
+
+def combination_detail(bitsets, combo):
+    """对单个组合解包位图，给出精确的远期收益统计 (只对排名靠前的少量组合调用)"""
+    words = bitsets.bits[combo[0]].copy()
+    for j in combo[1:]:
+        words &= bitsets.bits[j]
+    mask = unpack_bits(words, bitsets.n_samples)
+    r = bitsets.returns[mask].astype(float)
+    stock_hits = np.add.reduceat(mask, bitsets.offsets[:-1]) if len(bitsets.codes) else np.zeros(0)
+    return {
+        "hits": int(mask.sum()),
+        "mean": float(r.mean()) if len(r) else 0.0,
+        "median": float(np.median(r)) if len(r) else 0.0,
+        "std": float(r.std()) if len(r) else 0.0,
+        "stocks": int((stock_hits > 0).sum())
+    }
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import time
+    vault_dir = "backtest_data/final_vault"
+    if os.path.exists(vault_dir):
+        codes = sorted(f.replace(".parquet", "") for f in os.listdir(vault_dir) if f.endswith(".parquet"))
+        t0 = time.perf_counter()
+        bs = build_condition_bitsets(codes, vault_dir, horizon=10)
+        t1 = time.perf_counter()
+        print(f"{len(bs.conditions)} 个条件 x {bs.n_samples:,} 个样本，位图 {bs.nbytes / 1024 / 1024:.1f} MB，构建耗时 {t1 - t0:.2f}s")
+        top, stats = mine_combinations(bs, max_depth=4, min_hits=50, top_n=15)
+        print(f"枚举 {stats['evaluated']:,} 个组合，幸存 {stats['survived']:,} 个，耗时 {time.perf_counter() - t1:.2f}s")
+        print(top.drop(columns=["买入表达式"]).to_string())
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
@@ -1,20 +1,133 @@
 import os
 import pandas as pd
 import numpy as np
-import akshare as ak
 import warnings
 import time
+from signal_cache import invalidate_vault
+from vault_io import write_vault
+from panel_store import build_panel_store
 warnings.filterwarnings('ignore')
 
 SUPER_VAULT_DIR = "backtest_data/super_vault"
 FUNDAMENTAL_VAULT_DIR = "backtest_data/final_vault"
 os.makedirs(FUNDAMENTAL_VAULT_DIR, exist_ok=True)
 
+def merge_valuation(df, val_df):
+    """
+    把 stock_value_em 原始格式的每日估值表 (数据日期 / PE(TTM) / 市净率 / 总市值) 按 Date 左连接到主表，
+    并衍生 PE_TTM 的 3 年滚动分位。纯本地计算，不访问网络。
+    """
+    if not val_df.empty:
+        val_df['Date'] = pd.to_datetime(val_df['数据日期'])
+        # 提取有用列并重命名
+        val_cols_rename = {
+            'PE(TTM)': 'PE_TTM',
+            '市净率': 'PB',
+            '总市值': 'Total_MV',       # 总市值
+        }
+        # akshare 有些版本列名会有中英文混杂，这里做防御性提取
+        available_cols = [c for c in val_cols_rename.keys() if c in val_df.columns]
+        val_df = val_df[['Date'] + available_cols].rename(columns=val_cols_rename)
+        
+        # 衍生因子: PE 历史分位数 (PE_Percentile) 
+        # 这里的计算要求用过去3年的滚动数据求分位，为了性能和数据完整性，我们直接算全部历史的滚动百分位
+        if 'PE_TTM' in val_df.columns:
+            # 滚动计算过去 750个交易日 (约3年) 的 PE分位数
+            val_df['PE_Percentile_3Y'] = val_df['PE_TTM'].rolling(window=750, min_periods=250).apply(
+                lambda x: (pd.Series(x).rank(pct=True).iloc[-1]) * 100, raw=False
+            )
+        
+        # 使用 left join 基于 Date 拼接到传进来的主表 df 上
+        df = pd.merge(df, val_df, on='Date', how='left')
+    return df
+
+def merge_financial_reports(df, fin_df):
+    """
+    把 stock_financial_abstract_ths 原始格式的报告期财务摘要，按保守公告日 as-of 对齐到主表的每一天。
+    纯本地计算，不访问网络。
+    """
+    if not fin_df.empty and '报告期' in fin_df.columns:
+        # 数据清洗：很多列名叫'净资产收益率'，带有百分号
+        # 我们需要提取：报告期, 净资产收益率, 净利润同比增长率, 营业总收入同比增长率
+        # 但这些字段没有披露日期(公告日)，只有报告期(比如 3-31, 6-30)，
+        # 真实 A股 中，一季报最晚在4月30日，中报最晚在8月31日，三季报最晚在10月31日，年报最晚在次年4月30日公布。
+        # 为了防止未来函数，如果我们拿不到真实的精确公告日，我们必须采取【最保守的极限推迟法 (Worst-Case Delay)】
+        
+        fin_df['Report_Date'] = pd.to_datetime(fin_df['报告期'])
+        
+        def get_conservative_announce_date(report_date):
+            # Q1 (3-31) -> 必须等到 4-30 才认为财报已全市场公开可用
+            if report_date.month == 3:
+                 return report_date.replace(month=4, day=30)
+            # Q2 (6-30) -> 必须等到 8-31 
+            elif report_date.month == 6:
+                 return report_date.replace(month=8, day=31)
+            # Q3 (9-30) -> 必须等到 10-31
+            elif report_date.month == 9:
+                 return report_date.replace(month=10, day=31)
+            # Q4/年报 (12-31) -> A股年报最晚 4-30
+            elif report_date.month == 12:
+                 return report_date.replace(year=report_date.year+1, month=4, day=30)
+            return report_date
+            
+        fin_df['Announce_Date'] = fin_df['Report_Date'].apply(get_conservative_announce_date)
+        # 因为停牌或周末的原因，财报公告日不一定是交易日，我们需要将它和我们大表的 Date 对齐。
+        
+        # 清洗字符串数字 (例如去除 "15.34%" 中的 % 并转 float)
+        def clean_pct(val):
+            if isinstance(val, str):
+                if val == '--' or val == '': return np.nan
+                return float(val.replace('%', ''))
+            return float(val)
+
+        # 提取指标
+        target_metrics = {}
+        if '净资产收益率' in fin_df.columns:
+            target_metrics['ROE'] = fin_df['净资产收益率'].apply(clean_pct)
+        if '净利润同比增长率' in fin_df.columns:
+            target_metrics['NetProfit_YOY'] = fin_df['净利润同比增长率'].apply(clean_pct)
+        if '扣非净利润同比增长率' in fin_df.columns:
+            target_metrics['DeductedNetProfit_YOY'] = fin_df['扣非净利润同比增长率'].apply(clean_pct)
+        if '营业总收入同比增长率' in fin_df.columns:
+            target_metrics['Revenue_YOY'] = fin_df['营业总收入同比增长率'].apply(clean_pct)
+        if '资产负债率' in fin_df.columns:
+            target_metrics['Debt_Ratio'] = fin_df['资产负债率'].apply(clean_pct)
+
+        fin_metrics_df = pd.DataFrame(target_metrics)
+        fin_metrics_df['Announce_Date'] = fin_df['Announce_Date']
+        
+        # 排序并清除重复的公告日期 (如果有财报更正等情况)
+        fin_metrics_df = fin_metrics_df.sort_values('Announce_Date').drop_duplicates(subset=['Announce_Date'], keep='last')
+        
+        # ---- 绝杀：As-of Merge (基于时间线的安全对齐) ----
+        # 我们拿主表 df(每一天) 去匹配 fin_metrics_df 里在这一天之前（含这一天）所发布的【最近一份报表】
+        # 这个操作在 pandas 叫 merge_asof，是用来做量化的绝对神器，完美断绝任何时空穿越
+        
+        # 提取 df 里已有的日期列
+        df_dates = df[['Date']].sort_values('Date')
+        
+        # 用 merge_asof 抓取最近的财报
+        asof_df = pd.merge_asof(
+            df_dates, 
+            fin_metrics_df.dropna(subset=['Announce_Date']).sort_values('Announce_Date'), 
+            left_on='Date', 
+            right_on='Announce_Date', 
+            direction='backward' # 意味着：对于任意一天，向后倒退去寻找最近的一次发布日期的数据
+        )
+        # 将抓出来的财报列并入主 df
+        for col in target_metrics.keys():
+             if col in asof_df.columns:
+                 df[col] = asof_df[col]
+                 
+    return df
+
 def fetch_and_merge_fundamentals(df, code):
     """
     获取单只股票的财务和估值指标 (D表)，并通过严谨的 Announcement Date 映射方法，
     与已经包含C表指标的日线大表无缝对接！
+    (网络拉取在这里，合并逻辑在 merge_valuation / merge_financial_reports，可离线复用)
     """
+    import akshare as ak  # 延迟导入：只有真正联网拉数时才需要 akshare
     print(f"    --> 正在拉取 [{code}] 估值指标库...")
     
     # 策略 1. 每日估值指标 (PE, PB, 总市值, 流通市值等)
@@ -22,28 +135,7 @@ def fetch_and_merge_fundamentals(df, code):
     # 包含：pe_ttm, pb, total_mv, dv_ratio(股息率)
     try:
         val_df = ak.stock_value_em(symbol=code)
-        if not val_df.empty:
-            val_df['Date'] = pd.to_datetime(val_df['数据日期'])
-            # 提取有用列并重命名
-            val_cols_rename = {
-                'PE(TTM)': 'PE_TTM',
-                '市净率': 'PB',
-                '总市值': 'Total_MV',       # 总市值
-            }
-            # akshare 有些版本列名会有中英文混杂，这里做防御性提取
-            available_cols = [c for c in val_cols_rename.keys() if c in val_df.columns]
-            val_df = val_df[['Date'] + available_cols].rename(columns=val_cols_rename)
-            
-            # 衍生因子: PE 历史分位数 (PE_Percentile) 
-            # 这里的计算要求用过去3年的滚动数据求分位，为了性能和数据完整性，我们直接算全部历史的滚动百分位
-            if 'PE_TTM' in val_df.columns:
-                # 滚动计算过去 750个交易日 (约3年) 的 PE分位数
-                val_df['PE_Percentile_3Y'] = val_df['PE_TTM'].rolling(window=750, min_periods=250).apply(
-                    lambda x: (pd.Series(x).rank(pct=True).iloc[-1]) * 100, raw=False
-                )
-            
-            # 使用 left join 基于 Date 拼接到传进来的主表 df 上
-            df = pd.merge(df, val_df, on='Date', how='left')
+        df = merge_valuation(df, val_df)
     except Exception as e:
         print(f"      [!] 获取估值数据失败: {e}")
 
@@ -54,79 +146,7 @@ def fetch_and_merge_fundamentals(df, code):
         # 获取个股的财务摘要 
         # stock_financial_abstract_ths 包含 ROE 等，但我们需要日期映射
         fin_df = ak.stock_financial_abstract_ths(symbol=code, indicator="按报告期")
-        if not fin_df.empty and '报告期' in fin_df.columns:
-            # 数据清洗：很多列名叫'净资产收益率'，带有百分号
-            # 我们需要提取：报告期, 净资产收益率, 净利润同比增长率, 营业总收入同比增长率
-            # 但这些字段没有披露日期(公告日)，只有报告期(比如 3-31, 6-30)，
-            # 真实 A股 中，一季报最晚在4月30日，中报最晚在8月31日，三季报最晚在10月31日，年报最晚在次年4月30日公布。
-            # 为了防止未来函数，如果我们拿不到真实的精确公告日，我们必须采取【最保守的极限推迟法 (Worst-Case Delay)】
-            
-            fin_df['Report_Date'] = pd.to_datetime(fin_df['报告期'])
-            
-            def get_conservative_announce_date(report_date):
-                # Q1 (3-31) -> 必须等到 4-30 才认为财报已全市场公开可用
-                if report_date.month == 3:
-                     return report_date.replace(month=4, day=30)
-                # Q2 (6-30) -> 必须等到 8-31 
-                elif report_date.month == 6:
-                     return report_date.replace(month=8, day=31)
-                # Q3 (9-30) -> 必须等到 10-31
-                elif report_date.month == 9:
-                     return report_date.replace(month=10, day=31)
-                # Q4/年报 (12-31) -> A股年报最晚 4-30
-                elif report_date.month == 12:
-                     return report_date.replace(year=report_date.year+1, month=4, day=30)
-                return report_date
-                
-            fin_df['Announce_Date'] = fin_df['Report_Date'].apply(get_conservative_announce_date)
-            # 因为停牌或周末的原因，财报公告日不一定是交易日，我们需要将它和我们大表的 Date 对齐。
-            
-            # 清洗字符串数字 (例如去除 "15.34%" 中的 % 并转 float)
-            def clean_pct(val):
-                if isinstance(val, str):
-                    if val == '--' or val == '': return np.nan
-                    return float(val.replace('%', ''))
-                return float(val)
-
-            # 提取指标
-            target_metrics = {}
-            if '净资产收益率' in fin_df.columns:
-                target_metrics['ROE'] = fin_df['净资产收益率'].apply(clean_pct)
-            if '净利润同比增长率' in fin_df.columns:
-                target_metrics['NetProfit_YOY'] = fin_df['净利润同比增长率'].apply(clean_pct)
-            if '扣非净利润同比增长率' in fin_df.columns:
-                target_metrics['DeductedNetProfit_YOY'] = fin_df['扣非净利润同比增长率'].apply(clean_pct)
-            if '营业总收入同比增长率' in fin_df.columns:
-                target_metrics['Revenue_YOY'] = fin_df['营业总收入同比增长率'].apply(clean_pct)
-            if '资产负债率' in fin_df.columns:
-                target_metrics['Debt_Ratio'] = fin_df['资产负债率'].apply(clean_pct)
-
-            fin_metrics_df = pd.DataFrame(target_metrics)
-            fin_metrics_df['Announce_Date'] = fin_df['Announce_Date']
-            
-            # 排序并清除重复的公告日期 (如果有财报更正等情况)
-            fin_metrics_df = fin_metrics_df.sort_values('Announce_Date').drop_duplicates(subset=['Announce_Date'], keep='last')
-            
-            # ---- 绝杀：As-of Merge (基于时间线的安全对齐) ----
-            # 我们拿主表 df(每一天) 去匹配 fin_metrics_df 里在这一天之前（含这一天）所发布的【最近一份报表】
-            # 这个操作在 pandas 叫 merge_asof，是用来做量化的绝对神器，完美断绝任何时空穿越
-            
-            # 提取 df 里已有的日期列
-            df_dates = df[['Date']].sort_values('Date')
-            
-            # 用 merge_asof 抓取最近的财报
-            asof_df = pd.merge_asof(
-                df_dates, 
-                fin_metrics_df.dropna(subset=['Announce_Date']).sort_values('Announce_Date'), 
-                left_on='Date', 
-                right_on='Announce_Date', 
-                direction='backward' # 意味着：对于任意一天，向后倒退去寻找最近的一次发布日期的数据
-            )
-            # 将抓出来的财报列并入主 df
-            for col in target_metrics.keys():
-                 if col in asof_df.columns:
-                     df[col] = asof_df[col]
-                     
+        df = merge_financial_reports(df, fin_df)
     except Exception as e:
         print(f"      [!] 获取财务报表数据失败或该股无数据: {e}")
 
@@ -150,10 +170,16 @@ def build_final_fundamental_vault():
         final_df = fetch_and_merge_fundamentals(df, code)
         
         # 3. 存储为终极的满配大表 (Final Vault)
-        final_df.to_parquet(final_path, engine="pyarrow", index=False)
+        write_vault(final_df, final_path)
+        # Vault 已重建，作废该文件名下旧的信号缓存
+        invalidate_vault(final_path)
         print(f"  [√ 完工] {f} 财报基本面注入完成！最终列数爆炸级达到：{len(final_df.columns)}")
         time.sleep(1.5) # 防止Akshare封禁
 
+    # 逐股 Vault 全部落盘后，顺手生成按年份分区的截面面板库，供横截面分析直接按日期 x 代码读取
+    years = build_panel_store(FUNDAMENTAL_VAULT_DIR)
+    print(f"  [√ 面板库] 已生成 {len(years)} 个年份分区的截面面板库")
+
 if __name__ == "__main__":
     print("\n=== Final Vault 财务基本面合并引擎启动 ===")
     build_final_fundamental_vault()
@@ -0,0 +1,237 @@
+"""
+后台任务队列：Streamlit 进程持有唯一的 JOB_QUEUE，回测在它的工作进程池里执行。
+
+取舍：vault_io.VAULT_CACHE 是进程级缓存，工作进程各有一份，无法像页面进程那样让所有会话共用同一份。
+为了让总内存仍与单进程时相当，每个工作进程的缓存上限为 VAULT_CACHE_MAX_BYTES / JOB_MAX_WORKERS；
+代价是同一只股票落在不同工作进程时会各自从磁盘读一次 (一只股票的全部列约几 MB，读盘在毫秒级)。
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 后台任务的工作目录 (每个任务一个子目录，存进度与取消标记)
+JOB_DIR = "backtest_data/jobs"
+# 同时运行的任务数上限 (全服务器所有会话共享)，可用环境变量 JOB_MAX_WORKERS 覆盖
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# 已结束的任务保留多久 (秒)，超时后在下一次提交时清理
+JOB_RETENTION_SECONDS = 24 * 3600
+# 进度文件的最短写盘间隔 (秒)，避免逐股回报时频繁写盘
+PROGRESS_MIN_INTERVAL = 0.2
+
+
+def _init_worker(cache_max_bytes):
+    """工作进程启动时收紧本进程的 Vault 缓存上限 (见模块说明)"""
+    from vault_io import VAULT_CACHE
+    VAULT_CACHE.max_bytes = cache_max_bytes
+
+
+class JobCancelled(Exception):
+    """任务在检查点发现取消标记时抛出，由 _run_job 截获并记为已取消"""
+
+
+def _write_json(path, payload):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class JobContext:
+    """
+    交给任务函数的句柄 (只含任务目录路径，可以跨进程传递)：
+      - progress(done, total, text) 回报进度，页面轮询时读到；
+      - check_cancelled() 在安全的检查点响应取消请求 (抛 JobCancelled)；
+      - checkpoint(done, total, text) 两者合一。
+    """
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self._last_write = 0.0
+
+    def progress(self, done, total, text=""):
+        now = time.time()
+        if done < total and now - self._last_write < PROGRESS_MIN_INTERVAL:
+            return
+        self._last_write = now
+        _write_json(os.path.join(self.job_dir, "progress.json"),
+                    {"done": done, "total": total, "text": text, "updated_at": now})
+
+    def cancelled(self):
+        return os.path.exists(os.path.join(self.job_dir, "cancel"))
+
+    def check_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+    def checkpoint(self, done, total, text=""):
+        """回报进度并检查取消，可直接作为各引擎的 progress 回调传入"""
+        self.progress(done, total, text)
+        self.check_cancelled()
+
+
+def _run_job(job_dir, func, args, kwargs):
+    """工作进程里执行的任务外壳：记录开始时间，截获取消"""
+    ctx = JobContext(job_dir)
+    _write_json(os.path.join(job_dir, "started.json"), {"started_at": time.time(), "pid": os.getpid()})
+    try:
+        ctx.check_cancelled()
+        return {"state": "done", "result": func(ctx, *args, **kwargs)}
+    except JobCancelled:
+        return {"state": "cancelled", "result": None}
+
+
+class JobQueue:
+    """
+    进程级的后台任务队列 (Streamlit 所有会话共享同一个实例)。
+    任务提交到本机的进程池，脚本线程立刻拿到任务 ID 返回；页面之后按 ID 轮询进度、取消、取结果。
+    同时运行的任务数不超过 max_workers，多出来的排队等待。
+    取消是协作式的：排队中的任务直接撤销，运行中的任务在下一个检查点 (如每只股票之间) 停下。
+    """
+    def __init__(self, max_workers=JOB_MAX_WORKERS, job_dir=JOB_DIR):
+        self.max_workers = max_workers
+        self.job_dir = job_dir
+        self._pool = None
+        self._jobs = {}  # 任务 ID -> {"id", "kind", "label", "owner", "dir", "future", "submitted_at", "finished_at"}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            from vault_io import VAULT_CACHE_MAX_BYTES
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                             initargs=(VAULT_CACHE_MAX_BYTES // self.max_workers,))
+        return self._pool
+
+    def submit(self, func, *args, kind="", label="", owner=None, total=0, **kwargs):
+        """
+        提交任务。func 必须是模块顶层函数 (可 pickle)，签名为 func(ctx, *args, **kwargs)。
+        :param total: 预计的进度总量 (任务开始回报进度之前 status 的 total 就用它，便于 group_status 汇总)
+        :return: 任务 ID
+        """
+        self.prune()
+        job_id = uuid.uuid4().hex[:12]
+        job_path = os.path.join(self.job_dir, job_id)
+        os.makedirs(job_path, exist_ok=True)
+        with self._lock:
+            try:
+                future = self._executor().submit(_run_job, job_path, func, args, kwargs)
+            except BrokenProcessPool:
+                # 工作进程被系统杀掉 (如内存不足) 后进程池不可再用，换一个新的
+                self._pool = None
+                future = self._executor().submit(_run_job, job_path, func, args, kwargs)
+            self._jobs[job_id] = {"id": job_id, "kind": kind, "label": label, "owner": owner, "dir": job_path,
+                                  "future": future, "total": total, "submitted_at": time.time(), "finished_at": None}
+            future.add_done_callback(lambda _f, job=self._jobs[job_id]: job.update(finished_at=time.time()))
+        return job_id
+
+    def status(self, job_id):
+        """
+        任务状态：state 为 queued / running / done / failed / cancelled / unknown，
+        附带进度 (done, total, text)、提交 / 开始 / 结束时间与错误信息。
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return {"id": job_id, "state": "unknown"}
+        future = job["future"]
+        started = _read_json(os.path.join(job["dir"], "started.json"))
+        progress = _read_json(os.path.join(job["dir"], "progress.json")) or {}
+        info = {"id": job_id, "kind": job["kind"], "label": job["label"], "owner": job["owner"],
+                "submitted_at": job["submitted_at"], "started_at": started["started_at"] if started else None,
+                "finished_at": job["finished_at"], "done": progress.get("done", 0), "total": progress.get("total", job["total"]),
+                "text": progress.get("text", ""), "error": None}
+        if future.cancelled():
+            info["state"] = "cancelled"
+        elif future.done():
+            error = future.exception()
+            if error is not None:
+                info["state"] = "failed"
+                info["error"] = f"{type(error).__name__}: {error}"
+            else:
+                info["state"] = future.result()["state"]
+        else:
+            info["state"] = "running" if started else "queued"
+        return info
+
+    def group_status(self, job_ids):
+        """
+        一组任务 (如拆块提交的批量回测) 的汇总状态：
+        还有任务未结束时为 running (全部都还在排队时为 queued)；全部结束后有任一被取消则为 cancelled，否则为 done。
+        进度为各任务之和，失败的任务列在 failed 里 [(任务 ID, 错误信息)]，由调用方决定如何处理。
+        """
+        jobs = [self.status(job_id) for job_id in job_ids]
+        pending = [j for j in jobs if j["state"] in ("queued", "running")]
+        if pending:
+            state = "queued" if all(j["state"] == "queued" for j in jobs) else "running"
+        elif any(j["state"] in ("cancelled", "unknown") for j in jobs):
+            state = "cancelled"
+        else:
+            state = "done"
+        running = [j for j in jobs if j["state"] == "running"]
+        finished = [j["finished_at"] for j in jobs if j.get("finished_at")]
+        return {
+            "ids": list(job_ids), "state": state,
+            "done": sum(j.get("done", 0) for j in jobs), "total": sum(j.get("total", 0) for j in jobs),
+            "text": running[-1]["text"] if running else "",
+            "running": len(running), "queued": sum(j["state"] == "queued" for j in jobs),
+            "failed": [(j["id"], j["error"]) for j in jobs if j["state"] == "failed"],
+            "submitted_at": min((j["submitted_at"] for j in jobs if j.get("submitted_at")), default=None),
+            "finished_at": max(finished) if finished and not pending else None
+        }
+
+    def result(self, job_id):
+        """已完成任务的返回值；未完成、失败或已取消时返回 None"""
+        job = self._jobs.get(job_id)
+        if job is None or not job["future"].done() or job["future"].cancelled() or job["future"].exception() is not None:
+            return None
+        return job["future"].result()["result"]
+
+    def cancel(self, job_id):
+        """请求取消：排队中的任务立即撤销，运行中的任务写入取消标记等它在检查点停下"""
+        job = self._jobs.get(job_id)
+        if job is None or job["future"].done():
+            return False
+        if not job["future"].cancel():
+            open(os.path.join(job["dir"], "cancel"), "w").close()
+        return True
+
+    def list_jobs(self, owner=None):
+        """全部 (或某个用户的) 任务状态列表，最新提交的在前"""
+        jobs = sorted(self._jobs.values(), key=lambda j: j["submitted_at"], reverse=True)
+        return [self.status(j["id"]) for j in jobs if owner is None or j["owner"] == owner]
+
+    def forget(self, job_id):
+        """从队列里移除一个已结束的任务并删除其工作目录"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job["future"].done():
+                return False
+            del self._jobs[job_id]
+        shutil.rmtree(job["dir"], ignore_errors=True)
+        return True
+
+    def prune(self, max_age=JOB_RETENTION_SECONDS):
+        """清理结束超过 max_age 秒的任务"""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job["finished_at"] is not None and now - job["finished_at"] > max_age:
+                self.forget(job_id)
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+# 全进程共享的唯一实例
+JOB_QUEUE = JobQueue()
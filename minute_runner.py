@@ -0,0 +1,274 @@
+import numpy as np
+import pandas as pd
+from ashare_broker import AShareBroker
+from strategy_expr import compile_strategy
+from strategy_runner import calc_core_metrics
+from stage_profiler import StageProfiler
+from minute_vault import MINUTE_VAULT_DIR, NS_PER_DAY, iter_day_chunks, bars_to_frame, limit_pct_for, list_months
+
+# 分钟线策略表达式可以引用的字段 (逐块计算，日内累计量在交易日开始时归零)
+MINUTE_FIELDS = [
+    "Open", "High", "Low", "Close", "Volume",
+    "Time",         # 当根 bar 的结束时刻，HHMM 整数，如 1030
+    "Bar_Index",    # 当日第几根 bar，从 0 开始
+    "Prev_Close",   # 昨日收盘价 (回放的第一个交易日为 NaN)
+    "Pct_Chg",      # 相对昨收的涨跌幅 (%，口径同日线 Pct_Chg_Raw)
+    "Day_Open",     # 当日开盘价
+    "Day_High",     # 当日截至本根 (含) 的最高价
+    "Day_Low",      # 当日截至本根 (含) 的最低价
+    "Prior_High",   # 当日截至上一根的最高价 (首根为 NaN)，突破类条件用 Close > Prior_High
+    "Prior_Low",    # 当日截至上一根的最低价 (首根为 NaN)
+    "VWAP",         # 当日成交量加权均价
+    "Day_Volume"    # 当日累计成交量
+]
+
+
+def build_minute_features(frame, prev_close):
+    """
+    在一个分钟线块 (若干完整交易日) 上计算 MINUTE_FIELDS。
+    :param prev_close: 块内第一个交易日的昨收 (上一块最后一根的收盘价，首块为 NaN)
+    :return: (特征表, 块内每根 bar 所属交易日的日序号)
+    """
+    ts = frame["Datetime"].to_numpy().astype(np.int64)
+    day_ids = ts // NS_PER_DAY
+    minutes = (ts - day_ids * NS_PER_DAY) // (60 * 10**9)
+
+    df = frame.drop(columns=["Datetime"])
+    df["Time"] = (minutes // 60) * 100 + minutes % 60
+    g = df.groupby(day_ids, sort=False)
+    df["Bar_Index"] = g.cumcount()
+    df["Day_Open"] = g["Open"].transform("first")
+    df["Day_High"] = g["High"].cummax()
+    df["Day_Low"] = g["Low"].cummin()
+    df["Prior_High"] = df.groupby(day_ids, sort=False)["Day_High"].shift(1)
+    df["Prior_Low"] = df.groupby(day_ids, sort=False)["Day_Low"].shift(1)
+    df["Day_Volume"] = g["Volume"].cumsum()
+    turnover = (df["Close"] * df["Volume"]).groupby(day_ids, sort=False).cumsum()
+    df["VWAP"] = (turnover / df["Day_Volume"].where(df["Day_Volume"] > 0)).fillna(df["Close"])
+
+    # 昨收：块内前一交易日的最后一根收盘，块首日沿用上一块的收盘
+    day_close = g["Close"].last()
+    prev_by_day = pd.Series(np.concatenate([[prev_close], day_close.to_numpy()[:-1]]), index=day_close.index)
+    df["Prev_Close"] = prev_by_day.reindex(day_ids).to_numpy()
+    df["Pct_Chg"] = (df["Close"] / df["Prev_Close"] - 1) * 100
+    return df, day_ids
+
+
+class MinuteStrategyRunner:
+    """
+    分钟线流式回测：按“若干完整交易日”为一块，从内存映射的分钟线 Vault 里逐块读取、逐块算信号、逐根撮合。
+    - 撮合完全复用 AShareBroker 的规则 (整手、佣金 / 印花税 / 滑点、涨跌停封板拒单、T+1)；
+      涨跌停价按昨收与板块涨跌幅现算，分钟 bar 的最高 / 最低价触及涨跌停即视为该分钟封板；
+    - T+1：当日买入的持仓当天任何分钟都不能卖 (锁定期内不重复提交卖单)，次日第一根 bar 解锁；
+    - 回放的第一个交易日没有昨收 (无从判断涨跌停)，与日线引擎上市首日的处理一致，当天不下单；
+    - 常驻内存只有当前块的行情与信号，另外每个交易日只保留一个收盘净值点，回放年数再多内存也基本不涨。
+    """
+    def __init__(self, code, vault_dir=MINUTE_VAULT_DIR, initial_cash=200000,
+                 commission=0.00025, stamp_duty=0.0005, slippage=0.001,
+                 buy_logic=None, sell_logic=None,
+                 stop_loss_pct=None, take_profit_pct=None, max_hold_days=None,
+                 start_date=None, end_date=None, chunk_days=20, profile_memory=False):
+        """
+        :param code: 股票代码 (分钟线 Vault 下的子目录名)
+        :param buy_logic: / sell_logic: 基于 MINUTE_FIELDS 的表达式，如 "Time >= 1030 and Close > Prior_High"
+        :param max_hold_days: 最长持股交易日数 (买入当天记为第 1 天)，到期后在当天第一根可卖的 bar 上平仓
+        :param chunk_days: 每块包含的交易日数，决定常驻内存的上限
+        :raises StrategyExpressionError: 表达式语法错误或引用了 MINUTE_FIELDS 之外的字段
+        """
+        self.profiler = StageProfiler(track_memory=profile_memory)
+        with self.profiler.stage("compile"):
+            self.buy_expr, self.sell_expr = compile_strategy(buy_logic, sell_logic, schema_columns=MINUTE_FIELDS)
+        if not list_months(code, vault_dir):
+            raise FileNotFoundError(f"分钟线 Vault 中没有 {code} 的数据: {vault_dir}")
+
+        self.code = code
+        self.vault_dir = vault_dir
+        self.start_date = start_date
+        self.end_date = end_date
+        self.chunk_days = chunk_days
+        self.broker = AShareBroker(initial_cash, commission, stamp_duty, slippage)
+        self.stop_loss_pct = stop_loss_pct
+        self.take_profit_pct = take_profit_pct
+        self.max_hold_days = max_hold_days
+
+        self.holding_days = 0
+        self.cost_price = 0.0
+        self.equity_curve = None
+        self.first_open = None
+        self.bars_processed = 0
+
+    def _calc_signal(self, expr, df):
+        if expr is None:
+            return [False] * len(df)
+        return expr.evaluate(df).to_numpy().astype(bool).tolist()
+
+    def run(self):
+        """
+        流式回放整个时间窗口。
+        :return: (每日收盘净值表 [Date, Equity, Cash, Position_Value], broker.trades)
+        """
+        broker = self.broker
+        stop_line = -abs(self.stop_loss_pct) if self.stop_loss_pct is not None else None
+        profit_line = abs(self.take_profit_pct) if self.take_profit_pct is not None else None
+        max_hold_days = self.max_hold_days
+
+        day_dates, day_equity, day_cash = [], [], []
+        prev_close = np.nan
+        current_day = None
+        limit_up = limit_down = np.nan
+        close = np.nan
+
+        chunks = iter_day_chunks(self.code, self.start_date, self.end_date, self.vault_dir, self.chunk_days)
+        while True:
+            with self.profiler.stage("load") as stage:
+                bars = next(chunks, None)
+                if bars is None:
+                    break
+                frame = bars_to_frame(bars)
+                del bars
+                stage["rows"] = len(frame)
+
+            with self.profiler.stage("signals", rows=len(frame)):
+                df, day_ids = build_minute_features(frame, prev_close)
+                buy_signal = self._calc_signal(self.buy_expr, df)
+                sell_signal = self._calc_signal(self.sell_expr, df)
+                stamps = frame["Datetime"].to_numpy()
+                prev_closes = df["Prev_Close"].tolist()
+                closes = df["Close"].tolist()
+                highs = df["High"].tolist()
+                lows = df["Low"].tolist()
+                day_list = day_ids.tolist()
+                if self.first_open is None and len(df):
+                    self.first_open = float(df["Open"].iloc[0])
+                del df, frame
+
+            with self.profiler.stage("loop", rows=len(closes)):
+                for j in range(len(closes)):
+                    day = day_list[j]
+                    if day != current_day:
+                        # 收盘清点上一交易日的净值
+                        if current_day is not None:
+                            day_dates.append(current_day)
+                            day_equity.append(broker.cash + broker.total_shares * close)
+                            day_cash.append(broker.cash)
+                        current_day = day
+                        broker.daily_update_t1_lock()
+                        if broker.total_shares > 0:
+                            self.holding_days += 1
+                        pc = prev_closes[j]
+                        if pc == pc:
+                            pct = limit_pct_for(self.code, pd.Timestamp(stamps[j]))
+                            limit_up, limit_down = round(pc * (1 + pct), 2), round(pc * (1 - pct), 2)
+                        else:
+                            limit_up = limit_down = np.nan
+
+                    close = closes[j]
+                    broker.last_close = close
+                    if limit_up != limit_up:
+                        continue
+
+                    if broker.total_shares > 0:
+                        if broker.available_shares <= 0:
+                            continue
+                        current_return_pct = (close - self.cost_price) / self.cost_price
+                        if stop_line is not None and current_return_pct <= stop_line:
+                            triggered_sell = True
+                        elif profit_line is not None and current_return_pct >= profit_line:
+                            triggered_sell = True
+                        elif max_hold_days is not None and self.holding_days >= max_hold_days:
+                            triggered_sell = True
+                        else:
+                            triggered_sell = sell_signal[j]
+
+                        if triggered_sell:
+                            success, msg = broker.submit_sell_order(
+                                date=pd.Timestamp(stamps[j]),
+                                trigger_price=close,
+                                limit_down_price=limit_down,
+                                current_low=lows[j]
+                            )
+                            if success:
+                                self.holding_days = 0
+                                self.cost_price = 0.0
+
+                    elif buy_signal[j]:
+                        success, msg = broker.submit_buy_order(
+                            date=pd.Timestamp(stamps[j]),
+                            trigger_price=close,
+                            limit_up_price=limit_up,
+                            current_high=highs[j]
+                        )
+                        if success:
+                            self.cost_price = close * (1 + broker.slippage)
+                            self.holding_days = 1
+
+                self.bars_processed += len(closes)
+                if closes:
+                    prev_close = closes[-1]
+
+        if current_day is not None:
+            day_dates.append(current_day)
+            day_equity.append(broker.cash + broker.total_shares * close)
+            day_cash.append(broker.cash)
+
+        equity = np.asarray(day_equity, dtype=float)
+        cash = np.asarray(day_cash, dtype=float)
+        self.equity_curve = pd.DataFrame({
+            "Date": pd.to_datetime(np.asarray(day_dates, dtype=np.int64) * NS_PER_DAY),
+            "Equity": equity,
+            "Cash": cash,
+            "Position_Value": equity - cash
+        })
+        self.last_close = close
+        return self.equity_curve, broker.trades
+
+    def generate_report(self, curve_df=None):
+        """核心指标与日线战报同口径 (calc_core_metrics)；基准为回放首根 bar 开盘买入、持有到最后一根收盘"""
+        curve_df = self.equity_curve if curve_df is None else curve_df
+        with self.profiler.stage("report"):
+            if curve_df is None or curve_df.empty:
+                return {}
+            benchmark_return = self.last_close / self.first_open - 1 if self.first_open else 0.0
+            if len(self.broker.trades) == 0:
+                metrics = {
+                    "Final_Equity": self.broker.initial_cash, "Total_Return": 0.0, "Annual_Return": 0.0,
+                    "Max_Drawdown": 0.0, "Sharpe_Ratio": 0.0, "Calmar_Ratio": 0.0,
+                    "Total_Trades_Pairs": 0, "Win_Rate": 0.0
+                }
+            else:
+                metrics = calc_core_metrics(curve_df["Equity"], np.ones(len(curve_df), dtype=bool),
+                                            self.broker.initial_cash, self.broker.trades)
+            metrics["Benchmark_Return"] = benchmark_return
+            metrics["Bars_Processed"] = self.bars_processed
+            return metrics
+
+    def profile_summary(self):
+        """分阶段耗时 / 行数 (/ 峰值内存) 与订单计数，格式同 StrategyRunner.profile_summary"""
+        summary = self.profiler.summary()
+        summary["counters"].update(self.broker.order_stats)
+        return summary
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import tempfile
+    import tracemalloc
+    from minute_vault import build_synthetic_minute_vault
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_synthetic_minute_vault("600519", "2016-01-01", "2023-12-31", vault_dir=tmp)
+        for end in ("2016-12-31", "2019-12-31", "2023-12-31"):
+            runner = MinuteStrategyRunner(
+                "600519", vault_dir=tmp,
+                buy_logic="Time >= 1030 and Close > Prior_High and Close > VWAP and Pct_Chg < 5",
+                sell_logic="Close < VWAP * 0.98",
+                stop_loss_pct=0.05, take_profit_pct=0.08, max_hold_days=5,
+                start_date="2016-01-01", end_date=end
+            )
+            tracemalloc.start()
+            curve, trades = runner.run()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report = runner.generate_report(curve)
+            print(f"至 {end}: {report['Bars_Processed']:,} 根 bar，{len(trades)} 笔成交，"
+                  f"收益 {report['Total_Return']:.2%}，Python 侧峰值内存 {peak / 1024 / 1024:.1f} MB")
@@ -0,0 +1,213 @@
+import os
+import numpy as np
+import pandas as pd
+
+# 分钟线 Vault 根目录：每只股票一个子目录，每个自然月一个定长记录文件 ({code}/{YYYYMM}.bars)
+MINUTE_VAULT_DIR = "backtest_data/minute_vault"
+MINUTE_FILE_EXT = ".bars"
+
+# 单根分钟线的定长二进制记录 (48 字节，小端)。ts 为北京时间墙钟的 datetime64[ns] 整数值 (与日线 Date 一样不带时区)。
+# 文件里只有连续的记录、没有文件头：追加就是在文件尾写字节，读取直接 np.memmap 映射，不做任何反序列化。
+BAR_DTYPE = np.dtype([("ts", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"),
+                      ("close", "<f8"), ("volume", "<f8")])
+BARS_PER_DAY = 240
+NS_PER_DAY = 86400 * 10**9
+
+# DataFrame 形式的分钟线列名 <-> 记录字段
+FRAME_COLUMNS = {"Datetime": "ts", "Open": "open", "High": "high", "Low": "low", "Close": "close", "Volume": "volume"}
+
+
+def month_path(code, month, vault_dir=MINUTE_VAULT_DIR):
+    """某只股票某个月 (YYYYMM) 的分钟线文件路径"""
+    return os.path.join(vault_dir, code, f"{month}{MINUTE_FILE_EXT}")
+
+
+def list_months(code, vault_dir=MINUTE_VAULT_DIR):
+    """已落盘的月份 (YYYYMM，升序)"""
+    stock_dir = os.path.join(vault_dir, code)
+    if not os.path.isdir(stock_dir):
+        return []
+    return sorted(f[:-len(MINUTE_FILE_EXT)] for f in os.listdir(stock_dir) if f.endswith(MINUTE_FILE_EXT))
+
+
+def _complete_records(path):
+    """文件里完整记录的条数 (追加中途崩溃可能留下半条记录，一律不计)"""
+    return os.path.getsize(path) // BAR_DTYPE.itemsize
+
+
+def open_month(code, month, vault_dir=MINUTE_VAULT_DIR):
+    """
+    只读映射一个月的分钟线 (结构化数组视图，不把数据读进内存，访问到哪页才由操作系统按需换入)。
+    文件不存在或为空时返回空数组。
+    """
+    path = month_path(code, month, vault_dir)
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=BAR_DTYPE)
+    n = _complete_records(path)
+    if n == 0:
+        return np.zeros(0, dtype=BAR_DTYPE)
+    return np.memmap(path, dtype=BAR_DTYPE, mode="r", shape=(n,))
+
+
+def frame_to_bars(df):
+    """Datetime/Open/High/Low/Close/Volume 格式的 DataFrame -> BAR_DTYPE 记录数组"""
+    bars = np.empty(len(df), dtype=BAR_DTYPE)
+    bars["ts"] = pd.to_datetime(df["Datetime"]).to_numpy().astype("datetime64[ns]").astype(np.int64)
+    for col, field in FRAME_COLUMNS.items():
+        if field != "ts":
+            bars[field] = df[col].to_numpy(dtype=float)
+    return bars
+
+
+def bars_to_frame(bars):
+    """BAR_DTYPE 记录数组 -> DataFrame (复制出来，与映射文件脱钩)"""
+    return pd.DataFrame({
+        col: (bars[field].astype("datetime64[ns]") if field == "ts" else np.array(bars[field]))
+        for col, field in FRAME_COLUMNS.items()
+    })
+
+
+def append_bars(code, bars, vault_dir=MINUTE_VAULT_DIR):
+    """
+    把一批分钟线追加进 Vault：按自然月拆分，只在各月文件尾写入比已有最后一根更晚的 bar。
+    同一批数据重复灌入是幂等的；早于文件内最后时间戳的 bar 会被忽略 (文件只追加，不改写)。
+    文件尾若有上次崩溃留下的半条记录，先截掉再写。
+
+    :param bars: BAR_DTYPE 记录数组，或 Datetime/Open/High/Low/Close/Volume 格式的 DataFrame
+    :return: 实际写入的 bar 数
+    """
+    if isinstance(bars, pd.DataFrame):
+        bars = frame_to_bars(bars)
+    if len(bars) == 0:
+        return 0
+    bars = np.sort(np.asarray(bars, dtype=BAR_DTYPE), order="ts")
+    bars = bars[np.concatenate([[True], np.diff(bars["ts"]) > 0])]
+
+    months = bars["ts"].astype("datetime64[ns]").astype("datetime64[M]")
+    boundaries = np.flatnonzero(np.diff(months.astype(np.int64))) + 1
+    os.makedirs(os.path.join(vault_dir, code), exist_ok=True)
+
+    written = 0
+    for chunk in np.split(bars, boundaries):
+        month = pd.Timestamp(chunk["ts"][0]).strftime("%Y%m")
+        path = month_path(code, month, vault_dir)
+        if os.path.exists(path):
+            n = _complete_records(path)
+            if os.path.getsize(path) != n * BAR_DTYPE.itemsize:
+                os.truncate(path, n * BAR_DTYPE.itemsize)
+            if n > 0:
+                existing = np.memmap(path, dtype=BAR_DTYPE, mode="r", shape=(n,))
+                last_ts = int(existing["ts"][-1])
+                del existing
+                chunk = chunk[chunk["ts"] > last_ts]
+        if len(chunk) == 0:
+            continue
+        with open(path, "ab") as f:
+            f.write(chunk.tobytes())
+        written += len(chunk)
+    return written
+
+
+def iter_day_chunks(code, start_date=None, end_date=None, vault_dir=MINUTE_VAULT_DIR, chunk_days=20):
+    """
+    按时间顺序流式产出分钟线块：每块是若干个完整交易日的 BAR_DTYPE 视图 (一个交易日不会被拆到两块里)。
+    同一时刻只映射一个月份文件，处理完即释放映射，回放多少年的数据常驻内存都只有一个块的量级。
+
+    :param start_date: / end_date: 闭区间，按自然日过滤 (end_date 当天全天有效)
+    :param chunk_days: 每块最多包含的交易日数
+    """
+    lower = pd.Timestamp(start_date).value if start_date else None
+    upper = (pd.Timestamp(end_date) + pd.Timedelta(days=1)).value if end_date else None
+    lower_month = pd.Timestamp(start_date).strftime("%Y%m") if start_date else None
+    upper_month = pd.Timestamp(end_date).strftime("%Y%m") if end_date else None
+
+    for month in list_months(code, vault_dir):
+        if (lower_month and month < lower_month) or (upper_month and month > upper_month):
+            continue
+        bars = open_month(code, month, vault_dir)
+        ts = bars["ts"]
+        lo = int(np.searchsorted(ts, lower, side="left")) if lower is not None else 0
+        hi = int(np.searchsorted(ts, upper, side="left")) if upper is not None else len(bars)
+        if hi <= lo:
+            del bars
+            continue
+
+        day_ids = ts[lo:hi] // NS_PER_DAY
+        day_starts = np.flatnonzero(np.concatenate([[True], np.diff(day_ids) != 0])) + lo
+        cuts = list(day_starts[::chunk_days]) + [hi]
+        for a, b in zip(cuts[:-1], cuts[1:]):
+            yield bars[a:b]
+        del bars
+
+
+# ---------------- 离线合成分钟线 (测试 / 测评用) ----------------
+
+def trading_minutes():
+    """A 股连续竞价的 240 个分钟 bar 时刻 (相对当日 0 点的纳秒偏移)：09:31-11:30、13:01-15:00"""
+    am = np.arange(9 * 60 + 31, 11 * 60 + 31)
+    pm = np.arange(13 * 60 + 1, 15 * 60 + 1)
+    return np.concatenate([am, pm]).astype(np.int64) * 60 * 10**9
+
+
+def limit_pct_for(code, date):
+    """板块涨跌幅限制 (与 calc_daily_limits_and_flags 的规则一致，不含 ST 识别)"""
+    if code.startswith('688'):
+        return 0.20
+    if code.startswith('300'):
+        return 0.20 if pd.Timestamp(date) >= pd.Timestamp('2020-08-24') else 0.10
+    if code.startswith(('4', '8', '9')):
+        return 0.30
+    return 0.10
+
+
+def _synth_month(code, days, prev_close, rng, daily_vol=0.025):
+    """一个月的合成分钟线：分钟级随机游走，按昨收的涨跌停价封顶/封底，价格按分取整"""
+    offsets = trading_minutes()
+    sigma = daily_vol / np.sqrt(BARS_PER_DAY)
+    out = np.empty(len(days) * BARS_PER_DAY, dtype=BAR_DTYPE)
+
+    for k, day in enumerate(days):
+        pct = limit_pct_for(code, day)
+        up, down = round(prev_close * (1 + pct), 2), round(prev_close * (1 - pct), 2)
+        gap = rng.normal(0, daily_vol / 3)
+        path = prev_close * np.exp(gap + np.cumsum(rng.normal(0, sigma, BARS_PER_DAY)))
+        close = np.round(np.clip(path, down, up), 2)
+        open_ = np.concatenate([[np.round(np.clip(prev_close * np.exp(gap), down, up), 2)], close[:-1]])
+        wick = np.abs(rng.normal(0, sigma / 2, (2, BARS_PER_DAY)))
+        high = np.round(np.minimum(np.maximum(open_, close) * (1 + wick[0]), up), 2)
+        low = np.round(np.maximum(np.minimum(open_, close) * (1 - wick[1]), down), 2)
+
+        rows = slice(k * BARS_PER_DAY, (k + 1) * BARS_PER_DAY)
+        out["ts"][rows] = pd.Timestamp(day).value + offsets
+        out["open"][rows], out["high"][rows], out["low"][rows], out["close"][rows] = open_, high, low, close
+        out["volume"][rows] = np.round(rng.lognormal(10, 0.8, BARS_PER_DAY), -2)
+        prev_close = float(close[-1])
+    return out, prev_close
+
+
+def build_synthetic_minute_vault(code, start_date, end_date, vault_dir=MINUTE_VAULT_DIR, seed=42, start_price=10.0):
+    """
+    离线生成一只股票的合成分钟线并逐月追加进 Vault (工作日即交易日，每天 240 根)。
+    按月生成、按月落盘，生成多少年数据内存里都只有一个月；同一组参数逐位可复现，重复调用不会重复写入。
+    :return: 写入的 bar 总数
+    """
+    rng = np.random.default_rng([seed, int(code) if code.isdigit() else sum(map(ord, code))])
+    days = pd.bdate_range(start_date, end_date)
+    prev_close = start_price
+    written = 0
+    for _, month_days in pd.Series(days, index=days).groupby(days.to_period("M")):
+        bars, prev_close = _synth_month(code, month_days, prev_close, rng)
+        written += append_bars(code, bars, vault_dir)
+    return written
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        n = build_synthetic_minute_vault("600519", "2024-01-01", "2024-12-31", vault_dir=tmp)
+        print(f"写入 {n} 根分钟线，月份文件: {list_months('600519', tmp)}")
+        print(f"重复灌入新增: {build_synthetic_minute_vault('600519', '2024-01-01', '2024-12-31', vault_dir=tmp)}")
+        chunks = list(iter_day_chunks("600519", "2024-03-01", "2024-03-31", vault_dir=tmp, chunk_days=5))
+        print(f"3 月共 {len(chunks)} 块，{sum(len(c) for c in chunks)} 根")
+        print(bars_to_frame(chunks[0]).head())
@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+
+# 每批同时模拟的“路径 × 天数”单元上限，控制单批矩阵的内存 (约 8M 个 float64 = 64MB)
+MAX_CELLS_PER_BATCH = 8_000_000
+
+# 与 calc_core_metrics 相同的口径：一年 250 个交易日，无风险利率 3%
+TRADING_DAYS_PER_YEAR = 250
+RISK_FREE_RATE = 0.03
+
+
+def _path_metrics(returns, axis=1):
+    """
+    对一批收益率路径 (paths × steps) 一次性算出总收益、最大回撤、夏普，全程矩阵运算。
+    口径与 calc_core_metrics 一致：回撤按净值相对历史高点，夏普为日超额收益均值 / 标准差 (ddof=1) × sqrt(250)。
+    """
+    growth = np.cumprod(1.0 + returns, axis=axis)
+    total_return = growth[:, -1] - 1.0
+
+    # 把起点净值 1.0 也纳入历史高点，首日下跌同样计入回撤
+    running_max = np.maximum(np.maximum.accumulate(growth, axis=axis), 1.0)
+    max_drawdown = np.min(growth / running_max - 1.0, axis=axis)
+    max_drawdown = np.minimum(max_drawdown, 0.0)
+
+    excess = returns - RISK_FREE_RATE / TRADING_DAYS_PER_YEAR
+    std = excess.std(axis=axis, ddof=1) if returns.shape[1] > 1 else np.zeros(len(returns))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(std > 0, excess.mean(axis=axis) / std * np.sqrt(TRADING_DAYS_PER_YEAR), 0.0)
+    return total_return, max_drawdown, sharpe
+
+
+def _batches(n_paths, n_steps):
+    """按单批内存上限把 n_paths 切成若干批"""
+    per_batch = max(1, MAX_CELLS_PER_BATCH // max(n_steps, 1))
+    start = 0
+    while start < n_paths:
+        stop = min(n_paths, start + per_batch)
+        yield start, stop
+        start = stop
+
+
+def _block_stats(log_r, r, length):
+    """
+    预计算“从每个起点开始、长度为 length 的区块”的统计量 (每个起点一行)：
+    区块内累计对数收益的终值 / 最高点 / 最低点 / 区块内最大回撤，以及简单收益的和与平方和。
+    """
+    if length == 1:
+        # 单日区块 (独立同分布自助) 时高低点都等于当日收益，共用同一个数组，抽样时只需取一次
+        return {"total": log_r, "max_prefix": log_r, "min_prefix": log_r,
+                "intra_dd": np.zeros_like(log_r), "sum": r, "sum_sq": r * r}
+    windows = np.lib.stride_tricks.sliding_window_view(log_r, length)
+    cum = np.cumsum(windows, axis=1)
+    intra_dd = np.max(np.maximum.accumulate(cum, axis=1) - cum, axis=1)
+    raw = np.lib.stride_tricks.sliding_window_view(r, length)
+    return {
+        "total": cum[:, -1],
+        "max_prefix": cum.max(axis=1),
+        "min_prefix": cum.min(axis=1),
+        "intra_dd": intra_dd,
+        "sum": raw.sum(axis=1),
+        "sum_sq": (raw * raw).sum(axis=1),
+    }
+
+
+def bootstrap_daily_returns(daily_returns, n_paths=10000, block_size=5, seed=None):
+    """
+    日收益率的移动区块自助法 (Moving Block Bootstrap)：
+    从原始日收益序列中有放回地抽取长度为 block_size 的连续区块拼成同样长度的新路径，
+    区块内保留了波动聚集与短期自相关。
+
+    区块的统计量 (累计收益、区块内高低点与回撤、收益和与平方和) 按起点预先算好，
+    每条路径只需在“路径 × 区块数”的矩阵上做累加与累计最大值即可精确得到总收益、最大回撤与夏普，
+    比逐日展开整条路径少一个 block_size 倍的数据量，所有路径一次性批量计算，没有逐路径的 Python 循环。
+
+    :param daily_returns: 每日收益率序列 (包含空仓日的 0 收益)
+    :param block_size: 区块长度 (交易日)，1 即普通的独立同分布自助法
+    :return: {"Total_Return", "Max_Drawdown", "Sharpe_Ratio"} -> 长度为 n_paths 的模拟结果数组
+    """
+    r = np.asarray(daily_returns, dtype=float)
+    n = len(r)
+    rng = np.random.default_rng(seed)
+    out = {k: np.zeros(n_paths) for k in ("Total_Return", "Max_Drawdown", "Sharpe_Ratio")}
+    if n == 0:
+        return out
+
+    block_size = int(max(1, min(block_size, n)))
+    n_full, tail = divmod(n, block_size)
+    log_r = np.log1p(r)
+    full_stats = _block_stats(log_r, r, block_size)
+    # 最后一段不足一个区块时，用同样的方法单独抽一个短区块补齐长度
+    tail_stats = _block_stats(log_r, r, tail) if tail else None
+
+    for lo, hi in _batches(n_paths, n_full + 1):
+        m = hi - lo
+        pick = rng.integers(0, n - block_size + 1, size=(m, n_full))
+        if tail_stats is not None:
+            tail_pick = rng.integers(0, n - tail + 1, size=(m, 1))
+        stats, gathered = {}, {}
+        for k, v in full_stats.items():
+            if id(v) not in gathered:
+                g = v[pick]
+                if tail_stats is not None:
+                    g = np.concatenate([g, tail_stats[k][tail_pick]], axis=1)
+                gathered[id(v)] = g
+            stats[k] = gathered[id(v)]
+
+        # 各区块起点的累计对数净值 B_k，以及进入该区块前的历史最高点 R_k (含起点净值 0)
+        ends = np.cumsum(stats["total"], axis=1)
+        level = ends - stats["total"]
+        peaks = np.maximum.accumulate(level + stats["max_prefix"], axis=1)
+        prev_peak = np.concatenate([np.zeros((m, 1)), np.maximum(peaks[:, :-1], 0.0)], axis=1)
+        # 区块内任一天的回撤 = max(之前高点 - 区块内最低点, 区块内部自身的回撤)
+        dd_log = np.maximum(prev_peak - level - stats["min_prefix"], stats["intra_dd"]).max(axis=1)
+
+        out["Total_Return"][lo:hi] = np.expm1(ends[:, -1])
+        out["Max_Drawdown"][lo:hi] = np.expm1(-np.maximum(dd_log, 0.0))
+
+        total = stats["sum"].sum(axis=1)
+        total_sq = stats["sum_sq"].sum(axis=1)
+        if n > 1:
+            mean = total / n
+            var = np.maximum(total_sq - n * mean * mean, 0.0) / (n - 1)
+            std = np.sqrt(var)
+            excess_mean = mean - RISK_FREE_RATE / TRADING_DAYS_PER_YEAR
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out["Sharpe_Ratio"][lo:hi] = np.where(std > 0, excess_mean / std * np.sqrt(TRADING_DAYS_PER_YEAR), 0.0)
+    return out
+
+
+def reshuffle_trades(trade_returns, n_paths=10000, resample=False, seed=None):
+    """
+    交易顺序重排 (resample=False)：同一批往返交易换个先后次序，总收益不变，但回撤路径完全不同，
+    用来衡量“回撤有多少是运气排出来的”。
+    交易自助法 (resample=True)：从往返交易中有放回地抽取同样笔数，衡量总收益对少数大单的依赖。
+
+    :param trade_returns: 每笔往返交易的含费收益率 (如 Round_Trips 的 Return_Pct)
+    :return: {"Total_Return", "Max_Drawdown"} -> 长度为 n_paths 的模拟结果数组
+    """
+    r = np.asarray(trade_returns, dtype=float)
+    k = len(r)
+    rng = np.random.default_rng(seed)
+    out = {k_: np.zeros(n_paths) for k_ in ("Total_Return", "Max_Drawdown")}
+    if k == 0:
+        return out
+
+    for lo, hi in _batches(n_paths, k):
+        if resample:
+            idx = rng.integers(0, k, size=(hi - lo, k))
+        else:
+            # 对随机数矩阵逐行 argsort 即得到每条路径各自独立的随机排列
+            idx = np.argsort(rng.random((hi - lo, k)), axis=1)
+        tr, mdd, _ = _path_metrics(r[idx])
+        out["Total_Return"][lo:hi] = tr
+        out["Max_Drawdown"][lo:hi] = mdd
+    return out
+
+
+def summarize_simulations(samples, observed=None, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """
+    把模拟结果汇总成置信区间表。
+    :param samples: {指标名: 模拟数组}
+    :param observed: {指标名: 实盘回测值}，用于计算实际结果在模拟分布中的分位
+    :return: DataFrame，行为指标，列为各分位数 / 均值 / 实际值 / 实际值所处分位
+    """
+    rows = []
+    for metric, values in samples.items():
+        row = {"指标": metric}
+        qs = np.quantile(values, quantiles)
+        for q, v in zip(quantiles, qs):
+            row[f"P{int(round(q * 100))}"] = v
+        row["均值"] = float(np.mean(values))
+        if observed is not None and metric in observed:
+            row["实际回测值"] = observed[metric]
+            row["实际值所处分位"] = float(np.mean(values <= observed[metric]))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def run_robustness(equity_df, round_trips=None, n_paths=10000, block_size=5, seed=None):
+    """
+    回测结果的稳健性体检：日收益区块自助 + 交易顺序重排 + 交易自助三套蒙特卡洛。
+
+    :param equity_df: StrategyRunner.run() 返回的净值表 (需要 Equity 列)
+    :param round_trips: generate_report 返回的往返交易台账 (Round_Trips)，为空时只做日收益自助
+    :return: {
+        "daily_bootstrap": 汇总表, "trade_reshuffle": 汇总表, "trade_bootstrap": 汇总表,
+        "samples": {各模拟的原始数组}, "loss_probability": 日收益自助下总收益为负的概率
+    }
+    """
+    equity = pd.Series(np.asarray(equity_df['Equity'], dtype=float))
+    daily_returns = equity.pct_change().fillna(0).to_numpy()
+
+    growth = np.cumprod(1.0 + daily_returns)
+    running_max = np.maximum(np.maximum.accumulate(growth), 1.0) if len(growth) else growth
+    observed_daily = {
+        "Total_Return": float(growth[-1] - 1.0) if len(growth) else 0.0,
+        "Max_Drawdown": float(min(np.min(growth / running_max - 1.0), 0.0)) if len(growth) else 0.0,
+        "Sharpe_Ratio": float(_path_metrics(daily_returns[None, :])[2][0]) if len(growth) else 0.0,
+    }
+
+    daily = bootstrap_daily_returns(daily_returns, n_paths=n_paths, block_size=block_size, seed=seed)
+    samples = {"daily_bootstrap": daily}
+    result = {
+        "daily_bootstrap": summarize_simulations(daily, observed_daily),
+        "loss_probability": float(np.mean(daily["Total_Return"] < 0)),
+    }
+
+    trade_returns = np.asarray(round_trips['Return_Pct'], dtype=float) if round_trips is not None and len(round_trips) else np.zeros(0)
+    if len(trade_returns):
+        trade_growth = np.cumprod(1.0 + trade_returns)
+        trade_max = np.maximum(np.maximum.accumulate(trade_growth), 1.0)
+        observed_trade = {
+            "Total_Return": float(trade_growth[-1] - 1.0),
+            "Max_Drawdown": float(min(np.min(trade_growth / trade_max - 1.0), 0.0)),
+        }
+        seed_seq = np.random.SeedSequence(seed)
+        s_reshuffle, s_resample = seed_seq.spawn(2)
+        reshuffled = reshuffle_trades(trade_returns, n_paths=n_paths, resample=False, seed=s_reshuffle)
+        resampled = reshuffle_trades(trade_returns, n_paths=n_paths, resample=True, seed=s_resample)
+        samples["trade_reshuffle"] = reshuffled
+        samples["trade_bootstrap"] = resampled
+        result["trade_reshuffle"] = summarize_simulations(reshuffled, observed_trade)
+        result["trade_bootstrap"] = summarize_simulations(resampled, observed_trade)
+    else:
+        result["trade_reshuffle"] = pd.DataFrame()
+        result["trade_bootstrap"] = pd.DataFrame()
+
+    result["samples"] = samples
+    return result
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import os
+    import time
+    from strategy_runner import StrategyRunner
+
+    test_file = "backtest_data/final_vault/600519.parquet"
+    if os.path.exists(test_file):
+        runner = StrategyRunner(
+            data_path=test_file,
+            buy_logic="Close_Qfq > MA_20 and MACD_Hist > 0",
+            sell_logic="Close_Qfq < MA_10",
+            stop_loss_pct=0.08,
+            max_hold_days=20
+        )
+        curve_df, trades = runner.run()
+        report = runner.generate_report(curve_df)
+
+        t0 = time.perf_counter()
+        mc = run_robustness(curve_df, report["Round_Trips"], n_paths=10000, seed=42)
+        print(f"\n🎲 10000 条路径蒙特卡洛耗时 {time.perf_counter() - t0:.2f}s，亏损概率 {mc['loss_probability']:.1%}")
+        for key in ("daily_bootstrap", "trade_reshuffle", "trade_bootstrap"):
+            print(f"\n=== {key} ===")
+            print(mc[key].to_string(index=False))
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
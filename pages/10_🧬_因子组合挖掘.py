@@ -0,0 +1,197 @@
+import streamlit as st
+import pandas as pd
+import os
+import time
+import datetime
+from utils import inject_custom_css, check_authentication, render_sidebar
+
+st.set_page_config(page_title="因子组合挖掘 - 位图暴力搜索", layout="wide")
+inject_custom_css()
+check_authentication()
+render_sidebar()
+
+# 页面权限检查 (与回测页相同)
+if st.session_state.get('user_role') != 'admin' and not st.session_state.get('can_backtest'):
+    st.error("🚫 您的账户暂无专业回测权限。请联系管理员开启！")
+    st.stop()
+
+st.title("🧬 因子组合挖掘")
+st.caption("把【专业回测舱】的买入条件库展开成多档阈值，每个条件在每只股票上只算一次并压成位图，再用按位与枚举所有组合，"
+           "按信号日之后 N 个交易日的远期收益排序。用它来挑候选组合，再回到回测舱做带风控的完整回测。")
+
+vault_dir = "backtest_data/final_vault"
+available_stocks = []
+if os.path.exists(vault_dir):
+    available_stocks = sorted(f.replace('.parquet', '') for f in os.listdir(vault_dir) if f.endswith('.parquet'))
+
+if not available_stocks:
+    st.warning("⚠️ 底层数据库为空，请先运行数据采集抓取脚本！")
+    st.stop()
+
+from factor_miner import CONDITION_LIBRARY, RANK_OPTIONS, build_condition_bitsets, mine_combinations
+
+# --- 条件库 ---
+st.markdown("### 1. 条件库")
+st.info("💡 同一族的几档阈值 (如 RSI<20 / RSI<30 / RSI<40) 不会出现在同一个组合里。可以取消勾选不想参与挖掘的条件，或在表格末尾追加自定义表达式。")
+library_df = pd.DataFrame([{"参与挖掘": True, "族": c["family"], "条件": c["name"], "表达式": c["expr"]} for c in CONDITION_LIBRARY])
+edited_df = st.data_editor(library_df, num_rows="dynamic", use_container_width=True, hide_index=True, height=320)
+
+# --- 挖掘参数 ---
+st.markdown("### 2. 挖掘参数")
+col_p1, col_p2, col_p3, col_p4 = st.columns(4)
+horizon = col_p1.number_input("远期收益持有期 (交易日)", min_value=1, max_value=120, value=10, step=1)
+max_depth = col_p2.number_input("最大组合深度", min_value=1, max_value=6, value=3, step=1)
+min_hits = col_p3.number_input("最少触发次数 (剪枝阈值)", min_value=1, max_value=100000, value=50, step=10)
+top_n = col_p4.number_input("展示前 N 个组合", min_value=10, max_value=1000, value=50, step=10)
+
+col_p5, col_p6, col_p7 = st.columns(3)
+rank_by = col_p5.selectbox("排序依据", list(RANK_OPTIONS), format_func=RANK_OPTIONS.get)
+start_date = col_p6.date_input("样本起始日期", value=datetime.date(2010, 1, 1), min_value=datetime.date(1990, 1, 1), max_value=datetime.date.today())
+end_date = col_p7.date_input("样本截止日期", value=datetime.date.today(), min_value=datetime.date(1990, 1, 1), max_value=datetime.date.today())
+
+if st.button("🧬 开始挖掘", type="primary", use_container_width=True):
+    from strategy_expr import compile_expression, StrategyExpressionError
+
+    conditions = []
+    for _, r in edited_df.iterrows():
+        if not r["参与挖掘"] or not isinstance(r["表达式"], str) or not r["表达式"].strip():
+            continue
+        name = r["条件"] if isinstance(r["条件"], str) and r["条件"].strip() else r["表达式"].strip()
+        family = r["族"] if isinstance(r["族"], str) and r["族"].strip() else name
+        conditions.append({"family": family, "name": name, "expr": r["表达式"].strip()})
+
+    try:
+        for c in conditions:
+            compile_expression(c["expr"])
+    except StrategyExpressionError as e:
+        st.error(f"🚫 条件表达式有误: {e}")
+        st.stop()
+
+    if not conditions:
+        st.warning("请至少保留一个条件。")
+        st.stop()
+
+    progress_bar = st.progress(0, text="正在逐只求值条件并压缩位图...")
+
+    def on_progress(done, total, code):
+        progress_bar.progress(done / total, text=f"位图构建中: {code} ({done}/{total})")
+
+    t0 = time.perf_counter()
+    bitsets = build_condition_bitsets(available_stocks, vault_dir, conditions=conditions, horizon=int(horizon),
+                                      start_date=start_date, end_date=end_date, progress=on_progress)
+    build_seconds = time.perf_counter() - t0
+
+    with st.spinner("正在按位与枚举组合..."):
+        t1 = time.perf_counter()
+        top_df, stats = mine_combinations(bitsets, max_depth=int(max_depth), min_hits=int(min_hits),
+                                          top_n=int(top_n), rank_by=rank_by)
+        mine_seconds = time.perf_counter() - t1
+    progress_bar.progress(1.0, text="挖掘完成！")
+
+    st.session_state.mining_results = {
+        "top_df": top_df, "stats": stats, "n_conditions": len(conditions), "n_stocks": len(bitsets.codes),
+        "bitset_mb": bitsets.nbytes / 1024 / 1024, "build_seconds": build_seconds, "mine_seconds": mine_seconds,
+        "horizon": int(horizon)
+    }
+
+if st.session_state.get("mining_results"):
+    res = st.session_state.mining_results
+    stats = res["stats"]
+    st.markdown("---")
+    st.markdown("### 3. 挖掘结果")
+    col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+    col_m1.metric("样本 (股票-交易日)", f"{stats['samples']:,}", f"{res['n_stocks']} 只 · {res['n_conditions']} 个条件")
+    col_m2.metric("枚举组合数", f"{stats['evaluated']:,}", f"幸存 {stats['survived']:,}")
+    col_m3.metric("耗时", f"{res['build_seconds'] + res['mine_seconds']:.1f} 秒",
+                  f"位图 {res['build_seconds']:.1f}s · 枚举 {res['mine_seconds']:.1f}s", delta_color="off")
+    if stats.get("base_mean") is not None:
+        col_m4.metric(f"全样本 {res['horizon']} 日平均收益", f"{stats['base_mean'] * 100:.2f}%",
+                      f"胜率 {stats['base_win_rate'] * 100:.1f}%", delta_color="off")
+
+    top_df = res["top_df"]
+    if top_df.empty:
+        st.info("没有组合达到最少触发次数，试试降低剪枝阈值或放宽样本区间。")
+    else:
+        st.caption("⚠️ 相邻交易日的远期收益区间互相重叠，Z 值会偏高，只适合做相对排序，不代表严格的统计显著性。")
+        st.dataframe(
+            top_df.style.format({
+                "胜率": "{:.1%}", "平均收益": "{:.2%}", "中位收益": "{:.2%}", "超额收益": "{:.2%}", "显著性(Z)": "{:.2f}"
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+        picked = st.selectbox("📋 复制组合的买入表达式 (可粘贴到回测舱的自定义买入逻辑)", top_df["组合"].tolist())
+        st.code(top_df.loc[top_df["组合"] == picked, "买入表达式"].iloc[0], language="python")
+
+# --- 单信号事件研究 ---
+st.markdown("---")
+st.markdown("### 🔭 单信号事件研究 (Event Study)")
+st.caption("不跑撮合，只回答“条件触发之后 1/5/10/20 个交易日会发生什么”：找出全部股票的每个触发日，统计远期收益分布、胜率与平均路径，并与同期所有交易日的无条件表现对照。停牌日既不触发事件，也不计入持有天数。")
+
+default_expr = "MACD_Golden_Cross == True and Close_Qfq > MA_60"
+if st.session_state.get("mining_results") and not st.session_state.mining_results["top_df"].empty:
+    default_expr = st.session_state.mining_results["top_df"]["买入表达式"].iloc[0]
+event_expr = st.text_area("事件条件 (Pandas Expression)", value=default_expr, height=80)
+col_e1, col_e2 = st.columns(2)
+event_horizons = col_e1.multiselect("统计持有期 (交易日)", [1, 3, 5, 10, 20, 40, 60], default=[1, 5, 10, 20])
+event_cooldown = col_e2.number_input("同一股票两次事件的最小间隔 (交易日，0 = 每个触发日都算)", min_value=0, max_value=250, value=0)
+
+if st.button("🔭 运行事件研究", use_container_width=True):
+    from event_study import run_event_study
+    from strategy_expr import StrategyExpressionError
+
+    if not event_horizons:
+        st.warning("请至少选择一个持有期。")
+        st.stop()
+    progress_bar = st.progress(0, text="正在扫描触发日...")
+    t0 = time.perf_counter()
+    try:
+        study = run_event_study(
+            available_stocks, vault_dir, event_expr, horizons=event_horizons, start_date=start_date, end_date=end_date,
+            cooldown=int(event_cooldown),
+            progress=lambda done, total, code: progress_bar.progress(done / total, text=f"事件扫描中: {code} ({done}/{total})")
+        )
+    except StrategyExpressionError as e:
+        st.error(f"🚫 事件条件有误: {e}")
+        st.stop()
+    study["seconds"] = time.perf_counter() - t0
+    progress_bar.progress(1.0, text="事件研究完成！")
+    st.session_state.event_study = study
+
+if st.session_state.get("event_study"):
+    import plotly.express as px
+
+    study = st.session_state.event_study
+    st.success(f"✅ `{study['expression']}`：{study['n_stocks']} 只股票，{len(study['events']):,} 个事件，耗时 {study['seconds']:.2f} 秒")
+    if not study["errors"].empty:
+        with st.expander(f"⚠️ {len(study['errors'])} 只股票研究失败"):
+            st.dataframe(study["errors"], use_container_width=True, hide_index=True)
+
+    pct_cols = ["平均收益", "中位收益", "胜率", "标准差", "基准平均", "基准胜率", "P5", "P25", "P75", "P95", "超额收益"]
+    st.dataframe(study["summary"].style.format({c: "{:.2%}" for c in pct_cols}, na_rep="-"),
+                 use_container_width=True, hide_index=True)
+
+    path_long = study["path"].melt(id_vars="交易日", var_name="曲线", value_name="累计收益")
+    fig_path = px.line(path_long, x="交易日", y="累计收益", color="曲线", markers=True)
+    fig_path.update_layout(template="plotly_dark", height=380, yaxis_tickformat=".1%", xaxis_title="事件后第 N 个交易日")
+    st.plotly_chart(fig_path, use_container_width=True)
+
+    main_col = f"R{study['main_horizon']}"
+    col_d1, col_d2 = st.columns(2)
+    with col_d1:
+        st.markdown(f"**{study['main_horizon']} 日远期收益分布**")
+        if not study["events"].empty:
+            fig_hist = px.histogram(study["events"].dropna(subset=[main_col]), x=main_col, nbins=60)
+            fig_hist.update_layout(template="plotly_dark", height=320, xaxis_tickformat=".0%", xaxis_title="", yaxis_title="事件数")
+            st.plotly_chart(fig_hist, use_container_width=True)
+    with col_d2:
+        st.markdown(f"**逐年表现 ({study['main_horizon']} 日)**")
+        st.dataframe(study["by_year"].style.format({"平均收益": "{:.2%}", "胜率": "{:.1%}"}, na_rep="-"),
+                     use_container_width=True, hide_index=True, height=320)
+
+    with st.expander("📋 逐股表现与事件明细"):
+        st.dataframe(study["by_stock"].style.format({"平均收益": "{:.2%}", "胜率": "{:.1%}"}, na_rep="-"),
+                     use_container_width=True, hide_index=True)
+        events_show = study["events"].copy()
+        events_show["Date"] = events_show["Date"].dt.date
+        st.dataframe(events_show, use_container_width=True, hide_index=True)
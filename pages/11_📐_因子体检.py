@@ -0,0 +1,133 @@
+import streamlit as st
+import os
+import time
+import datetime
+from utils import inject_custom_css, check_authentication, render_sidebar
+
+st.set_page_config(page_title="因子体检 - 截面 IC 与分层收益", layout="wide")
+inject_custom_css()
+check_authentication()
+render_sidebar()
+
+# 页面权限检查 (与回测页相同)
+if st.session_state.get('user_role') != 'admin' and not st.session_state.get('can_backtest'):
+    st.error("🚫 您的账户暂无专业回测权限。请联系管理员开启！")
+    st.stop()
+
+st.title("📐 因子体检")
+st.caption("每个交易日把 Vault 里的全部股票按某个因子列 (如 BIAS_12、Turnover_ZScore、PE_Percentile_3Y) 截面排序，"
+           "计算 Rank IC 及其随持有期的衰减、分层远期收益与多空净值、顶 / 底层换手。所有计算都在【日期 x 股票】矩阵上一次完成。")
+
+vault_dir = "backtest_data/final_vault"
+available_stocks = []
+if os.path.exists(vault_dir):
+    available_stocks = sorted(f.replace('.parquet', '') for f in os.listdir(vault_dir) if f.endswith('.parquet'))
+
+if not available_stocks:
+    st.warning("⚠️ 底层数据库为空，请先运行数据采集抓取脚本！")
+    st.stop()
+
+from factor_analysis import DEFAULT_IC_HORIZONS, numeric_factor_columns, score_factors
+from panel_store import PANEL_STORE_DIR
+
+all_factors = numeric_factor_columns(os.path.join(vault_dir, f"{available_stocks[0]}.parquet"))
+
+# --- 参数 ---
+st.markdown("### 1. 因子与参数")
+picked_factors = st.multiselect("参与体检的因子列 (默认全部数值因子)", all_factors, default=all_factors)
+col_p1, col_p2, col_p3, col_p4 = st.columns(4)
+ic_horizons = col_p1.multiselect("IC 持有期 (交易日)", [1, 2, 3, 5, 10, 20, 40, 60], default=list(DEFAULT_IC_HORIZONS))
+main_horizon = col_p2.selectbox("打分表使用的持有期", sorted(ic_horizons) or [1], index=min(3, max(len(ic_horizons) - 1, 0)))
+n_quantiles = col_p3.number_input("分层数", min_value=2, max_value=20, value=5, step=1)
+min_stocks = col_p4.number_input("单日最少股票数 (不足则当日不计)", min_value=3, max_value=1000,
+                                 value=min(30, max(len(available_stocks) // 2, 3)), step=1)
+col_p5, col_p6 = st.columns(2)
+start_date = col_p5.date_input("样本起始日期", value=datetime.date(2010, 1, 1), min_value=datetime.date(1990, 1, 1), max_value=datetime.date.today())
+end_date = col_p6.date_input("样本截止日期", value=datetime.date.today(), min_value=datetime.date(1990, 1, 1), max_value=datetime.date.today())
+
+if st.button("📐 开始体检", type="primary", use_container_width=True):
+    if not picked_factors or not ic_horizons:
+        st.warning("请至少选择一个因子和一个持有期。")
+        st.stop()
+    horizons = sorted(set(ic_horizons) | {1})  # 分层净值固定用 1 日收益复利
+    progress_bar = st.progress(0, text="正在拼装日期 x 股票面板...")
+
+    def on_progress(done, total, code):
+        progress_bar.progress(done / total, text=f"面板加载中: {code} ({done}/{total})")
+
+    t0 = time.perf_counter()
+    scorecard, results = score_factors(available_stocks, vault_dir, factor_columns=picked_factors, horizons=horizons,
+                                       n_quantiles=int(n_quantiles), min_stocks=int(min_stocks),
+                                       start_date=start_date, end_date=end_date, main_horizon=int(main_horizon),
+                                       panel_dir=PANEL_STORE_DIR, progress=on_progress)
+    progress_bar.progress(1.0, text="体检完成！")
+    st.session_state.factor_report = {
+        "scorecard": scorecard, "results": results, "seconds": time.perf_counter() - t0,
+        "main_horizon": int(main_horizon), "n_stocks": len(available_stocks)
+    }
+
+if st.session_state.get("factor_report"):
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    report = st.session_state.factor_report
+    st.markdown("---")
+    st.markdown("### 2. 因子打分表")
+    st.success(f"✅ {len(report['results'])} 个因子 x {report['n_stocks']} 只股票，耗时 {report['seconds']:.1f} 秒"
+               f" (按 {report['main_horizon']} 日 |ICIR| 排序)")
+    st.caption("⚠️ 持有期大于 1 日时相邻交易日的远期收益互相重叠，t 值会偏高，只适合做相对排序。")
+    st.dataframe(
+        report["scorecard"].style.format({
+            "IC均值": "{:.4f}", "ICIR": "{:.3f}", "IC>0占比": "{:.1%}", "t值": "{:.2f}",
+            "多空年化": "{:.2%}", "顶层换手": "{:.1%}", "排名自相关": "{:.3f}"
+        }, na_rep="-"),
+        use_container_width=True,
+        hide_index=True
+    )
+
+    st.markdown("### 3. 单因子明细")
+    factor = st.selectbox("选择因子", report["scorecard"]["因子"].tolist())
+    res = report["results"][factor]
+
+    col_d1, col_d2 = st.columns(2)
+    with col_d1:
+        st.markdown("**IC 衰减 (各持有期 IC 均值)**")
+        fig_decay = px.bar(res["ic_summary"], x="持有期", y="IC均值", text_auto=".4f")
+        fig_decay.update_layout(template="plotly_dark", height=320, xaxis_type="category", xaxis_title="持有期 (交易日)")
+        st.plotly_chart(fig_decay, use_container_width=True)
+    with col_d2:
+        st.markdown(f"**分层平均远期收益 ({report['main_horizon']} 日)**")
+        q_ret = res["quantile_returns"]
+        if report["main_horizon"] in q_ret.index:
+            q_row = q_ret.loc[report["main_horizon"]].reset_index()
+            q_row.columns = ["分层", "平均收益"]
+            fig_q = px.bar(q_row, x="分层", y="平均收益", text_auto=".2%")
+            fig_q.update_layout(template="plotly_dark", height=320, yaxis_tickformat=".2%")
+            st.plotly_chart(fig_q, use_container_width=True)
+
+    st.markdown("**分层净值与多空净值 (1 日远期收益逐日复利，Q1 = 因子最小)**")
+    cum = res["cum_quantile"].dropna(how="all")
+    fig_cum = go.Figure()
+    for col in cum.columns:
+        fig_cum.add_trace(go.Scatter(x=cum.index, y=cum[col], mode="lines", name=col,
+                                     line=dict(width=3 if col == "多空" else 1.5, dash="dash" if col == "多空" else None)))
+    fig_cum.update_layout(template="plotly_dark", height=420, hovermode="x unified")
+    st.plotly_chart(fig_cum, use_container_width=True)
+
+    col_d3, col_d4 = st.columns(2)
+    with col_d3:
+        st.markdown("**滚动 IC (60 日均值)**")
+        rolling_ic = res["ic"].rolling(60, min_periods=20).mean()
+        rolling_ic.columns = [f"{h} 日" for h in rolling_ic.columns]
+        fig_ic = px.line(rolling_ic, labels={"value": "IC", "index": "", "variable": "持有期"})
+        fig_ic.update_layout(template="plotly_dark", height=320)
+        st.plotly_chart(fig_ic, use_container_width=True)
+    with col_d4:
+        st.markdown("**IC 统计**")
+        st.dataframe(res["ic_summary"].style.format({
+            "IC均值": "{:.4f}", "IC标准差": "{:.4f}", "ICIR": "{:.3f}", "IC>0占比": "{:.1%}", "t值": "{:.2f}"
+        }, na_rep="-"), use_container_width=True, hide_index=True)
+        col_m1, col_m2, col_m3 = st.columns(3)
+        col_m1.metric("底层日换手", f"{res['turnover'].iloc[0]:.1%}")
+        col_m2.metric("顶层日换手", f"{res['turnover'].iloc[-1]:.1%}")
+        col_m3.metric("排名日间自相关", f"{res['rank_autocorr']:.3f}")
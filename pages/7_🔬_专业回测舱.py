@@ -4,7 +4,8 @@ import numpy as np
 import os
 import plotly.graph_objects as go
 import datetime
-from utils import get_db, inject_custom_css, check_authentication, render_sidebar
+import time
+from utils import get_db, inject_custom_css, check_authentication, render_sidebar, render_job_panel
 
 st.set_page_config(page_title="专业回测舱 - AI 智能投顾", layout="wide")
 inject_custom_css()
@@ -255,99 +256,119 @@ with col_main:
     custom_sell = st.text_input("注入自定义卖出逻辑 (Pandas Expression)", placeholder="例如: MACD_Hist < 0", key="custom_sell_key")
 
     st.markdown("---")
+    # 从 UI 的 Checkbox 中拼接出 Pandas query 字符串 (单次回测与参数扫描共用)
+    buy_conditions = []
+    if buy_ma: buy_conditions.append(f"(Close_Qfq > {buy_ma_col})")
+    if buy_ma_bull: buy_conditions.append("(MA_5 > MA_10 and MA_10 > MA_20 and MA_20 > MA_60)")
+    if buy_bias12: buy_conditions.append(f"(BIAS_12 < {buy_bias12_val})")
+    if buy_macd: buy_conditions.append(f"(MACD_Hist > {buy_macd_val})")
+    if buy_macd_gc: buy_conditions.append("(MACD_Golden_Cross == True)")
+    if buy_kdj: buy_conditions.append(f"(KDJ_J < {buy_kdj_j} and KDJ_K < {buy_kdj_k} and KDJ_D < {buy_kdj_d})")
+    if buy_pb: buy_conditions.append(f"(PB < {buy_pb_val})")
+    if buy_boll_lower: buy_conditions.append("(Close_Qfq <= BOLL_Lower)")
+    if buy_turnover: buy_conditions.append(f"(Turnover_ZScore > {buy_turn_z})")
+    if buy_vol_ratio: buy_conditions.append(f"(Vol_Ratio_5D > {buy_vol_ratio_val})")
+    if buy_vol_shrink: buy_conditions.append("(Vol_Shrink_20D == True)")
+    if buy_limit_down: buy_conditions.append("(Limit_Down_Count_5 == 0)")
+    if buy_limit_up_count: 
+        col_lk = "Limit_Up_Count_5" if limit_up_period == "5日内" else "Limit_Up_Count_10"
+        buy_conditions.append(f"({col_lk} >= {limit_up_min})")
+    if buy_seal_ratio: buy_conditions.append(f"(Limit_Up_Seal_Ratio >= {seal_ratio_min})")
+    if buy_roe: buy_conditions.append(f"(ROE > {buy_roe_val})")
+    if buy_mv: buy_conditions.append(f"(Total_MV >= {buy_mv_val[0] * 100000000} and Total_MV <= {buy_mv_val[1] * 100000000})") # 转换为元
+    if buy_pe: buy_conditions.append(f"(PE_Percentile_3Y < {buy_pe_val})")
+    if buy_rsi: buy_conditions.append(f"(RSI_14 < {buy_rsi_val})")
+    if buy_yoy: buy_conditions.append(f"(NetProfit_YOY > {buy_yoy_val})")
+    if buy_deducted_yoy: buy_conditions.append(f"(DeductedNetProfit_YOY > {buy_deducted_yoy_val})")
+    if buy_rev_yoy: buy_conditions.append(f"(Revenue_YOY > {buy_rev_yoy_val})")
+    if custom_buy.strip(): buy_conditions.append(f"({custom_buy.strip()})")
+    
+    sell_conditions = []
+    if sell_ma: sell_conditions.append(f"(Close_Qfq < {sell_ma_col})")
+    if sell_ma_bear: sell_conditions.append("(MA_5 < MA_10 and MA_10 < MA_20 and MA_20 < MA_60)")
+    if sell_bias6: sell_conditions.append(f"(BIAS_6 > {sell_bias6_val})")
+    if sell_macd: sell_conditions.append(f"(MACD_Hist < {sell_macd_val})")
+    if sell_macd_dc: sell_conditions.append("(MACD_Dead_Cross == True)")
+    if sell_kdj: sell_conditions.append(f"(KDJ_J > {sell_kdj_j} and KDJ_K > {sell_kdj_k} and KDJ_D > {sell_kdj_d})")
+    if sell_rsi: sell_conditions.append(f"(RSI_14 > {sell_rsi_val})")
+    if sell_boll: sell_conditions.append("(Close_Qfq >= BOLL_Upper)")
+    if custom_sell.strip(): sell_conditions.append(f"({custom_sell.strip()})")
+    
+    # 生成最终的 eval 语句
+    buy_joiner = " and " if "AND" in buy_logic_type else " or "
+    sell_joiner = " and " if "AND" in sell_logic_type else " or "
+    
+    final_buy_logic = buy_joiner.join(buy_conditions) if buy_conditions else "False"
+    final_sell_logic = sell_joiner.join(sell_conditions) if sell_conditions else "False"
+    
+    # 处理可选的刹车参数
+    v_sl = stop_loss / 100.0 if stop_loss > 0 else None
+    v_tp = take_profit / 100.0 if take_profit > 0 else None
+    v_md = int(max_days) if max_days > 0 else None
+    
+    data_path = f"backtest_data/final_vault/{stock_code}.parquet"
+
+    profile_memory = st.checkbox("⏱️ 性能画像同时记录各阶段峰值内存 (会拖慢逐日大循环)", value=False)
+    use_registry = st.checkbox("🗂️ 参数与数据都没变时直接调取回测档案 (取消勾选则强制重算)", value=True)
+
+    runner_kwargs = {
+        "initial_cash": initial_cash,
+        "commission": commission,
+        "stamp_duty": stamp_duty,
+        "slippage": slippage,
+        "buy_logic": final_buy_logic,
+        "sell_logic": final_sell_logic,
+        "stop_loss_pct": v_sl,
+        "take_profit_pct": v_tp,
+        "max_hold_days": v_md,
+        "start_date": start_date,
+        "end_date": end_date
+    }
+
     if st.button("🚀 组合参数，开始专业级回测大炮", type="primary", use_container_width=True):
         st.toast("正在组装策略大循环...", icon="⚡")
         
-        # 1. 检查数据文件是否存在
-        data_path = f"backtest_data/final_vault/{stock_code}.parquet"
+        # 检查数据文件是否存在
         if not os.path.exists(data_path):
             st.error(f"抱歉，未找到 {stock_code} 的超级数据库缓存。请先在后台运行数据采集脚本。")
             st.stop()
-            
-        # 2. 从 UI 的 Checkbox 中拼接出 Pandas query 字符串
-        buy_conditions = []
-        if buy_ma: buy_conditions.append(f"(Close_Qfq > {buy_ma_col})")
-        if buy_ma_bull: buy_conditions.append("(MA_5 > MA_10 and MA_10 > MA_20 and MA_20 > MA_60)")
-        if buy_bias12: buy_conditions.append(f"(BIAS_12 < {buy_bias12_val})")
-        if buy_macd: buy_conditions.append(f"(MACD_Hist > {buy_macd_val})")
-        if buy_macd_gc: buy_conditions.append("(MACD_Golden_Cross == True)")
-        if buy_kdj: buy_conditions.append(f"(KDJ_J < {buy_kdj_j} and KDJ_K < {buy_kdj_k} and KDJ_D < {buy_kdj_d})")
-        if buy_pb: buy_conditions.append(f"(PB < {buy_pb_val})")
-        if buy_boll_lower: buy_conditions.append("(Close_Qfq <= BOLL_Lower)")
-        if buy_turnover: buy_conditions.append(f"(Turnover_ZScore > {buy_turn_z})")
-        if buy_vol_ratio: buy_conditions.append(f"(Vol_Ratio_5D > {buy_vol_ratio_val})")
-        if buy_vol_shrink: buy_conditions.append("(Vol_Shrink_20D == True)")
-        if buy_limit_down: buy_conditions.append("(Limit_Down_Count_5 == 0)")
-        if buy_limit_up_count: 
-            col_lk = "Limit_Up_Count_5" if limit_up_period == "5日内" else "Limit_Up_Count_10"
-            buy_conditions.append(f"({col_lk} >= {limit_up_min})")
-        if buy_seal_ratio: buy_conditions.append(f"(Limit_Up_Seal_Ratio >= {seal_ratio_min})")
-        if buy_roe: buy_conditions.append(f"(ROE > {buy_roe_val})")
-        if buy_mv: buy_conditions.append(f"(Total_MV >= {buy_mv_val[0] * 100000000} and Total_MV <= {buy_mv_val[1] * 100000000})") # 转换为元
-        if buy_pe: buy_conditions.append(f"(PE_Percentile_3Y < {buy_pe_val})")
-        if buy_rsi: buy_conditions.append(f"(RSI_14 < {buy_rsi_val})")
-        if buy_yoy: buy_conditions.append(f"(NetProfit_YOY > {buy_yoy_val})")
-        if buy_deducted_yoy: buy_conditions.append(f"(DeductedNetProfit_YOY > {buy_deducted_yoy_val})")
-        if buy_rev_yoy: buy_conditions.append(f"(Revenue_YOY > {buy_rev_yoy_val})")
-        if custom_buy.strip(): buy_conditions.append(f"({custom_buy.strip()})")
-        
-        sell_conditions = []
-        if sell_ma: sell_conditions.append(f"(Close_Qfq < {sell_ma_col})")
-        if sell_ma_bear: sell_conditions.append("(MA_5 < MA_10 and MA_10 < MA_20 and MA_20 < MA_60)")
-        if sell_bias6: sell_conditions.append(f"(BIAS_6 > {sell_bias6_val})")
-        if sell_macd: sell_conditions.append(f"(MACD_Hist < {sell_macd_val})")
-        if sell_macd_dc: sell_conditions.append("(MACD_Dead_Cross == True)")
-        if sell_kdj: sell_conditions.append(f"(KDJ_J > {sell_kdj_j} and KDJ_K > {sell_kdj_k} and KDJ_D > {sell_kdj_d})")
-        if sell_rsi: sell_conditions.append(f"(RSI_14 > {sell_rsi_val})")
-        if sell_boll: sell_conditions.append("(Close_Qfq >= BOLL_Upper)")
-        if custom_sell.strip(): sell_conditions.append(f"({custom_sell.strip()})")
-        
-        # 3. 生成最终的 eval 语句
-        buy_joiner = " and " if "AND" in buy_logic_type else " or "
-        sell_joiner = " and " if "AND" in sell_logic_type else " or "
-        
-        final_buy_logic = buy_joiner.join(buy_conditions) if buy_conditions else "False"
-        final_sell_logic = sell_joiner.join(sell_conditions) if sell_conditions else "False"
-        
-        # 处理可选的刹车参数
-        v_sl = stop_loss / 100.0 if stop_loss > 0 else None
-        v_tp = take_profit / 100.0 if take_profit > 0 else None
-        v_md = int(max_days) if max_days > 0 else None
         
         st.info(f"⚙️ 后台编译的最终买点逻辑: `{final_buy_logic}`")
         st.info(f"⚙️ 后台编译的最终卖点逻辑: `{final_sell_logic}`")
         
-        # 跑核心引擎!
-        with st.spinner(f"正在驱动十万次级别的逐日矩阵模拟倒推，请耐心等待..."):
-            from strategy_runner import StrategyRunner
-            
-            try:
-                runner = StrategyRunner(
-                    data_path=data_path,
-                    initial_cash=initial_cash,
-                    commission=commission,
-                    stamp_duty=stamp_duty,
-                    slippage=slippage,
-                    buy_logic=final_buy_logic,
-                    sell_logic=final_sell_logic,
-                    stop_loss_pct=v_sl,
-                    take_profit_pct=v_tp,
-                    max_hold_days=v_md,
-                    start_date=start_date,
-                    end_date=end_date
-                )
-                curve_df, trades = runner.run()
-                report = runner.generate_report(curve_df)
-                
-                # 将结果保存到 Session State 中，确保 UI 操作不会导致数据丢失
-                st.session_state.backtest_results = {
-                    "curve_df": curve_df,
-                    "trades": trades,
-                    "report": report,
-                    "stock_code": stock_code
-                }
-            except Exception as outer_err:
-                st.error(f"引擎执行错误: {outer_err}")
+        # 命中档案直接读档；否则把回测交给后台任务队列，脚本线程立刻返回，页面随后轮询进度
+        from run_registry import RunRegistry, run_key
+        from strategy_expr import StrategyExpressionError
+        try:
+            registry_key = run_key("single", [stock_code], [data_path], runner_kwargs)
+        except StrategyExpressionError as e:
+            st.error(f"引擎执行错误: {e}")
+            st.stop()
+        cached = RunRegistry().load_single(registry_key) if use_registry else None
+        if cached is not None:
+            st.session_state.backtest_results = cached
+            st.success(f"⚡ 命中回测档案 `{registry_key}`：参数与 Vault 数据都没变，直接读档，未重新撮合。")
+        else:
+            from job_queue import JOB_QUEUE
+            from batch_runner import single_backtest_job
+            st.session_state.backtest_job = JOB_QUEUE.submit(
+                single_backtest_job, stock_code, data_path, runner_kwargs, profile_memory=profile_memory,
+                registry_key=registry_key, kind="single", label=stock_code, owner=st.session_state.get("username"))
+
+    # ------ 后台回测任务：轮询进度 / 取消 / 取回结果 ------
+    if st.session_state.get("backtest_job"):
+        from job_queue import JOB_QUEUE
+        job = render_job_panel(st.session_state.backtest_job, "🛰️ 后台回测", key="cancel_backtest_job")
+        if job is not None:
+            if job["state"] == "done":
+                st.session_state.backtest_results = JOB_QUEUE.result(job["id"])
+                st.toast("回测完成，结果已自动归档！", icon="✅")
+            elif job["state"] == "failed":
+                st.error(f"引擎执行错误: {job['error']}")
+            elif job["state"] == "cancelled":
+                st.warning("回测任务已取消。")
+            JOB_QUEUE.forget(job["id"])
+            del st.session_state.backtest_job
 
     # ------ 绘制极其华丽的图表与报表区 (独立于按钮状态) ------
     if 'backtest_results' in st.session_state:
@@ -468,11 +489,357 @@ with col_main:
         else:
             st.info("该阶段无有效的对比数据。")
         
+        # 往返交易台账
+        with st.expander("🔁 往返交易台账 (开平仓配对 · 含费盈亏)", expanded=False):
+            round_trips = report.get("Round_Trips")
+            if round_trips is not None and not round_trips.empty:
+                rt_show = round_trips.copy()
+                rt_show['Entry_Date'] = rt_show['Entry_Date'].dt.date
+                rt_show['Exit_Date'] = rt_show['Exit_Date'].dt.date
+                rt_c1, rt_c2, rt_c3 = st.columns(3)
+                rt_c1.metric("含费净盈亏合计", f"¥ {rt_show['PnL'].sum():,.0f}")
+                rt_c2.metric("单笔平均收益", f"{rt_show['Return_Pct'].mean()*100:.2f}%")
+                rt_c3.metric("平均持有交易日", f"{rt_show['Holding_Days'].mean():.1f} 天")
+                st.dataframe(
+                    rt_show.style.format({"Entry_Cost": "{:,.2f}", "Exit_Proceeds": "{:,.2f}", "Fees": "{:,.2f}",
+                                          "PnL": "{:,.2f}", "Return_Pct": "{:.2%}"}),
+                    use_container_width=True,
+                    hide_index=True
+                )
+            else:
+                st.caption("回测周期内没有完成的往返交易。")
+        
         # 流水单
         with st.expander("📝 详细交易履历表 (Trading Logs)", expanded=False):
             if trades:
-                trades_df = pd.DataFrame(trades)
+                trades_df = trades.to_frame() if hasattr(trades, "to_frame") else pd.DataFrame(trades)
                 trades_df['Date'] = trades_df['Date'].dt.date
                 st.dataframe(trades_df, use_container_width=True)
             else:
                 st.caption("回测周期内没有发生任何交易。")
+        
+        # 性能画像：时间都花在哪一步
+        profile = res.get("profile")
+        if profile:
+            from stage_profiler import profile_to_frame, counters_to_frame
+            with st.expander(f"⏱️ 性能画像 (总耗时 {profile['total_seconds']:.3f} 秒)", expanded=False):
+                prof_df = profile_to_frame(profile)
+                fmt = {"耗时(秒)": "{:.4f}", "耗时占比": "{:.1%}", "处理行数": "{:,.0f}", "吞吐(行/秒)": "{:,.0f}"}
+                if profile["track_memory"]:
+                    fmt["峰值内存(MB)"] = "{:.2f}"
+                else:
+                    prof_df = prof_df.drop(columns=["峰值内存(MB)"])
+                st.dataframe(prof_df.style.format(fmt, na_rep="-"), use_container_width=True, hide_index=True)
+                if profile["counters"]:
+                    st.dataframe(counters_to_frame(profile), use_container_width=True, hide_index=True)
+                st.caption("行情读取计入构造阶段；峰值内存为该阶段内 Python / numpy 新分配的峰值 (tracemalloc)，不含 Arrow 缓冲区。")
+        
+        # 蒙特卡洛稳健性体检
+        st.markdown("### 🎲 蒙特卡洛稳健性体检 (运气 vs 真本事)")
+        st.caption("把这条净值曲线的日收益按区块重抽、把往返交易打乱先后或有放回重抽，跑上万条平行宇宙，看收益、回撤、夏普的置信区间。")
+        mc_c1, mc_c2, mc_c3 = st.columns([1, 1, 1])
+        with mc_c1:
+            mc_paths = st.select_slider("模拟路径数", options=[1000, 2000, 5000, 10000, 20000], value=10000)
+        with mc_c2:
+            mc_block = st.number_input("日收益区块长度 (天)", min_value=1, max_value=60, value=5, step=1,
+                                       help="区块内保留波动聚集与短期自相关；1 为独立同分布重抽 (最慢)")
+        with mc_c3:
+            st.write("")
+            run_mc = st.button("🎲 开始蒙特卡洛模拟", use_container_width=True)
+        
+        if run_mc:
+            from monte_carlo import run_robustness
+            with st.spinner("批量矩阵模拟中..."):
+                st.session_state.mc_results = {
+                    "stock_code": bk_stock_code,
+                    "result": run_robustness(curve_df, report.get("Round_Trips"), n_paths=int(mc_paths), block_size=int(mc_block))
+                }
+        
+        mc_res = st.session_state.get("mc_results")
+        if mc_res and mc_res["stock_code"] == bk_stock_code:
+            mc_out = mc_res["result"]
+            metric_names = {"Total_Return": "总收益", "Max_Drawdown": "最大回撤", "Sharpe_Ratio": "夏普比率"}
+            
+            def show_mc_table(df_mc):
+                df_show = df_mc.copy()
+                df_show["指标"] = df_show["指标"].map(metric_names)
+                pct_cols = [c for c in df_show.columns if c not in ("指标", "实际值所处分位")]
+                fmt = {c: "{:.2%}" for c in pct_cols}
+                fmt["实际值所处分位"] = "{:.0%}"
+                # 夏普不是百分比，单独按小数显示
+                styled = df_show.style.format(fmt)
+                if "夏普比率" in df_show["指标"].values:
+                    styled = styled.format("{:.2f}", subset=pd.IndexSlice[df_show.index[df_show["指标"] == "夏普比率"], pct_cols])
+                st.dataframe(styled, use_container_width=True, hide_index=True)
+            
+            st.metric("日收益重抽下最终亏损的概率", f"{mc_out['loss_probability']*100:.1f}%")
+            tab_d, tab_s, tab_b = st.tabs(["📈 日收益区块自助", "🔀 交易顺序重排", "♻️ 交易有放回重抽"])
+            with tab_d:
+                show_mc_table(mc_out["daily_bootstrap"])
+                samples = mc_out["samples"]["daily_bootstrap"]
+                fig_mc = go.Figure()
+                fig_mc.add_trace(go.Histogram(x=samples["Total_Return"] * 100, nbinsx=80, name="模拟总收益 (%)", marker_color="#f39c12"))
+                fig_mc.add_vline(x=report["Total_Return"] * 100, line_color="red", line_dash="dash", annotation_text="实际回测")
+                fig_mc.update_layout(template="plotly_dark", height=300, margin=dict(l=0, r=0, t=30, b=0), xaxis_title="总收益 (%)")
+                st.plotly_chart(fig_mc, use_container_width=True)
+            with tab_s:
+                if mc_out["trade_reshuffle"].empty:
+                    st.info("没有完成的往返交易，无法做交易顺序重排。")
+                else:
+                    st.caption("同样的交易换个先后顺序，总收益不变，回撤分布反映“回撤有多少是运气排出来的”。")
+                    show_mc_table(mc_out["trade_reshuffle"])
+                    fig_dd = go.Figure(go.Histogram(x=mc_out["samples"]["trade_reshuffle"]["Max_Drawdown"] * 100, nbinsx=60, marker_color="#00fa9a"))
+                    fig_dd.update_layout(template="plotly_dark", height=300, margin=dict(l=0, r=0, t=30, b=0), xaxis_title="最大回撤 (%)")
+                    st.plotly_chart(fig_dd, use_container_width=True)
+            with tab_b:
+                if mc_out["trade_bootstrap"].empty:
+                    st.info("没有完成的往返交易，无法做交易重抽。")
+                else:
+                    st.caption("从历史往返交易中有放回地抽取同样笔数，衡量收益是否只靠少数几笔大单撑着。")
+                    show_mc_table(mc_out["trade_bootstrap"])
+
+    # ------ 风控刹车参数网格扫描 ------
+    st.markdown("---")
+    st.markdown("### 🧪 风控刹车参数寻优 (网格扫描)")
+    st.caption("沿用上方组装好的买卖逻辑与摩擦成本：行情只读一次、信号只算一次，然后把所有 止损 × 止盈 × 最长持仓 组合当作 N 个账户，在向量内核里单进程一遍跑完。")
+    with st.expander("⚙️ 配置扫描区间", expanded=False):
+        sw_c1, sw_c2, sw_c3 = st.columns(3)
+        with sw_c1:
+            st.write("**止损线 (-%)**")
+            sl_from = st.number_input("止损起点", min_value=0.0, max_value=50.0, value=3.0, step=1.0, key="sw_sl_from")
+            sl_to = st.number_input("止损终点", min_value=0.0, max_value=50.0, value=15.0, step=1.0, key="sw_sl_to")
+            sl_step = st.number_input("止损步长", min_value=0.0, max_value=20.0, value=2.0, step=0.5, key="sw_sl_step")
+        with sw_c2:
+            st.write("**止盈线 (+%)**")
+            tp_from = st.number_input("止盈起点", min_value=0.0, max_value=200.0, value=0.0, step=5.0, key="sw_tp_from", help="0 表示不止盈")
+            tp_to = st.number_input("止盈终点", min_value=0.0, max_value=200.0, value=50.0, step=5.0, key="sw_tp_to")
+            tp_step = st.number_input("止盈步长", min_value=0.0, max_value=100.0, value=10.0, step=5.0, key="sw_tp_step")
+        with sw_c3:
+            st.write("**最长持仓 (天)**")
+            md_from = st.number_input("持仓起点", min_value=0, max_value=500, value=0, step=5, key="sw_md_from", help="0 表示不限天数")
+            md_to = st.number_input("持仓终点", min_value=0, max_value=500, value=60, step=5, key="sw_md_to")
+            md_step = st.number_input("持仓步长", min_value=0, max_value=250, value=20, step=5, key="sw_md_step")
+
+        from param_sweep import build_param_grid
+        sl_grid = build_param_grid(sl_from / 100.0, sl_to / 100.0, sl_step / 100.0)
+        tp_grid = build_param_grid(tp_from / 100.0, tp_to / 100.0, tp_step / 100.0)
+        md_grid = build_param_grid(int(md_from), int(md_to), int(md_step))
+        st.caption(f"共 {len(sl_grid) * len(tp_grid) * len(md_grid)} 组参数组合待扫描。")
+
+        if st.button("🧪 启动参数网格扫描", use_container_width=True):
+            if not os.path.exists(data_path):
+                st.error(f"抱歉，未找到 {stock_code} 的超级数据库缓存。请先在后台运行数据采集脚本。")
+            else:
+                # 扫描交给后台任务队列，脚本线程立刻返回，页面随后轮询进度
+                from job_queue import JOB_QUEUE
+                from param_sweep import param_sweep_job
+                st.session_state.sweep_job = {
+                    "id": JOB_QUEUE.submit(
+                        param_sweep_job, data_path, final_buy_logic, final_sell_logic,
+                        stop_loss_list=sl_grid,
+                        take_profit_list=tp_grid,
+                        max_hold_list=md_grid,
+                        initial_cash=initial_cash,
+                        commission=commission,
+                        stamp_duty=stamp_duty,
+                        slippage=slippage,
+                        start_date=start_date,
+                        end_date=end_date,
+                        kind="sweep", label=f"{stock_code} 参数扫描", owner=st.session_state.get("username")),
+                    "stock_code": stock_code
+                }
+
+    if st.session_state.get("sweep_job"):
+        from job_queue import JOB_QUEUE
+        sweep_job = st.session_state.sweep_job
+        job = render_job_panel(sweep_job["id"], "🧪 参数网格扫描", key="cancel_sweep_job")
+        if job is not None:
+            if job["state"] == "done":
+                st.session_state.sweep_results = {"df": JOB_QUEUE.result(job["id"]), "stock_code": sweep_job["stock_code"]}
+            elif job["state"] == "failed":
+                st.error(f"参数扫描执行错误: {job['error']}")
+            elif job["state"] == "cancelled":
+                st.warning("参数扫描任务已取消。")
+            JOB_QUEUE.forget(job["id"])
+            del st.session_state.sweep_job
+
+    if 'sweep_results' in st.session_state:
+        sweep_df = st.session_state.sweep_results["df"]
+        st.markdown(f"#### 🏅 {st.session_state.sweep_results['stock_code']} 参数组合排行榜 (按夏普降序)")
+
+        show_df = sweep_df.copy()
+        show_df["止损线"] = show_df["止损线"].apply(lambda x: "不止损" if pd.isna(x) else f"-{x*100:.1f}%")
+        show_df["止盈线"] = show_df["止盈线"].apply(lambda x: "不止盈" if pd.isna(x) else f"+{x*100:.1f}%")
+        show_df["最长持仓天数"] = show_df["最长持仓天数"].apply(lambda x: "不限" if pd.isna(x) else f"{int(x)}天")
+        st.dataframe(
+            show_df.style.format({
+                "Total_Return": "{:.2%}", "Annual_Return": "{:.2%}", "Max_Drawdown": "{:.2%}",
+                "Win_Rate": "{:.1%}", "Benchmark_Return": "{:.2%}", "Alpha": "{:.2%}",
+                "Sharpe_Ratio": "{:.2f}", "Calmar_Ratio": "{:.2f}", "Final_Equity": "{:,.0f}"
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+
+        # 热力图：横轴止损、纵轴止盈，按最长持仓天数切片
+        hm_col1, hm_col2 = st.columns(2)
+        metric_map = {"夏普比率 (Sharpe)": "Sharpe_Ratio", "卡玛比率 (Calmar)": "Calmar_Ratio", "最大回撤 (MaxDD)": "Max_Drawdown"}
+        hm_metric_label = hm_col1.selectbox("热力图指标", list(metric_map.keys()))
+        md_labels = show_df["最长持仓天数"].unique().tolist()
+        hm_md_label = hm_col2.selectbox("最长持仓切片", md_labels)
+
+        hm_src = show_df[show_df["最长持仓天数"] == hm_md_label].copy()
+        hm_src["__val__"] = sweep_df.loc[hm_src.index, metric_map[hm_metric_label]]
+        hm_src["__sl__"] = sweep_df.loc[hm_src.index, "止损线"].fillna(0)
+        hm_src["__tp__"] = sweep_df.loc[hm_src.index, "止盈线"].fillna(0)
+        hm_src = hm_src.sort_values(["__tp__", "__sl__"])
+        pivot = hm_src.pivot_table(index="止盈线", columns="止损线", values="__val__", sort=False)
+
+        fig_hm = go.Figure(data=go.Heatmap(
+            z=pivot.values,
+            x=pivot.columns.tolist(),
+            y=pivot.index.tolist(),
+            colorscale="RdYlGn",
+            text=np.round(pivot.values, 3),
+            texttemplate="%{text}"
+        ))
+        fig_hm.update_layout(
+            template="plotly_dark",
+            height=450,
+            xaxis_title="止损线",
+            yaxis_title="止盈线",
+            margin=dict(l=0, r=0, t=30, b=0)
+        )
+        st.plotly_chart(fig_hm, use_container_width=True)
+
+    # ------ 滚动前推 (Walk-Forward) 样本外检验 ------
+    st.markdown("---")
+    st.markdown("### 🚶 滚动前推优化 (Walk-Forward 样本外检验)")
+    st.caption("在滚动的训练窗里用上方扫描区间自动寻优，把选中的风控参数原封不动套用到紧随其后的测试窗，只统计从未参与调参的样本外收益。")
+    with st.expander("⚙️ 配置滚动窗口", expanded=False):
+        wf_c1, wf_c2, wf_c3 = st.columns(3)
+        wf_train_months = wf_c1.number_input("训练窗长度 (月)", min_value=6, max_value=120, value=36, step=6)
+        wf_test_months = wf_c2.number_input("测试窗长度 (月)", min_value=1, max_value=36, value=6, step=1)
+        wf_rank_label = wf_c3.selectbox("训练窗选参依据", ["夏普比率 (Sharpe)", "卡玛比率 (Calmar)", "策略净收益"])
+        wf_rank_by = {"夏普比率 (Sharpe)": "Sharpe_Ratio", "卡玛比率 (Calmar)": "Calmar_Ratio", "策略净收益": "Total_Return"}[wf_rank_label]
+
+        if st.button("🚶 启动滚动前推优化", use_container_width=True):
+            if not os.path.exists(data_path):
+                st.error(f"抱歉，未找到 {stock_code} 的超级数据库缓存。请先在后台运行数据采集脚本。")
+            else:
+                from job_queue import JOB_QUEUE
+                from walk_forward import walk_forward_job
+                st.session_state.walk_forward_job = {
+                    "id": JOB_QUEUE.submit(
+                        walk_forward_job, data_path, final_buy_logic, final_sell_logic,
+                        stop_loss_list=sl_grid,
+                        take_profit_list=tp_grid,
+                        max_hold_list=md_grid,
+                        train_months=int(wf_train_months),
+                        test_months=int(wf_test_months),
+                        initial_cash=initial_cash,
+                        commission=commission,
+                        stamp_duty=stamp_duty,
+                        slippage=slippage,
+                        start_date=start_date,
+                        end_date=end_date,
+                        rank_by=wf_rank_by,
+                        kind="walk_forward", label=f"{stock_code} 滚动前推", owner=st.session_state.get("username")),
+                    "stock_code": stock_code
+                }
+
+    if st.session_state.get("walk_forward_job"):
+        from job_queue import JOB_QUEUE
+        wf_job = st.session_state.walk_forward_job
+        job = render_job_panel(wf_job["id"], "🚶 滚动前推优化", key="cancel_walk_forward_job")
+        if job is not None:
+            if job["state"] == "done":
+                st.session_state.walk_forward_results = {"res": JOB_QUEUE.result(job["id"]), "stock_code": wf_job["stock_code"]}
+            elif job["state"] == "failed":
+                st.error(f"滚动前推执行错误: {job['error']}")
+            elif job["state"] == "cancelled":
+                st.warning("滚动前推任务已取消。")
+            JOB_QUEUE.forget(job["id"])
+            del st.session_state.walk_forward_job
+
+    if 'walk_forward_results' in st.session_state:
+        wf_res = st.session_state.walk_forward_results["res"]
+        wf_report = wf_res["report"]
+        wf_m1, wf_m2, wf_m3, wf_m4 = st.columns(4)
+        wf_m1.metric("样本外净收益", f"{wf_report['Total_Return']*100:.2f}%")
+        wf_m2.metric("样本外年化", f"{wf_report['Annual_Return']*100:.2f}%")
+        wf_m3.metric("样本外最大回撤", f"{wf_report['Max_Drawdown']*100:.2f}%")
+        wf_m4.metric("样本外夏普", f"{wf_report['Sharpe_Ratio']:.2f}", f"胜率 {wf_report['Win_Rate']*100:.1f}%")
+
+        wf_curve = wf_res["equity_df"]
+        if not wf_curve.empty:
+            fig_wf = go.Figure()
+            for seg_id, seg in wf_curve.groupby("Segment"):
+                fig_wf.add_trace(go.Scatter(
+                    x=seg['Date'], y=seg['Equity'], mode='lines',
+                    line=dict(color='orange' if seg_id % 2 == 0 else '#f39c12', width=2),
+                    showlegend=False
+                ))
+            fig_wf.update_layout(
+                template="plotly_dark",
+                height=400,
+                margin=dict(l=0, r=0, t=30, b=0),
+                title=f"{st.session_state.walk_forward_results['stock_code']} 样本外拼接净值 (各段颜色交替)"
+            )
+            st.plotly_chart(fig_wf, use_container_width=True)
+
+        wf_table = wf_res["windows"].copy()
+        for col in ["止损线", "止盈线"]:
+            wf_table[col] = wf_table[col].apply(lambda x: "不启用" if pd.isna(x) else f"{x*100:.1f}%")
+        wf_table["最长持仓天数"] = wf_table["最长持仓天数"].apply(lambda x: "不限" if pd.isna(x) else f"{int(x)}天")
+        st.dataframe(
+            wf_table.style.format({"样本外收益": "{:.2%}", "样本外回撤": "{:.2%}"}, precision=3),
+            use_container_width=True,
+            hide_index=True
+        )
+
+    # ------ 回测档案馆：历史单票回测一键重开、并排对比 ------
+    st.markdown("---")
+    st.markdown("### 🗂️ 回测档案馆 (历史单票回测)")
+    from run_registry import RunRegistry
+    registry = RunRegistry()
+    runs_df = registry.list_runs(kind="single")
+    if runs_df.empty:
+        st.caption("还没有任何档案。每次回测完成都会自动归档，刷新页面或明天再跑同一套参数时直接秒开。")
+    else:
+        runs_show = runs_df[["key", "标的", "创建时间", "区间", "Total_Return", "Annual_Return", "Max_Drawdown",
+                             "Sharpe_Ratio", "Win_Rate", "Total_Trades_Pairs", "买入逻辑", "卖出逻辑"]]
+        st.dataframe(
+            runs_show.style.format({"Total_Return": "{:.2%}", "Annual_Return": "{:.2%}", "Max_Drawdown": "{:.2%}",
+                                    "Sharpe_Ratio": "{:.2f}", "Win_Rate": "{:.1%}"}, na_rep="-"),
+            use_container_width=True, hide_index=True, height=240
+        )
+        run_labels = {r["key"]: f"{r['标的']} · {r['创建时间']} · {r['key'][:8]}" for _, r in runs_df.iterrows()}
+        picked_runs = st.multiselect("选择档案 (选 1 个可重新打开，选多个并排对比)", list(run_labels), format_func=run_labels.get)
+        col_a1, col_a2 = st.columns(2)
+        if col_a1.button("📂 重新打开第一个选中的档案", use_container_width=True, disabled=not picked_runs):
+            st.session_state.backtest_results = registry.load_single(picked_runs[0])
+            st.rerun()
+        if col_a2.button("🗑️ 删除选中的档案", use_container_width=True, disabled=not picked_runs):
+            for key in picked_runs:
+                registry.delete(key)
+            st.rerun()
+
+        if len(picked_runs) >= 2:
+            compare_df, compare_curves = registry.compare(picked_runs)
+            compare_df.columns = [run_labels[k] for k in compare_df.columns]
+            st.dataframe(compare_df.astype(str), use_container_width=True)
+            fig_cmp = go.Figure()
+            for key, curve in compare_curves.items():
+                if curve is None or curve.empty:
+                    continue
+                fig_cmp.add_trace(go.Scatter(x=curve["Date"], y=curve["Equity"] / curve["Equity"].iloc[0],
+                                             mode="lines", name=run_labels[key]))
+            fig_cmp.update_layout(template="plotly_dark", height=400, hovermode="x unified", yaxis_title="净值 (起点归一)",
+                                  margin=dict(l=0, r=0, t=30, b=0))
+            st.plotly_chart(fig_cmp, use_container_width=True)
+
+# 后台任务未结束时，页面渲染完毕后隔一秒自动重跑一次以刷新进度 (期间任何操作都会立即打断等待)
+if any(st.session_state.get(k) for k in ("backtest_job", "sweep_job", "walk_forward_job")):
+    time.sleep(1)
+    st.rerun()
@@ -4,7 +4,9 @@ import numpy as np
 import os
 import plotly.express as px
 import datetime
-from utils import get_db, inject_custom_css, check_authentication, render_sidebar, get_cached_stock_name
+import time
+from utils import get_db, inject_custom_css, check_authentication, render_sidebar, get_cached_stock_name, render_job_panel
+from report_engine import stack_tear_sheets
 
 st.set_page_config(page_title="全景阅兵场 - 批斗组合策略", layout="wide")
 inject_custom_css()
@@ -54,7 +56,7 @@ end_date = col_time2.date_input("终战截止日期 (End Date)", value=datetime.
 
 st.markdown("---")
 st.markdown("### 3. 克隆核心策略代码 (Core Engine)")
-st.info("💡 请将你在【专业回测舱】中拼接好的最终 Pandas Code 复制到下方执行。如果代码写错引擎将自动熔断跳过。")
+st.info("💡 请将你在【专业回测舱】中拼接好的最终 Pandas Code 复制到下方执行。如果代码写错或引用了不存在的字段，引擎会在加载任何行情之前直接报错。")
 
 col_logic1, col_logic2 = st.columns(2)
 with col_logic1:
@@ -62,67 +64,93 @@ with col_logic1:
 with col_logic2:
     sell_logic = st.text_area("🏃 第二轨：逃顶引擎代码 (支持 eval)", value="Close_Qfq < MA_10 or MACD_Dead_Cross == True", height=120)
 
+use_registry = st.checkbox("🗂️ 参数与数据都没变时直接调取回测档案 (取消勾选则强制重算)", value=True)
+
 if st.button("🚀 三军听令 —— 启动十一国联军超算回测！", type="primary", use_container_width=True):
-    from strategy_runner import StrategyRunner
+    from run_registry import RunRegistry, run_key
+    from strategy_expr import compile_strategy, read_vault_columns, StrategyExpressionError
+    
+    # 表达式整批只编译一次，并对照全部 Vault 的表结构提前校验字段
+    try:
+        vault_columns = set().union(*(read_vault_columns(os.path.join(vault_dir, f"{c}.parquet")) for c in available_stocks))
+        buy_expr, sell_expr = compile_strategy(buy_logic, sell_logic, schema_columns=vault_columns)
+    except StrategyExpressionError as e:
+        st.error(f"🚫 策略代码校验失败，未加载任何行情: {e}")
+        st.stop()
     
     v_sl = stop_loss / 100.0 if stop_loss > 0 else None
     v_tp = take_profit / 100.0 if take_profit > 0 else None
     v_md = int(max_days) if max_days > 0 else None
     
-    results = []
+    runner_kwargs = {
+        "initial_cash": initial_cash,
+        "commission": commission,
+        "stamp_duty": stamp_duty,
+        "slippage": slippage,
+        "buy_logic": buy_expr,
+        "sell_logic": sell_expr,
+        "stop_loss_pct": v_sl,
+        "take_profit_pct": v_tp,
+        "max_hold_days": v_md,
+        "start_date": start_date,
+        "end_date": end_date
+    }
     
-    # 构建酷炫进度条
-    progress_bar = st.progress(0, text="正在装药填装引擎矩阵...")
-    total_stocks = len(available_stocks)
-    
-    for i, code in enumerate(available_stocks):
-        progress_bar.progress((i) / total_stocks, text=f"量化引擎狂飙中: 正在高频推演主力代码 {code} (进度: {i+1}/{total_stocks}) ...")
-        
-        data_path = os.path.join(vault_dir, f"{code}.parquet")
-        runner = StrategyRunner(
-            data_path=data_path,
-            initial_cash=initial_cash,
-            commission=commission,
-            stamp_duty=stamp_duty,
-            slippage=slippage,
-            buy_logic=buy_logic,
-            sell_logic=sell_logic,
-            stop_loss_pct=v_sl,
-            take_profit_pct=v_tp,
-            max_hold_days=v_md,
-            start_date=start_date,
-            end_date=end_date
-        )
-        
-        try:
-            curve_df, trades = runner.run()
-            report = runner.generate_report(curve_df)
-            
-            # 计算对比差值
-            ret = report['Total_Return']
-            bench = report['Benchmark_Return']
-            alpha = ret - bench
-            
-            results.append({
-                "标的代码": code,
-                "股票名称": get_cached_stock_name(code),
-                "策略绝对收益": ret,
-                "被动死拿收益": bench,
-                "🔥 超额 Alpha": alpha,
-                "战斗胜率": report['Win_Rate'],
-                "深渊回撤 (MaxDD)": report['Max_Drawdown'],
-                "交易拔枪次数": report['Total_Trades_Pairs'],
-                "Tear_Sheet_Monthly": report.get('Tear_Sheet_Monthly'),
-                "trades": trades
-            })
-        except Exception as e:
-            st.error(f"⚠️ {code} 回测报错 (可能是因为数据缺陷或该票无可算周期): {e}")
-            
-    progress_bar.progress(1.0, text="全线轰炸清算完毕！请检阅超级大盘看板。")
-    st.balloons()
-    
-    st.session_state.batch_results = results
-    st.session_state.batch_total_stocks = total_stocks
+    # 同一批股票、同一套参数、同一版 Vault 数据的请求直接读档，不再重新撮合
+    registry = RunRegistry()
+    vault_paths = [os.path.join(vault_dir, f"{c}.parquet") for c in available_stocks]
+    registry_key = run_key("batch", available_stocks, vault_paths, runner_kwargs)
+    cached = registry.load_batch(registry_key) if use_registry else None
+    if cached is not None:
+        st.session_state.batch_results = cached["results"]
+        st.session_state.batch_total_stocks = cached["total_stocks"]
+        st.session_state.batch_profiles = cached["profiles"]
+        st.session_state.batch_wall_seconds = cached["wall_seconds"] or 0
+        st.success(f"⚡ 命中回测档案 `{registry_key}`：策略参数与全部 Vault 数据都没变，直接读档，未重新撮合。")
+    else:
+        # 多股回测切块交给后台任务队列，各块在工作进程池里并行，脚本线程立刻返回，页面随后轮询汇总进度
+        from job_queue import JOB_QUEUE
+        from batch_runner import BATCH_CHUNKS_PER_WORKER, batch_backtest_job, split_batch
+        stock_names = {c: get_cached_stock_name(c) for c in available_stocks}
+        chunks = split_batch(available_stocks, JOB_QUEUE.max_workers * BATCH_CHUNKS_PER_WORKER)
+        job_ids = [
+            JOB_QUEUE.submit(batch_backtest_job, chunk, vault_dir, runner_kwargs,
+                             stock_names={c: stock_names[c] for c in chunk},
+                             kind="batch", label=f"{len(available_stocks)} 只股票 (第 {k + 1}/{len(chunks)} 块)",
+                             owner=st.session_state.get("username"), total=len(chunk))
+            for k, chunk in enumerate(chunks)
+        ]
+        st.session_state.batch_job = {"ids": job_ids, "chunks": chunks, "registry_key": registry_key,
+                                      "runner_kwargs": runner_kwargs}
+
+# --- 后台批量任务：轮询进度 / 取消 / 取回结果 ---
+if st.session_state.get("batch_job"):
+    from job_queue import JOB_QUEUE
+    batch_job = st.session_state.batch_job
+    job = render_job_panel(batch_job["ids"], "🏎️ 批量回测", key="cancel_batch_job")
+    if job is not None:
+        if job["state"] == "done":
+            from batch_runner import merge_batch_results
+            from run_registry import RunRegistry, run_spec
+            failed = dict(job["failed"])
+            outputs = [f"分块任务失败: {failed[job_id]}" if job_id in failed else JOB_QUEUE.result(job_id)
+                       for job_id in job["ids"]]
+            batch = merge_batch_results(batch_job["chunks"], outputs)
+            wall_seconds = job["finished_at"] - job["submitted_at"]
+            for code, error in batch["errors"]:
+                st.error(f"⚠️ {code} 回测报错 (可能是因为数据缺陷或该票无可算周期): {error}")
+            RunRegistry().save_batch(batch_job["registry_key"], run_spec(batch_job["runner_kwargs"]), batch["results"],
+                                     batch["total_stocks"], profiles=batch["profiles"], wall_seconds=wall_seconds)
+            st.session_state.batch_results = batch["results"]
+            st.session_state.batch_total_stocks = batch["total_stocks"]
+            st.session_state.batch_profiles = batch["profiles"]
+            st.session_state.batch_wall_seconds = wall_seconds
+            st.balloons()
+        elif job["state"] == "cancelled":
+            st.warning("批量回测任务已取消。")
+        for job_id in job["ids"]:
+            JOB_QUEUE.forget(job_id)
+        del st.session_state.batch_job
 
 # --- 渲染区 (利用 Session State 防止按钮刷新消失) ---
 if 'batch_results' in st.session_state and st.session_state.batch_results:
@@ -198,21 +226,10 @@ if 'batch_results' in st.session_state and st.session_state.batch_results:
     st.markdown("### 📊 策略时效性：军团月度平均超额收益分布 (Alpha Timing)")
     st.caption("透视策略的宏观适应期与失效期。红柱越高代表您的策略当月在全军中迎来了系统性红利，大爆赚；绿柱向下代表遭遇了全线的集体闷杀。")
     
-    heatmap_records = []
-    for r in results:
-        code = r["标的代码"]
-        name = r.get("股票名称", "")
-        df_m = r["Tear_Sheet_Monthly"]
-        if df_m is not None and not df_m.empty:
-            for _, row_m in df_m.iterrows():
-                heatmap_records.append({
-                    "股票代码": f"{name}({code})",
-                    "周期": str(row_m["周期"]),
-                    "Alpha": row_m["🔥 超额收益 (Alpha)"]
-                })
+    # 各票月度战报一次性竖向拼接成长表，不再逐行 iterrows
+    hm_df = stack_tear_sheets({f'{r.get("股票名称", "")}({r["标的代码"]})': r["Tear_Sheet_Monthly"] for r in results})
     
-    if heatmap_records:
-        hm_df = pd.DataFrame(heatmap_records)
+    if not hm_df.empty:
         
         # 方案二：大盘归因法 - 计算每个月的平均超额收益
         mean_alpha_df = hm_df.groupby("周期")['Alpha'].mean().reset_index()
@@ -319,8 +336,274 @@ if 'batch_results' in st.session_state and st.session_state.batch_results:
     with tab_t:
         trades_data = selected_detail["trades"]
         if trades_data:
-            trades_df = pd.DataFrame(trades_data)
+            trades_df = trades_data.to_frame() if hasattr(trades_data, "to_frame") else pd.DataFrame(trades_data)
             trades_df['Date'] = pd.to_datetime(trades_df['Date']).dt.date
             st.dataframe(trades_df, use_container_width=True)
         else:
             st.info("当前时间窗口和选定策略下，回测周期内没有发生任何交易。")
+
+    # 全部股票的分阶段耗时汇总 (各子进程的 profile 相加；多进程并行时总耗时会大于墙钟时间)
+    batch_profiles = st.session_state.get("batch_profiles")
+    if batch_profiles:
+        from stage_profiler import aggregate_profiles
+        with st.expander(f"⏱️ 批量性能画像 ({len(batch_profiles)} 只股票 · 墙钟 {st.session_state.get('batch_wall_seconds', 0):.2f} 秒)", expanded=False):
+            stage_df, counter_df = aggregate_profiles(batch_profiles)
+            if stage_df["单票峰值内存(MB)"].isna().all():
+                stage_df = stage_df.drop(columns=["单票峰值内存(MB)"])
+            st.dataframe(
+                stage_df.style.format({
+                    "总耗时(秒)": "{:.3f}", "单票平均(秒)": "{:.4f}", "单票最慢(秒)": "{:.4f}",
+                    "总处理行数": "{:,.0f}", "单票峰值内存(MB)": "{:.2f}", "耗时占比": "{:.1%}"
+                }, na_rep="-"),
+                use_container_width=True,
+                hide_index=True
+            )
+            if not counter_df.empty:
+                st.dataframe(counter_df, use_container_width=True, hide_index=True)
+
+# --- 批量回测档案 ---
+from run_registry import RunRegistry
+batch_registry = RunRegistry()
+batch_runs = batch_registry.list_runs(kind="batch")
+if not batch_runs.empty:
+    with st.expander(f"🗂️ 批量回测档案馆 ({len(batch_runs)} 份)", expanded=False):
+        st.dataframe(
+            batch_runs[["key", "标的", "创建时间", "区间", "买入逻辑", "卖出逻辑", "止损", "止盈", "最长持仓",
+                        "策略绝对收益", "🔥 超额 Alpha", "战斗胜率"]].style.format(
+                {"策略绝对收益": "{:.2%}", "🔥 超额 Alpha": "{:.2%}", "战斗胜率": "{:.1%}"}, na_rep="-"),
+            use_container_width=True, hide_index=True
+        )
+        batch_labels = {r["key"]: f"{r['创建时间']} · {r['买入逻辑']} · {r['key'][:8]}" for _, r in batch_runs.iterrows()}
+        picked_batches = st.multiselect("选择档案 (选 1 个可重新打开，选多个并排对比)", list(batch_labels), format_func=batch_labels.get)
+        col_b1, col_b2 = st.columns(2)
+        if col_b1.button("📂 重新打开第一个选中的档案", use_container_width=True, disabled=not picked_batches):
+            loaded = batch_registry.load_batch(picked_batches[0])
+            st.session_state.batch_results = loaded["results"]
+            st.session_state.batch_total_stocks = loaded["total_stocks"]
+            st.session_state.batch_profiles = loaded["profiles"]
+            st.session_state.batch_wall_seconds = loaded["wall_seconds"] or 0
+            st.rerun()
+        if col_b2.button("🗑️ 删除选中的档案", use_container_width=True, disabled=not picked_batches):
+            for key in picked_batches:
+                batch_registry.delete(key)
+            st.rerun()
+        if len(picked_batches) >= 2:
+            compare_df, _ = batch_registry.compare(picked_batches)
+            compare_df.columns = [batch_labels[k] for k in compare_df.columns]
+            st.caption("指标为各股票的简单平均。")
+            st.dataframe(compare_df.astype(str), use_container_width=True)
+
+# --- 多策略同场对比 ---
+st.markdown("---")
+st.markdown("### ⚔️ 多策略同场对比 (策略 x 股票矩阵)")
+st.caption("每只股票只读取一次行情，所有候选策略在同一份数据上依次推演；相同的买卖表达式只求值一次。资金、费率与时间窗口沿用上方设置，风控参数按每行单独填写 (0 表示不启用)。")
+
+if "matrix_strategies" not in st.session_state:
+    st.session_state.matrix_strategies = pd.DataFrame([
+        {"策略名称": "当前策略", "买入条件": buy_logic, "卖出条件": sell_logic,
+         "止损(%)": stop_loss, "止盈(%)": take_profit, "最长持仓(天)": int(max_days)},
+        {"策略名称": "MACD 金叉趋势", "买入条件": "Close_Qfq > MA_60 and MACD_Hist > 0", "卖出条件": "Close_Qfq < MA_20",
+         "止损(%)": 8.0, "止盈(%)": 0.0, "最长持仓(天)": 0},
+        {"策略名称": "RSI 超卖抄底", "买入条件": "RSI_14 < 30", "卖出条件": "RSI_14 > 60",
+         "止损(%)": 8.0, "止盈(%)": 15.0, "最长持仓(天)": 30}
+    ])
+
+matrix_specs_df = st.data_editor(st.session_state.matrix_strategies, num_rows="dynamic", use_container_width=True, hide_index=True)
+
+if st.button("⚔️ 启动多策略同场对比", use_container_width=True):
+    from strategy_matrix import prepare_strategies, strategy_matrix_job
+    from strategy_expr import read_vault_columns, StrategyExpressionError
+
+    specs = []
+    for _, r in matrix_specs_df.dropna(subset=["策略名称"]).iterrows():
+        specs.append({
+            "name": r["策略名称"],
+            "buy_logic": r["买入条件"] if isinstance(r["买入条件"], str) else "",
+            "sell_logic": r["卖出条件"] if isinstance(r["卖出条件"], str) else "",
+            "stop_loss_pct": r["止损(%)"] / 100.0 if pd.notna(r["止损(%)"]) and r["止损(%)"] > 0 else None,
+            "take_profit_pct": r["止盈(%)"] / 100.0 if pd.notna(r["止盈(%)"]) and r["止盈(%)"] > 0 else None,
+            "max_hold_days": int(r["最长持仓(天)"]) if pd.notna(r["最长持仓(天)"]) and r["最长持仓(天)"] > 0 else None
+        })
+
+    # 全部策略先整体编译校验，任何一条写错都不加载行情
+    try:
+        vault_columns = set().union(*(read_vault_columns(os.path.join(vault_dir, f"{c}.parquet")) for c in available_stocks))
+        matrix_strategies = prepare_strategies(specs, schema_columns=vault_columns)
+    except StrategyExpressionError as e:
+        st.error(f"🚫 策略代码校验失败，未加载任何行情: {e}")
+        st.stop()
+
+    if not matrix_strategies:
+        st.warning("请至少填写一个策略。")
+        st.stop()
+
+    # 与批量回测相同：按股票切块交给后台任务队列，页面随后轮询汇总进度
+    from job_queue import JOB_QUEUE
+    from batch_runner import BATCH_CHUNKS_PER_WORKER, split_batch
+    broker_kwargs = {"initial_cash": initial_cash, "commission": commission, "stamp_duty": stamp_duty, "slippage": slippage}
+    chunks = split_batch(available_stocks, JOB_QUEUE.max_workers * BATCH_CHUNKS_PER_WORKER)
+    job_ids = [
+        JOB_QUEUE.submit(strategy_matrix_job, chunk, vault_dir, matrix_strategies, broker_kwargs,
+                         start_date=start_date, end_date=end_date,
+                         kind="matrix", label=f"{len(matrix_strategies)} 个策略 x {len(available_stocks)} 只股票 (第 {k + 1}/{len(chunks)} 块)",
+                         owner=st.session_state.get("username"), total=len(chunk))
+        for k, chunk in enumerate(chunks)
+    ]
+    st.session_state.matrix_strategies = matrix_specs_df
+    st.session_state.matrix_job = {"ids": job_ids, "order": [s["name"] for s in matrix_strategies]}
+
+if st.session_state.get("matrix_job"):
+    from job_queue import JOB_QUEUE
+    matrix_job = st.session_state.matrix_job
+    job = render_job_panel(matrix_job["ids"], "⚔️ 多策略矩阵", key="cancel_matrix_job")
+    if job is not None:
+        if job["state"] == "done":
+            failed = dict(job["failed"])
+            matrix_rows = []
+            for job_id in job["ids"]:
+                if job_id in failed:
+                    st.error(f"⚠️ 多策略对比分块任务失败: {failed[job_id]}")
+                    continue
+                out = JOB_QUEUE.result(job_id)
+                matrix_rows.extend(out["rows"])
+                for code, error in out["errors"]:
+                    st.error(f"⚠️ {code} 多策略对比报错: {error}")
+            st.session_state.matrix_results = {
+                "long_df": pd.DataFrame(matrix_rows),
+                "order": matrix_job["order"],
+                "wall_seconds": job["finished_at"] - job["submitted_at"]
+            }
+        elif job["state"] == "cancelled":
+            st.warning("多策略对比任务已取消。")
+        for job_id in job["ids"]:
+            JOB_QUEUE.forget(job_id)
+        del st.session_state.matrix_job
+
+if st.session_state.get("matrix_results") is not None and not st.session_state.matrix_results["long_df"].empty:
+    from strategy_matrix import pivot_matrix, summarize_strategies
+
+    mx = st.session_state.matrix_results
+    long_df = mx["long_df"]
+    st.success(f"✅ {len(mx['order'])} 个策略 x {long_df['股票代码'].nunique()} 只股票，墙钟 {mx['wall_seconds']:.2f} 秒")
+
+    summary_df = summarize_strategies(long_df)
+    st.dataframe(
+        summary_df.style.format({
+            "平均收益": "{:.2%}", "平均 Alpha": "{:.2%}", "跑赢基准占比": "{:.1%}",
+            "平均胜率": "{:.1%}", "平均回撤": "{:.2%}", "最深回撤": "{:.2%}"
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+
+    metric_labels = {"Alpha": "🔥 超额 Alpha", "Total_Return": "策略绝对收益", "Win_Rate": "战斗胜率", "Max_Drawdown": "深渊回撤 (MaxDD)"}
+    metric_key = st.radio("矩阵指标", list(metric_labels), format_func=metric_labels.get, horizontal=True)
+    matrix_df = pivot_matrix(long_df, metric_key, mx["order"])
+    matrix_df.columns = [f"{get_cached_stock_name(c)}({c})" for c in matrix_df.columns]
+
+    fig_mx = px.imshow(
+        matrix_df,
+        color_continuous_scale=px.colors.diverging.RdYlGn[::-1],
+        color_continuous_midpoint=0 if metric_key != "Win_Rate" else 0.5,
+        text_auto=".1%",
+        aspect="auto"
+    )
+    fig_mx.update_layout(template="plotly_dark", height=120 + 45 * len(matrix_df), xaxis_title="", yaxis_title="",
+                         coloraxis_showscale=False)
+    st.plotly_chart(fig_mx, use_container_width=True)
+
+# --- 共享资金组合模式 ---
+st.markdown("---")
+st.markdown("### 💼 共享资金组合回测 (单一账户 · 多股同持)")
+st.caption("与上方逐票独立回测不同：所有标的共用一个现金账户，在同一条主日历上同步推进，受最大持仓数约束，并沿用个股的 T+1 与涨跌停规则。")
+
+col_pf1, col_pf2, col_pf3, col_pf4 = st.columns(4)
+pf_cash = col_pf1.number_input("组合总资金 (元)", min_value=100000, value=1000000, step=100000)
+pf_max_pos = col_pf2.number_input("最大同时持仓数", min_value=1, max_value=500, value=5, step=1)
+pf_sizing_label = col_pf3.radio("仓位分配方式", ["等权分配", "信号加权"], horizontal=True)
+pf_score_col = col_pf4.selectbox(
+    "候选打分列 (排序/加权依据)",
+    ["(按代码顺序)", "Turnover_ZScore", "Vol_Ratio_5D", "MACD_Hist", "RSI_14", "BIAS_12", "Price_Loc_250"],
+    help="同一天买点超过剩余仓位时，按该列从高到低挑选；信号加权模式下同时作为资金分配权重"
+)
+
+if st.button("💼 启动共享资金组合回测", use_container_width=True):
+    from portfolio_engine import portfolio_backtest_job
+
+    score_col = None if pf_score_col == "(按代码顺序)" else pf_score_col
+    pf_sizing = "signal" if pf_sizing_label == "信号加权" else "equal"
+    if pf_sizing == "signal" and score_col is None:
+        st.error("信号加权模式需要先选择一个打分列。")
+    else:
+        from job_queue import JOB_QUEUE
+        st.session_state.portfolio_job = JOB_QUEUE.submit(
+            portfolio_backtest_job,
+            sorted(available_stocks),
+            buy_logic,
+            sell_logic,
+            initial_cash=pf_cash,
+            commission=commission,
+            stamp_duty=stamp_duty,
+            slippage=slippage,
+            max_positions=int(pf_max_pos),
+            sizing=pf_sizing,
+            score_col=score_col,
+            stop_loss_pct=stop_loss / 100.0 if stop_loss > 0 else None,
+            take_profit_pct=take_profit / 100.0 if take_profit > 0 else None,
+            max_hold_days=int(max_days) if max_days > 0 else None,
+            start_date=start_date,
+            end_date=end_date,
+            kind="portfolio", label=f"{len(available_stocks)} 只股票共享资金组合", owner=st.session_state.get("username")
+        )
+
+if st.session_state.get("portfolio_job"):
+    from job_queue import JOB_QUEUE
+    job = render_job_panel(st.session_state.portfolio_job, "💼 组合回测", key="cancel_portfolio_job")
+    if job is not None:
+        if job["state"] == "done":
+            st.session_state.portfolio_results = JOB_QUEUE.result(job["id"])
+        elif job["state"] == "failed":
+            st.error(f"组合回测执行错误: {job['error']}")
+        elif job["state"] == "cancelled":
+            st.warning("组合回测任务已取消。")
+        JOB_QUEUE.forget(job["id"])
+        del st.session_state.portfolio_job
+
+if st.session_state.get('portfolio_results'):
+    pf_res = st.session_state.portfolio_results
+    pf_report = pf_res["report"]
+    pf_curve = pf_res["curve_df"]
+
+    col_pr1, col_pr2, col_pr3, col_pr4 = st.columns(4)
+    col_pr1.metric("组合最终净资产", f"¥ {pf_report['Final_Equity']:,.0f}", f"{pf_report['Total_Return']*100:.2f}%")
+    col_pr2.metric("年化收益", f"{pf_report['Annual_Return']*100:.2f}%")
+    col_pr3.metric("最大回撤", f"{pf_report['Max_Drawdown']*100:.2f}%")
+    col_pr4.metric("夏普 / 胜率", f"{pf_report['Sharpe_Ratio']:.2f}", f"胜率 {pf_report['Win_Rate']*100:.1f}% · {pf_report['Total_Trades_Pairs']} 笔")
+
+    if not pf_curve.empty:
+        fig_pf = px.line(pf_curve, x="Date", y=["Equity", "Cash"])
+        fig_pf.update_layout(template="plotly_dark", height=400, xaxis_title="", yaxis_title="组合资产 (元)")
+        st.plotly_chart(fig_pf, use_container_width=True)
+
+    with st.expander("🔁 组合往返交易台账", expanded=False):
+        pf_rt = pf_report.get("Round_Trips")
+        if pf_rt is not None and not pf_rt.empty:
+            pf_rt_show = pf_rt.copy()
+            pf_rt_show['Entry_Date'] = pf_rt_show['Entry_Date'].dt.date
+            pf_rt_show['Exit_Date'] = pf_rt_show['Exit_Date'].dt.date
+            st.dataframe(pf_rt_show, use_container_width=True, hide_index=True)
+        else:
+            st.info("当前参数下组合没有完成的往返交易。")
+
+    with st.expander("📝 组合交易履历表", expanded=False):
+        if not pf_res["trades_df"].empty:
+            pf_trades_show = pf_res["trades_df"].copy()
+            pf_trades_show['Date'] = pd.to_datetime(pf_trades_show['Date']).dt.date
+            st.dataframe(pf_trades_show, use_container_width=True)
+        else:
+            st.info("当前参数下组合未发生任何交易。")
+
+# 后台任务未结束时，页面渲染完毕后隔一秒自动重跑一次以刷新进度 (期间任何操作都会立即打断等待)
+if any(st.session_state.get(k) for k in ("batch_job", "matrix_job", "portfolio_job")):
+    time.sleep(1)
+    st.rerun()
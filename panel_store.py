@@ -0,0 +1,230 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from vault_io import resolve_date_window, _overlapping_row_groups
+
+PANEL_STORE_DIR = "backtest_data/panel_store"
+# 每个 row group 容纳的股票数：按代码读取时凭 Code 统计信息只解码命中的 row group
+PANEL_CODES_PER_ROW_GROUP = 64
+
+
+def _align_table(table, schema, code):
+    """把单只股票的 Vault 表对齐到面板的统一表结构 (缺列补空、类型统一，Code 列以文件名为准)"""
+    arrays = []
+    for field in schema:
+        if field.name == 'Code':
+            arrays.append(pa.array([code] * table.num_rows, type=field.type))
+        elif field.name in table.column_names:
+            arrays.append(table.column(field.name).cast(field.type))
+        else:
+            arrays.append(pa.nulls(table.num_rows, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def build_panel_store(vault_dir, panel_dir=PANEL_STORE_DIR, progress=None):
+    """
+    由逐股 Vault 生成面板库：与 Vault 列完全相同，按年份分文件 ({年份}.parquet)，文件内按 (Code, Date) 排序，
+    每 PANEL_CODES_PER_ROW_GROUP 只股票一个 row group。
+    每个 Vault 文件只读一次，内存里最多只缓冲每个年份一个 row group 的数据；
+    先写到临时目录，全部完成后再整体替换，构建中途失败不会留下半套面板。
+
+    :param progress: 可选回调 progress(已完成数, 总数, 代码)
+    :return: 写入的年份列表
+    """
+    codes = sorted(f.replace(".parquet", "") for f in os.listdir(vault_dir) if f.endswith(".parquet"))
+    if not codes:
+        return []
+    schema = pq.read_schema(os.path.join(vault_dir, f"{codes[0]}.parquet")).remove_metadata()
+    if 'Code' not in schema.names:
+        schema = schema.insert(1, pa.field('Code', pa.string()))
+
+    tmp_dir = panel_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    writers, buffers = {}, {}
+
+    def flush(year):
+        chunk = pa.concat_tables(buffers.pop(year))
+        if year not in writers:
+            writers[year] = pq.ParquetWriter(os.path.join(tmp_dir, f"{year}.parquet"), schema)
+        writers[year].write_table(chunk, row_group_size=chunk.num_rows)
+
+    try:
+        for k, code in enumerate(codes):
+            table = _align_table(pq.read_table(os.path.join(vault_dir, f"{code}.parquet")), schema, code)
+            table = table.take(pc.sort_indices(table, [("Date", "ascending")]))
+            years = pc.year(table.column('Date')).to_numpy()
+            bounds = np.flatnonzero(np.diff(years)) + 1
+            for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(years)]])):
+                if hi <= lo:
+                    continue
+                year = int(years[lo])
+                buffers.setdefault(year, []).append(table.slice(lo, hi - lo))
+                if len(buffers[year]) >= PANEL_CODES_PER_ROW_GROUP:
+                    flush(year)
+            if progress:
+                progress(k + 1, len(codes), code)
+        for year in list(buffers):
+            flush(year)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    old_dir = panel_dir.rstrip("/") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(panel_dir):
+        os.replace(panel_dir, old_dir)
+    os.replace(tmp_dir, panel_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return sorted(writers)
+
+
+class PanelSlice:
+    """
+    面板库读出的对齐二维数组：行 = 日期 (升序)，列 = 股票代码。
+    数值列缺失处为 NaN，布尔列缺失处为 False；present 标记 Vault 里是否真有这一行。
+    """
+    def __init__(self, dates, codes, values, present):
+        self.dates = dates        # DatetimeIndex
+        self.codes = codes        # [代码, ...]
+        self.values = values      # {列名: (日期数, 股票数) 数组}
+        self.present = present    # (日期数, 股票数) 布尔数组
+
+    def __getitem__(self, column):
+        return self.values[column]
+
+    def frame(self, column):
+        """某一列的 日期 x 代码 DataFrame"""
+        return pd.DataFrame(self.values[column], index=self.dates, columns=self.codes)
+
+
+class PanelStore:
+    """
+    面板库读取器。只按需解码：
+      - 按日期访问：只打开窗口覆盖的年份文件，再凭 row group 的 Date 统计跳过窗口外的块；
+      - 按股票访问：凭 row group 的 Code 统计只解码包含目标股票的块 (每年一个块)；
+    任何读取都只物化请求的列、日期与股票，不会把整个面板读进内存。
+    """
+    def __init__(self, panel_dir=PANEL_STORE_DIR):
+        self.panel_dir = panel_dir
+        self.years = sorted(int(f.replace(".parquet", "")) for f in os.listdir(panel_dir)
+                            if f.endswith(".parquet") and f.replace(".parquet", "").isdigit()) if os.path.isdir(panel_dir) else []
+        if not self.years:
+            raise FileNotFoundError(f"面板库不存在或为空: {panel_dir}")
+        self.schema = pq.read_schema(self._path(self.years[-1]))
+
+    @staticmethod
+    def exists(panel_dir=PANEL_STORE_DIR):
+        return os.path.isdir(panel_dir) and any(f.endswith(".parquet") for f in os.listdir(panel_dir))
+
+    @property
+    def columns(self):
+        return [c for c in self.schema.names if c not in ('Date', 'Code')]
+
+    def _path(self, year):
+        return os.path.join(self.panel_dir, f"{year}.parquet")
+
+    def read_table(self, columns, start_date=None, end_date=None, codes=None):
+        """按窗口与代码读出长表 (Arrow Table，含 Date、Code 与请求的列)"""
+        lower, upper = resolve_date_window(start_date, end_date)
+        wanted = ['Date', 'Code'] + [c for c in columns if c not in ('Date', 'Code')]
+        code_set = sorted(set(codes)) if codes is not None else None
+        tables = []
+        for year in self.years:
+            if year > upper.year or (lower is not None and year < lower.year):
+                continue
+            pf = pq.ParquetFile(self._path(year))
+            meta = pf.metadata
+            groups = _overlapping_row_groups(meta, pf.schema_arrow.names.index('Date'), lower, upper)
+            if code_set is not None:
+                groups = [i for i in groups if self._group_has_codes(meta, i, pf.schema_arrow.names.index('Code'), code_set)]
+            if groups:
+                tables.append(pf.read_row_groups(groups, columns=wanted))
+        if not tables:
+            return self.schema.empty_table().select(wanted)
+        table = pa.concat_tables(tables)
+
+        mask = pc.less_equal(table.column('Date'), pa.scalar(upper, type=table.schema.field('Date').type))
+        if lower is not None:
+            mask = pc.and_(mask, pc.greater_equal(table.column('Date'), pa.scalar(lower, type=table.schema.field('Date').type)))
+        if code_set is not None:
+            mask = pc.and_(mask, pc.is_in(table.column('Code'), value_set=pa.array(code_set, type=pa.string())))
+        return table.filter(mask)
+
+    @staticmethod
+    def _group_has_codes(meta, group, code_idx, code_set):
+        stats = meta.row_group(group).column(code_idx).statistics
+        if stats is None or not stats.has_min_max:
+            return True
+        lo = np.searchsorted(code_set, stats.min, side="left")
+        return lo < len(code_set) and code_set[lo] <= stats.max
+
+    def read(self, columns, start_date=None, end_date=None, codes=None, dtype=None):
+        """
+        读出若干列的对齐二维数组。
+        :param codes: 股票列表 (按给定顺序排列列)；默认为窗口内出现过的全部股票 (代码升序)
+        :param dtype: 数值列的目标精度 (如 np.float32)；默认保持 Vault 原始精度
+        :return: PanelSlice，日期轴为窗口内所有股票日期的并集
+        """
+        table = self.read_table(columns, start_date, end_date, codes)
+        date_values = table.column('Date').to_numpy()
+        code_values = table.column('Code').to_numpy(zero_copy_only=False)
+
+        dates = pd.DatetimeIndex(np.unique(date_values))
+        codes = list(codes) if codes is not None else sorted(set(code_values.tolist()))
+        rows = dates.searchsorted(date_values)
+        cols = pd.Index(codes).get_indexer(code_values)
+        shape = (len(dates), len(codes))
+
+        present = np.zeros(shape, dtype=bool)
+        present[rows, cols] = True
+        values = {}
+        for c in columns:
+            if c in ('Date', 'Code'):
+                continue
+            column = table.column(c)
+            if pa.types.is_boolean(column.type):
+                out = np.zeros(shape, dtype=bool)
+                out[rows, cols] = column.fill_null(False).to_numpy(zero_copy_only=False)
+            else:
+                out = np.full(shape, np.nan, dtype=dtype or np.float64)
+                out[rows, cols] = column.to_numpy(zero_copy_only=False)
+            values[c] = out
+        return PanelSlice(dates, codes, values, present)
+
+    def read_stock(self, code, columns=None, start_date=None, end_date=None):
+        """单只股票的时间序列 (与直接读 Vault 同口径的 DataFrame)"""
+        columns = self.columns if columns is None else columns
+        df = self.read_table(columns, start_date, end_date, codes=[code]).to_pandas()
+        return df.sort_values('Date').reset_index(drop=True)
+
+    def read_day(self, date, columns=None):
+        """某一天的全市场截面 (行 = 股票代码)"""
+        columns = self.columns if columns is None else columns
+        day = pd.to_datetime(date)
+        df = self.read_table(columns, start_date=day, end_date=day).to_pandas()
+        return df.drop(columns=['Date']).set_index('Code').sort_index()
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import time
+    vault_dir = "backtest_data/final_vault"
+    if os.path.exists(vault_dir):
+        t0 = time.perf_counter()
+        years = build_panel_store(vault_dir)
+        print(f"面板库构建完成：{len(years)} 个年份文件，耗时 {time.perf_counter() - t0:.2f}s")
+
+        store = PanelStore()
+        t0 = time.perf_counter()
+        panel = store.read(['Close_Raw', 'BIAS_12', 'is_trading'], start_date="2020-01-01", end_date="2020-12-31")
+        print(f"2020 年面板 {panel['Close_Raw'].shape}，耗时 {time.perf_counter() - t0:.3f}s")
+        print(panel.frame('Close_Raw').tail(3).round(2).to_string())
+        print(store.read_day("2020-06-01", ["Close_Raw", "PE_TTM"]).round(2).to_string())
+        print(store.read_stock("600519", ["Close_Raw"], start_date="2020-12-25", end_date="2020-12-31").to_string())
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
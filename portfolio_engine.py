@@ -0,0 +1,343 @@
+import os
+import numpy as np
+import pandas as pd
+from ashare_broker import AShareBroker
+from strategy_runner import calc_core_metrics
+from report_engine import build_round_trips
+from strategy_expr import compile_strategy
+from signal_cache import get_signal
+from vault_io import load_vault
+
+VAULT_DIR = "backtest_data/final_vault"
+
+# 组合撮合需要的行情列
+PRICE_COLUMNS = ['Close_Raw', 'High_Raw', 'Low_Raw', 'limit_up', 'limit_down', 'Pct_Chg_Raw']
+# 逐日撮合时每隔多少个交易日回报一次进度 (约一年)
+PROGRESS_EVERY_DAYS = 250
+
+
+def load_vault_matrices(codes, buy_logic, sell_logic, vault_dir=VAULT_DIR,
+                        start_date=None, end_date=None, score_col=None, progress=None):
+    """
+    把多只股票的 Final Vault 对齐到同一条主日历上，拆成 (日期 × 股票) 的二维矩阵。
+    每只股票的买卖表达式在各自的大表上 eval 一次，之后撮合阶段只做矩阵运算。
+    :param progress: 可选的回调 progress(done, total, text)，每读完一只股票调用一次
+
+    :return: (dates, codes, mats)，mats 为 {列名: 2D ndarray}，含 buy/sell 信号与可选的打分列
+    """
+    # 表达式整批只编译一次，逐票在读数据前对照表结构校验字段
+    buy_expr, sell_expr = compile_strategy(buy_logic, sell_logic)
+
+    frames = []
+    loaded_codes = []
+    for i, code in enumerate(codes):
+        if progress is not None:
+            progress(i, len(codes), f"读取 {code} 的行情与信号 ({i + 1}/{len(codes)})")
+        path = os.path.join(vault_dir, f"{code}.parquet")
+        if not os.path.exists(path):
+            continue
+        compile_strategy(buy_expr, sell_expr, data_path=path)
+        # 信号直接取自缓存，这里只需读撮合用的行情列；与单票引擎同口径，
+        # 未来占位日期与时间窗口外的数据在读取层就被裁掉 (行索引为 Parquet 原始行号)
+        df = load_vault(path, columns=['is_trading'] + PRICE_COLUMNS + ([score_col] if score_col else []),
+                        start_date=start_date, end_date=end_date)
+        if df.empty:
+            continue
+        rows = df.index.to_numpy()
+
+        # 直接在读出的这份表上追加列，不再另做拷贝
+        part = df
+        # 信号取自落盘缓存 (整张表按原始行号存储，与单票引擎共用)，按原始行号切片
+        part['__BUY_SIGNAL__'] = get_signal(path, buy_expr)[rows] if buy_expr is not None else False
+        part['__SELL_SIGNAL__'] = get_signal(path, sell_expr)[rows] if sell_expr is not None else False
+        if score_col:
+            part['__SCORE__'] = df[score_col].astype(float)
+        part['Code'] = code
+        frames.append(part)
+        loaded_codes.append(code)
+
+    if not frames:
+        return pd.DatetimeIndex([]), [], {}
+
+    long_df = pd.concat(frames, ignore_index=True)
+    value_cols = ['is_trading', '__BUY_SIGNAL__', '__SELL_SIGNAL__'] + PRICE_COLUMNS
+    if score_col:
+        value_cols.append('__SCORE__')
+
+    wide = long_df.pivot(index='Date', columns='Code', values=value_cols).sort_index()
+    dates = wide.index
+    mats = {}
+    for col in value_cols:
+        block = wide[col].reindex(columns=loaded_codes)
+        if col in ('is_trading', '__BUY_SIGNAL__', '__SELL_SIGNAL__'):
+            # 对齐后缺失的日子视为停牌 / 无信号
+            mats[col] = block.fillna(False).to_numpy().astype(bool)
+        else:
+            mats[col] = block.to_numpy(dtype=float)
+    return dates, loaded_codes, mats
+
+
+def _cap_budgets(total, weights, cap):
+    """
+    按权重分配 total，且每份不超过 cap：超出上限的部分按其余未封顶份额的权重再分配，
+    直到没有超额或所有份额都已封顶 (此时剩余资金留作现金)。
+    """
+    budget = total * weights
+    capped = np.zeros(weights.size, dtype=bool)
+    while True:
+        over = ~capped & (budget > cap)
+        if not over.any():
+            return budget
+        excess = float(np.sum(budget[over] - cap))
+        budget[over] = cap
+        capped |= over
+        free_w = np.where(capped, 0.0, weights)
+        if free_w.sum() <= 0:
+            return budget
+        budget += excess * free_w / free_w.sum()
+
+
+class PortfolioBacktester:
+    """
+    共享资金的多股票组合回测引擎。
+    所有股票在同一条主日历上一次性推进：每天只跑一轮 Python 循环，
+    当天所有股票的 T+1 解锁、止损止盈、涨跌停撮合、仓位分配全部用向量化矩阵运算完成。
+    手数、最低佣金、印花税、滑点、涨跌停容差沿用 AShareBroker 的规则常量。
+    """
+    def __init__(self, codes, buy_logic, sell_logic, initial_cash=1000000,
+                 commission=0.00025, stamp_duty=0.0005, slippage=0.001,
+                 max_positions=10, sizing="equal", score_col=None,
+                 stop_loss_pct=None, take_profit_pct=None, max_hold_days=None,
+                 start_date=None, end_date=None, vault_dir=VAULT_DIR, progress=None):
+        """
+        :param max_positions: 同时持有的最大股票数量
+        :param sizing: "equal" 等权分配 / "signal" 按打分列 score_col 加权分配
+        :param score_col: 买入候选的打分列 (同时用于候选排序)，为空时按代码顺序
+        :param progress: 可选的回调 progress(done, total, text)，加载时逐只、撮合时约每年调用一次
+                         (后台任务里用来回报进度并检查取消)
+        """
+        if sizing == "signal" and not score_col:
+            raise ValueError("信号加权模式需要指定打分列 score_col")
+
+        # 单一现金账户及全部费率规则都挂在 AShareBroker 上
+        self.broker = AShareBroker(initial_cash, commission, stamp_duty, slippage)
+        self.max_positions = max_positions
+        self.sizing = sizing
+        self.score_col = score_col
+        self.stop_loss_pct = stop_loss_pct
+        self.take_profit_pct = take_profit_pct
+        self.max_hold_days = max_hold_days
+        self.progress = progress
+
+        self.dates, self.codes, self.mats = load_vault_matrices(
+            codes, buy_logic, sell_logic, vault_dir=vault_dir,
+            start_date=start_date, end_date=end_date, score_col=score_col, progress=progress
+        )
+
+    def _fees(self, amount):
+        """向量化的 A 股佣金 (含最低 5 元) 与印花税"""
+        comm = np.maximum(amount * self.broker.commission_rate, self.broker.MIN_COMMISSION)
+        stamp = amount * self.broker.stamp_duty_rate
+        return comm, stamp
+
+    def run(self):
+        """
+        逐日推进整个组合。
+        :return: (组合净值曲线 DataFrame, 交易流水 DataFrame)
+        """
+        broker = self.broker
+        m = self.mats
+        n_days, n_codes = m['Close_Raw'].shape if self.codes else (0, 0)
+        lot = broker.LOT_SIZE
+        slip = broker.slippage
+
+        shares = np.zeros(n_codes, dtype=np.int64)
+        cost_price = np.zeros(n_codes)
+        holding_days = np.zeros(n_codes, dtype=np.int64)
+        last_close = np.full(n_codes, np.nan)
+
+        equity_arr = np.empty(n_days)
+        cash_arr = np.empty(n_days)
+        positions_arr = np.empty(n_days, dtype=np.int64)
+        trade_chunks = []
+
+        stop_line = -abs(self.stop_loss_pct) if self.stop_loss_pct is not None else None
+        profit_line = abs(self.take_profit_pct) if self.take_profit_pct is not None else None
+
+        for t in range(n_days):
+            if self.progress is not None and t % PROGRESS_EVERY_DAYS == 0:
+                self.progress(t, n_days, f"组合撮合推进到 {self.dates[t].date()}")
+            close = m['Close_Raw'][t]
+            tradable = m['is_trading'][t] & ~np.isnan(close)
+            last_close = np.where(tradable, close, last_close)
+
+            # T+1：昨日及以前的持仓今日全部解锁
+            available = shares.copy()
+
+            # --- 卖出：风控刹车 + 策略卖点，跌停封死则卖不出 ---
+            held = tradable & (shares > 0)
+            holding_days[held] += 1
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ret = (close - cost_price) / cost_price
+            trigger = m['__SELL_SIGNAL__'][t].copy()
+            if stop_line is not None:
+                trigger |= ret <= stop_line
+            if profit_line is not None:
+                trigger |= ret >= profit_line
+            if self.max_hold_days is not None:
+                trigger |= holding_days >= self.max_hold_days
+            limit_down = m['limit_down'][t] * broker.LIMIT_DOWN_TOLERANCE
+            blocked_down = (close <= limit_down) | (m['Low_Raw'][t] <= limit_down)
+            sell_idx = np.flatnonzero(held & trigger & (available > 0) & ~blocked_down)
+            # 与单票引擎一致：当天开盘时持仓的股票，当天不再回补买入
+            held_at_open = shares > 0
+
+            if sell_idx.size:
+                price = close[sell_idx] * (1 - slip)
+                qty = available[sell_idx]
+                amount = qty * price
+                comm, stamp = self._fees(amount)
+                broker.cash += float(np.sum(amount - comm - stamp))
+                shares[sell_idx] -= qty
+                cost_price[sell_idx] = 0.0
+                holding_days[sell_idx] = 0
+                trade_chunks.append(("SELL", t, sell_idx, price, qty, amount, comm, stamp))
+
+            # --- 买入：空仓且出现买点、未被涨停封死，按剩余仓位名额分配资金 ---
+            slots = self.max_positions - int(np.count_nonzero(shares))
+            if slots > 0:
+                limit_up = m['limit_up'][t] * broker.LIMIT_UP_TOLERANCE
+                blocked_up = (close >= limit_up) | (m['High_Raw'][t] >= limit_up)
+                cand = np.flatnonzero(tradable & m['__BUY_SIGNAL__'][t] & ~held_at_open & ~blocked_up)
+
+                if cand.size:
+                    if self.score_col:
+                        score = np.nan_to_num(m['__SCORE__'][t][cand], nan=-np.inf)
+                        cand = cand[np.argsort(-score, kind='stable')]
+                    cand = cand[:slots]
+
+                    mark = np.where(np.isnan(last_close), 0.0, last_close)
+                    equity_now = broker.cash + float(np.sum(shares * mark))
+                    price = close[cand] * (1 + slip)
+
+                    # 每个新仓位的目标资金不超过 总资产/最大持仓数，合计不超过现金
+                    deployable = min(broker.cash, equity_now / self.max_positions * cand.size)
+                    if self.sizing == "signal":
+                        w = np.clip(np.nan_to_num(m['__SCORE__'][t][cand], nan=0.0), 0, None)
+                        w = w / w.sum() if w.sum() > 0 else np.full(cand.size, 1.0 / cand.size)
+                    else:
+                        w = np.full(cand.size, 1.0 / cand.size)
+                    budget = _cap_budgets(deployable, w, equity_now / self.max_positions)
+
+                    qty = (np.floor(budget / price / lot) * lot).astype(np.int64)
+                    amount = qty * price
+                    comm, stamp = self._fees(amount)
+                    # 与 AShareBroker 一致：加上手续费后超预算则减一手重试
+                    over = amount + comm + stamp > budget
+                    if over.any():
+                        qty = np.where(over, qty - lot, qty)
+                        amount = qty * price
+                        comm, stamp = self._fees(amount)
+
+                    ok = qty >= lot
+                    if ok.any():
+                        cand, price, qty = cand[ok], price[ok], qty[ok]
+                        amount, comm, stamp = amount[ok], comm[ok], stamp[ok]
+                        broker.cash -= float(np.sum(amount + comm + stamp))
+                        shares[cand] += qty
+                        cost_price[cand] = price
+                        holding_days[cand] = 1
+                        trade_chunks.append(("BUY", t, cand, price, qty, amount, comm, stamp))
+
+            mark = np.where(np.isnan(last_close), 0.0, last_close)
+            equity_arr[t] = broker.cash + float(np.sum(shares * mark))
+            cash_arr[t] = broker.cash
+            positions_arr[t] = np.count_nonzero(shares)
+
+        self.equity_df = pd.DataFrame({
+            "Date": self.dates,
+            "Equity": equity_arr,
+            "Cash": cash_arr,
+            "Position_Value": equity_arr - cash_arr,
+            "Positions": positions_arr,
+            "Is_Trading": m['is_trading'].any(axis=1) if self.codes else np.zeros(0, dtype=bool)
+        })
+        self.trades_df = self._build_trades(trade_chunks)
+        return self.equity_df, self.trades_df
+
+    def _build_trades(self, chunks):
+        """把撮合过程中按天收集的成交块一次性拼成交易流水表"""
+        columns = ["Date", "Code", "Type", "Price", "Shares", "Amount", "Commission", "Stamp_Duty"]
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        codes = np.asarray(self.codes)
+        parts = []
+        for side, t, idx, price, qty, amount, comm, stamp in chunks:
+            parts.append(pd.DataFrame({
+                "Date": self.dates[t],
+                "Code": codes[idx],
+                "Type": side,
+                "Price": price,
+                "Shares": qty,
+                "Amount": amount,
+                "Commission": comm,
+                "Stamp_Duty": stamp
+            }))
+        return pd.concat(parts, ignore_index=True)
+
+    def generate_report(self):
+        """组合层面的战报：净值指标 + 按个股配对的往返交易胜率"""
+        init_eq = self.broker.initial_cash
+        if self.equity_df.empty or self.trades_df.empty:
+            return {
+                "Initial_Cash": init_eq, "Final_Equity": init_eq, "Total_Return": 0.0,
+                "Annual_Return": 0.0, "Max_Drawdown": 0.0, "Sharpe_Ratio": 0.0, "Calmar_Ratio": 0.0,
+                "Total_Trades_Pairs": 0, "Win_Rate": 0.0
+            }
+
+        report = {"Initial_Cash": init_eq}
+        report.update(calc_core_metrics(self.equity_df['Equity'], self.equity_df['Is_Trading'], init_eq, []))
+
+        # 组合里买卖交错，往返台账在每只股票内部按先后顺序配对
+        round_trips = build_round_trips(self.trades_df, self.equity_df)
+        report["Total_Trades_Pairs"] = len(round_trips)
+        report["Win_Rate"] = float(round_trips['Is_Win'].mean()) if len(round_trips) else 0.0
+        report["Round_Trips"] = round_trips
+        return report
+
+
+# ------ 后台任务 (job_queue) ------
+def portfolio_backtest_job(ctx, codes, buy_logic, sell_logic, **portfolio_kwargs):
+    """
+    策略全景阅兵场的共享资金组合回测任务 (在 job_queue 的工作进程里执行)。
+    读行情时逐只、撮合时约每年回报一次进度并检查取消。
+    :param portfolio_kwargs: 透传给 PortfolioBacktester 的资金、费率、仓位规则、风控与时间窗口
+    :return: {"curve_df", "trades_df", "report"}
+    """
+    bt = PortfolioBacktester(codes, buy_logic, sell_logic, progress=ctx.checkpoint, **portfolio_kwargs)
+    curve_df, trades_df = bt.run()
+    ctx.checkpoint(1, 1, "生成组合战报")
+    return {"curve_df": curve_df, "trades_df": trades_df, "report": bt.generate_report()}
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    if os.path.exists(VAULT_DIR):
+        all_codes = sorted(f.replace('.parquet', '') for f in os.listdir(VAULT_DIR) if f.endswith('.parquet'))
+        bt = PortfolioBacktester(
+            all_codes,
+            buy_logic="Close_Qfq > MA_20 and MACD_Hist > 0",
+            sell_logic="Close_Qfq < MA_10",
+            max_positions=5,
+            stop_loss_pct=0.08,
+            max_hold_days=20,
+            start_date="2015-01-01"
+        )
+        curve_df, trades_df = bt.run()
+        report = bt.generate_report()
+        print("\n🏆 === 组合战报 ===")
+        for k, v in report.items():
+            print(f"  {k}: {v}")
+        print(trades_df.tail())
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+# 往返交易台账的列顺序
+ROUND_TRIP_COLUMNS = [
+    "Entry_Date", "Exit_Date", "Entry_Price", "Exit_Price", "Shares",
+    "Entry_Cost", "Exit_Proceeds", "Fees", "PnL", "Return_Pct",
+    "Holding_Days", "Calendar_Days", "Is_Win"
+]
+
+# 分期战报 (Tear Sheet) 的列名，与回测舱 / 阅兵场页面的展示口径一致
+TEAR_SHEET_COLUMNS = ["周期", "策略净收益", "基准天然涨幅", "🔥 超额收益 (Alpha)", "期间最大回撤"]
+
+
+def build_round_trips(trades, equity_df=None):
+    """
+    把 broker 的逐笔流水整理成往返交易台账 (一买一卖为一行)。
+    买卖按先后顺序配对 (组合流水含 Code 列时在每只股票内部配对)，未平仓的最后一笔买单不计入。
+
+    :param trades: broker.trades (TradeLog)、交易字典列表或同结构的 DataFrame
+    :param equity_df: 可选，带 Date / Is_Trading 的净值表，用于统计持有期内的有效交易日数
+    :return: DataFrame，列见 ROUND_TRIP_COLUMNS (组合流水额外带 Code 列)
+                Entry_Cost 为买入成交额 + 佣金 + 印花税，Exit_Proceeds 为卖出成交额 - 佣金 - 印花税，
+                PnL = Exit_Proceeds - Entry_Cost (完全含费)，Is_Win 沿用战报口径：卖出单价 > 买入单价
+    """
+    if isinstance(trades, pd.DataFrame):
+        trades_df = trades
+    elif hasattr(trades, "to_frame"):
+        trades_df = trades.to_frame()
+    else:
+        trades_df = pd.DataFrame(trades)
+    keys = ['Code'] if 'Code' in trades_df.columns else []
+    if trades_df.empty:
+        return pd.DataFrame(columns=keys + ROUND_TRIP_COLUMNS)
+
+    seq = trades_df.groupby(keys + ['Type']).cumcount() if keys else trades_df.groupby('Type').cumcount()
+    buys = trades_df[trades_df['Type'] == 'BUY'].assign(Seq=seq)
+    sells = trades_df[trades_df['Type'] == 'SELL'].assign(Seq=seq)
+    pairs = buys.merge(sells, on=keys + ['Seq'], suffixes=('_Buy', '_Sell'))
+
+    entry_cost = pairs['Amount_Buy'] + pairs['Commission_Buy'] + pairs['Stamp_Duty_Buy']
+    exit_proceeds = pairs['Amount_Sell'] - pairs['Commission_Sell'] - pairs['Stamp_Duty_Sell']
+    entry_date = pd.to_datetime(pairs['Date_Buy'])
+    exit_date = pd.to_datetime(pairs['Date_Sell'])
+
+    ledger = pd.DataFrame({
+        "Entry_Date": entry_date,
+        "Exit_Date": exit_date,
+        "Entry_Price": pairs['Price_Buy'],
+        "Exit_Price": pairs['Price_Sell'],
+        "Shares": pairs['Shares_Sell'],
+        "Entry_Cost": entry_cost,
+        "Exit_Proceeds": exit_proceeds,
+        "Fees": (pairs['Commission_Buy'] + pairs['Stamp_Duty_Buy']
+                 + pairs['Commission_Sell'] + pairs['Stamp_Duty_Sell']),
+        "PnL": exit_proceeds - entry_cost,
+        "Return_Pct": (exit_proceeds - entry_cost) / entry_cost,
+        "Holding_Days": np.nan,
+        "Calendar_Days": (exit_date - entry_date).dt.days,
+        "Is_Win": pairs['Price_Sell'] > pairs['Price_Buy']
+    })
+
+    if equity_df is not None and len(ledger):
+        # 持有期内的有效交易日数 (含买入当天与卖出当天)，用累计计数一次性查表
+        cal = pd.DatetimeIndex(equity_df['Date'])
+        cum_trading = np.cumsum(np.asarray(equity_df['Is_Trading'], dtype=bool))
+        lo = cal.searchsorted(entry_date)
+        hi = cal.searchsorted(exit_date)
+        before = np.where(lo > 0, cum_trading[np.maximum(lo - 1, 0)], 0)
+        ledger["Holding_Days"] = cum_trading[np.minimum(hi, len(cal) - 1)] - before
+
+    for key in keys:
+        ledger.insert(0, key, pairs[key].to_numpy())
+    return ledger
+
+
+def calc_tear_sheet(equity_df, freq="Y"):
+    """
+    一次性算出所有周期的分期战报 (按年 "Y" 或按月 "M")，全部用 groupby 聚合，不逐组回调 Python。
+    口径：区间首尾净值算策略收益；区间内有效收盘价首尾算基准涨幅；
+    区间内净值相对区间内高点的最大回撤；不足 2 个交易日的周期跳过。
+
+    :param equity_df: 带 Date / Equity / Close_Price 的净值表
+    :return: DataFrame，列见 TEAR_SHEET_COLUMNS
+    """
+    if equity_df is None or len(equity_df) == 0 or 'Close_Price' not in equity_df.columns:
+        return pd.DataFrame()
+
+    dates = pd.to_datetime(equity_df['Date'])
+    if freq == "Y":
+        key = dates.dt.year
+        label = lambda k: f"{k}年"
+    else:
+        key = dates.dt.to_period('M')
+        label = str
+
+    equity = equity_df['Equity'].astype(float)
+    prices = equity_df['Close_Price'].astype(float)
+
+    grouped_eq = equity.groupby(key, sort=True)
+    grouped_px = prices.groupby(key, sort=True)
+    size = grouped_eq.size()
+    start_eq = grouped_eq.first()
+    end_eq = grouped_eq.last()
+    # first / last 会跳过 NaN，正好对应“区间内有效收盘价”的首尾
+    start_p = grouped_px.first()
+    end_p = grouped_px.last()
+    n_prices = grouped_px.count()
+    running_max = grouped_eq.cummax()
+    mdd = ((equity - running_max) / running_max).groupby(key, sort=True).min()
+
+    start_eq_arr = start_eq.to_numpy()
+    strat_ret = np.where(start_eq_arr > 0, (end_eq.to_numpy() - start_eq_arr) / np.where(start_eq_arr > 0, start_eq_arr, 1), 0.0)
+    start_p_arr = start_p.to_numpy()
+    bench_ret = np.where((n_prices.to_numpy() >= 2) & (start_p_arr != 0),
+                         (end_p.to_numpy() - start_p_arr) / np.where(start_p_arr != 0, start_p_arr, 1), 0.0)
+
+    sheet = pd.DataFrame({
+        TEAR_SHEET_COLUMNS[0]: [label(k) for k in size.index],
+        TEAR_SHEET_COLUMNS[1]: strat_ret,
+        TEAR_SHEET_COLUMNS[2]: bench_ret,
+        TEAR_SHEET_COLUMNS[3]: strat_ret - bench_ret,
+        TEAR_SHEET_COLUMNS[4]: mdd.to_numpy()
+    })
+    sheet = sheet[size.to_numpy() >= 2].reset_index(drop=True)
+    return sheet if not sheet.empty else pd.DataFrame()
+
+
+def stack_tear_sheets(sheets):
+    """
+    把多只股票的分期战报竖向拼成一张长表 (阅兵场的全军热力图 / 时效性统计用)。
+    :param sheets: {标签: 分期战报 DataFrame}
+    :return: DataFrame [股票代码, 周期, Alpha]
+    """
+    frames = {k: v for k, v in sheets.items() if v is not None and not v.empty}
+    if not frames:
+        return pd.DataFrame(columns=["股票代码", "周期", "Alpha"])
+    stacked = pd.concat(frames, names=["股票代码", None]).reset_index(level=0)
+    return pd.DataFrame({
+        "股票代码": stacked["股票代码"].to_numpy(),
+        "周期": stacked[TEAR_SHEET_COLUMNS[0]].astype(str).to_numpy(),
+        "Alpha": stacked[TEAR_SHEET_COLUMNS[3]].to_numpy()
+    })
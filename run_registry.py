@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import inspect
+import numpy as np
+import pandas as pd
+from ashare_broker import TradeLog
+from strategy_expr import compile_strategy
+from strategy_runner import StrategyRunner
+from vault_io import resolve_date_window
+
+RUN_REGISTRY_DIR = "backtest_data/run_registry"
+# 撮合 / 战报口径发生变化时调高版本号，旧档案的键自然全部对不上
+REGISTRY_VERSION = 1
+# 战报里以表格形式落盘的字段，其余字段都是标量
+REPORT_FRAMES = ("Tear_Sheet_Yearly", "Tear_Sheet_Monthly", "Round_Trips")
+# 档案列表里展示的单票核心指标
+SINGLE_METRICS = ("Total_Return", "Benchmark_Return", "Annual_Return", "Max_Drawdown", "Sharpe_Ratio",
+                  "Win_Rate", "Total_Trades_Pairs")
+
+_RUNNER_DEFAULTS = {name: p.default for name, p in inspect.signature(StrategyRunner.__init__).parameters.items()
+                    if p.default is not inspect.Parameter.empty}
+
+
+def run_spec(runner_kwargs):
+    """
+    把 StrategyRunner 的参数整理成决定回测结果的规范字典：表达式取规范化文本，
+    未给出的参数补上 StrategyRunner 的默认值，日期窗口换算成实际生效的闭区间
+    (不给截止日期时以“今天”为界，Vault 里的未来占位行随日期推移会进入窗口)。
+    :raises StrategyExpressionError: 表达式语法错误
+    """
+    kw = dict(_RUNNER_DEFAULTS, **runner_kwargs)
+    buy_expr, sell_expr = compile_strategy(kw.get("buy_logic"), kw.get("sell_logic"))
+    lower, upper = resolve_date_window(kw.get("start_date"), kw.get("end_date"))
+    optional = lambda v, cast: None if v is None else cast(v)
+    return {
+        "buy": buy_expr.normalized if buy_expr is not None else None,
+        "sell": sell_expr.normalized if sell_expr is not None else None,
+        "stop_loss_pct": optional(kw["stop_loss_pct"], float),
+        "take_profit_pct": optional(kw["take_profit_pct"], float),
+        "max_hold_days": optional(kw["max_hold_days"], int),
+        "initial_cash": float(kw["initial_cash"]),
+        "commission": float(kw["commission"]),
+        "stamp_duty": float(kw["stamp_duty"]),
+        "slippage": float(kw["slippage"]),
+        "start_date": str(lower.date()) if lower is not None else None,
+        "end_date": str(upper.date())
+    }
+
+
+def vault_version(data_paths):
+    """
+    一组 Vault 文件的数据版本：各文件 (文件名, 大小, 修改时间) 的哈希。
+    只读文件元信息、不读内容，数千只股票也只需毫秒级；Vault 重建后版本随之改变。
+    """
+    h = hashlib.sha1()
+    for path in sorted(data_paths):
+        st = os.stat(path)
+        h.update(f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()
+
+
+def run_key(kind, codes, data_paths, runner_kwargs):
+    """回测请求的档案键：类型 + 股票 + 策略规范 + 数据版本，任何一项不同都是不同的档案"""
+    payload = {"version": REGISTRY_VERSION, "kind": kind, "codes": sorted(codes),
+               "spec": run_spec(runner_kwargs), "vault": vault_version(data_paths)}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:24]
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(value)
+    if isinstance(value, tuple):
+        return list(value)
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def _trades_frame(trades):
+    if isinstance(trades, TradeLog):
+        return trades.to_frame()
+    return pd.DataFrame(list(trades or []), columns=TradeLog.COLUMNS)
+
+
+class RunRegistry:
+    """
+    本地回测档案库。每次回测一个目录 ({键}/)：
+      - meta.json：类型、策略规范、标签、创建时间、标量指标 (列档案时只读这个文件)；
+      - 净值曲线、交易流水、战报里的各张表各存一个 Parquet 文件 (列式压缩，读回即是 DataFrame)。
+    先写临时目录再整体改名，写到一半崩溃不会留下残缺档案。
+    """
+    def __init__(self, registry_dir=RUN_REGISTRY_DIR):
+        self.registry_dir = registry_dir
+
+    def _dir(self, key):
+        return os.path.join(self.registry_dir, key)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self._dir(key), "meta.json"))
+
+    def _write(self, key, meta, frames):
+        """
+        写入一份档案。临时目录名带 uuid，同一进程里的多个会话线程同时保存同一个键也互不干扰；
+        键相同即参数与数据都相同，目标目录已有完整档案时直接视为已保存 (不先删再换，读者不会看到档案短暂消失)。
+        """
+        final_dir = self._dir(key)
+        if self.has(key):
+            return
+        tmp_dir = f"{final_dir}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_dir)
+        for name, df in frames.items():
+            if df is not None:
+                df.to_parquet(os.path.join(tmp_dir, f"{name}.parquet"), engine="pyarrow", index=False)
+        meta = dict(meta, key=key, version=REGISTRY_VERSION, created_at=time.strftime("%Y-%m-%d %H:%M:%S"),
+                    frames=[name for name, df in frames.items() if df is not None])
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, default=_json_default)
+        if os.path.isdir(final_dir) and not self.has(key):
+            # 之前崩溃残留的不完整目录：先改名挪开再删，避免与并发写入者互删
+            stale_dir = f"{final_dir}.{uuid.uuid4().hex}.stale"
+            try:
+                os.replace(final_dir, stale_dir)
+                shutil.rmtree(stale_dir, ignore_errors=True)
+            except OSError:
+                pass
+        try:
+            os.replace(tmp_dir, final_dir)
+        except OSError:
+            # 另一个写入者抢先完成了同一份档案
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def read_meta(self, key):
+        with open(os.path.join(self._dir(key), "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _read_frame(self, key, name, columns=None):
+        path = os.path.join(self._dir(key), f"{name}.parquet")
+        return pd.read_parquet(path, columns=columns) if os.path.exists(path) else None
+
+    # ------ 单票回测 (专业回测舱) ------
+    def save_single(self, key, spec, stock_code, curve_df, trades, report, profile=None, seconds=None):
+        scalars = {k: v for k, v in report.items() if k not in REPORT_FRAMES}
+        frames = {"curve": curve_df, "trades": _trades_frame(trades)}
+        frames.update({f"report_{name}": report.get(name) for name in REPORT_FRAMES})
+        meta = {"kind": "single", "spec": spec, "codes": [stock_code], "label": stock_code,
+                "report": scalars, "profile": profile, "seconds": seconds}
+        self._write(key, meta, frames)
+
+    def load_single(self, key):
+        """读回与专业回测舱 session_state.backtest_results 同结构的字典，档案不存在时返回 None"""
+        if not self.has(key):
+            return None
+        meta = self.read_meta(key)
+        report = dict(meta["report"])
+        for name in REPORT_FRAMES:
+            frame = self._read_frame(key, f"report_{name}")
+            report[name] = frame if frame is not None else pd.DataFrame()
+        return {
+            "curve_df": self._read_frame(key, "curve"),
+            "trades": TradeLog.from_frame(self._read_frame(key, "trades")),
+            "report": report,
+            "stock_code": meta["codes"][0],
+            "profile": meta.get("profile"),
+            "registry_key": key
+        }
+
+    def load_curve(self, key):
+        """只读某次单票回测的 Date / Equity 两列 (档案对比画图用)"""
+        return self._read_frame(key, "curve", columns=["Date", "Equity"])
+
+    # ------ 批量回测 (策略全景阅兵场) ------
+    def save_batch(self, key, spec, results, total_stocks, profiles=None, wall_seconds=None,
+                   code_column="标的代码", frame_columns=("Tear_Sheet_Monthly",), trades_column="trades"):
+        """
+        results 为逐股结果字典的列表：标量字段合并成一张结果表，
+        frame_columns 里的逐股表格与交易流水各自纵向拼成一张长表 (带股票代码列)。
+        """
+        nested = set(frame_columns) | {trades_column}
+        table = pd.DataFrame([{k: v for k, v in r.items() if k not in nested} for r in results])
+        frames = {"results": table}
+        for col in frame_columns:
+            parts = [r[col].assign(**{code_column: r[code_column]}) for r in results
+                     if isinstance(r.get(col), pd.DataFrame) and not r[col].empty]
+            frames[col] = pd.concat(parts, ignore_index=True) if parts else None
+        parts = [_trades_frame(r.get(trades_column)).assign(**{code_column: r[code_column]}) for r in results]
+        frames["trades"] = pd.concat(parts, ignore_index=True) if parts else _trades_frame(None)
+
+        summary = {}
+        if len(table):
+            for col in table.select_dtypes("number").columns:
+                summary[col] = float(table[col].mean())
+        meta = {"kind": "batch", "spec": spec, "codes": [r[code_column] for r in results],
+                "label": f"{len(results)} 只股票", "report": summary, "total_stocks": total_stocks,
+                "profiles": profiles, "seconds": wall_seconds,
+                "layout": {"code_column": code_column, "frame_columns": list(frame_columns), "trades_column": trades_column}}
+        self._write(key, meta, frames)
+
+    def load_batch(self, key):
+        """读回逐股结果字典列表 (与写入时同结构)，档案不存在时返回 None"""
+        if not self.has(key):
+            return None
+        meta = self.read_meta(key)
+        layout = meta["layout"]
+        code_column = layout["code_column"]
+        table = self._read_frame(key, "results")
+        per_code = {}
+        for col in layout["frame_columns"]:
+            frame = self._read_frame(key, col)
+            per_code[col] = {code: g.drop(columns=[code_column]).reset_index(drop=True)
+                             for code, g in frame.groupby(code_column, sort=False)} if frame is not None else {}
+        trades = self._read_frame(key, "trades")
+        trades_by_code = {code: g.drop(columns=[code_column]).reset_index(drop=True)
+                          for code, g in trades.groupby(code_column, sort=False)}
+
+        results = []
+        for row in table.to_dict("records"):
+            code = row[code_column]
+            for col in layout["frame_columns"]:
+                row[col] = per_code[col].get(code)
+            row[layout["trades_column"]] = TradeLog.from_frame(trades_by_code.get(code, _trades_frame(None)))
+            results.append(row)
+        return {"results": results, "total_stocks": meta["total_stocks"], "profiles": meta.get("profiles") or [],
+                "wall_seconds": meta.get("seconds"), "registry_key": key}
+
+    # ------ 档案管理 ------
+    def list_runs(self, kind=None):
+        """列出全部档案 (新的在前)：键、类型、标签、创建时间、策略规范与标量指标"""
+        rows = []
+        if os.path.isdir(self.registry_dir):
+            for key in os.listdir(self.registry_dir):
+                if not self.has(key):
+                    continue
+                meta = self.read_meta(key)
+                if kind is not None and meta["kind"] != kind:
+                    continue
+                spec = meta["spec"]
+                row = {"key": key, "类型": meta["kind"], "标的": meta["label"], "创建时间": meta["created_at"],
+                       "买入逻辑": spec["buy"], "卖出逻辑": spec["sell"], "区间": f"{spec['start_date']} ~ {spec['end_date']}",
+                       "止损": spec["stop_loss_pct"], "止盈": spec["take_profit_pct"], "最长持仓": spec["max_hold_days"]}
+                row.update(meta.get("report") or {})
+                rows.append(row)
+        df = pd.DataFrame(rows)
+        return df.sort_values("创建时间", ascending=False).reset_index(drop=True) if len(df) else df
+
+    def compare(self, keys):
+        """
+        并排对比若干档案：返回 (指标表, {键: 净值曲线})。
+        指标表每列一次回测、每行一个指标与策略参数；单票档案附带净值曲线，批量档案没有曲线。
+        """
+        columns, curves = {}, {}
+        for key in keys:
+            meta = self.read_meta(key)
+            spec = meta["spec"]
+            col = {"标的": meta["label"], "创建时间": meta["created_at"], "买入逻辑": spec["buy"], "卖出逻辑": spec["sell"],
+                   "区间": f"{spec['start_date']} ~ {spec['end_date']}", "止损": spec["stop_loss_pct"],
+                   "止盈": spec["take_profit_pct"], "最长持仓": spec["max_hold_days"]}
+            col.update(meta.get("report") or {})
+            columns[key] = col
+            if meta["kind"] == "single":
+                curves[key] = self.load_curve(key)
+        return pd.DataFrame(columns), curves
+
+    def delete(self, key):
+        shutil.rmtree(self._dir(key), ignore_errors=True)
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    test_file = "backtest_data/final_vault/600519.parquet"
+    if os.path.exists(test_file):
+        kwargs = {"buy_logic": "Close_Qfq > MA_20", "sell_logic": "Close_Qfq < MA_10", "stop_loss_pct": 0.08,
+                  "start_date": "2010-01-01", "end_date": "2024-12-31"}
+        registry = RunRegistry()
+        key = run_key("single", ["600519"], [test_file], kwargs)
+
+        t0 = time.perf_counter()
+        runner = StrategyRunner(test_file, **kwargs)
+        curve_df, trades = runner.run()
+        report = runner.generate_report(curve_df)
+        run_seconds = time.perf_counter() - t0
+        registry.save_single(key, run_spec(kwargs), "600519", curve_df, trades, report, runner.profile_summary(), run_seconds)
+
+        t0 = time.perf_counter()
+        loaded = registry.load_single(run_key("single", ["600519"], [test_file], kwargs))
+        print(f"回测 {run_seconds:.3f}s，读档 {time.perf_counter() - t0:.3f}s，键 {key}")
+        print(f"总收益 {loaded['report']['Total_Return']:.4f} vs {report['Total_Return']:.4f}，交易 {len(loaded['trades'])} 笔")
+        print(registry.list_runs().head().to_string())
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
@@ -0,0 +1,149 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from strategy_expr import ALLOWED_FUNCTIONS
+from vault_io import VAULT_CACHE
+
+# 落盘的信号缓存目录与容量上限 (超出后按最近使用时间淘汰最旧的条目)
+SIGNAL_CACHE_DIR = "backtest_data/signal_cache"
+SIGNAL_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# 进程内的文件指纹备忘：(真实路径, 大小, 修改时间) -> 内容哈希，同一文件只哈希一次
+_FINGERPRINT_MEMO = {}
+
+
+def vault_fingerprint(data_path):
+    """
+    Vault 文件的内容指纹 (SHA1)。
+    重建后的文件内容一变指纹就变，旧缓存自然失效；内容没变 (哪怕重写过一遍) 则继续命中。
+    """
+    real_path = os.path.realpath(data_path)
+    st = os.stat(real_path)
+    memo_key = (real_path, st.st_size, st.st_mtime_ns)
+    digest = _FINGERPRINT_MEMO.get(memo_key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(real_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _FINGERPRINT_MEMO[memo_key] = digest
+    return digest
+
+
+def _vault_prefix(data_path):
+    """同一个 Vault 文件的所有缓存条目共用的文件名前缀 (按真实路径区分)"""
+    return hashlib.sha1(os.path.realpath(data_path).encode("utf-8")).hexdigest()[:16]
+
+
+def _entry_path(data_path, fingerprint, expr, cache_dir):
+    expr_key = hashlib.sha1(expr.normalized.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(cache_dir, f"{_vault_prefix(data_path)}_{fingerprint[:16]}_{expr_key}.npy")
+
+
+def _evaluate_full_file(data_path, expr):
+    """只读取表达式用到的列，在整张 Vault 上求值 (行顺序与 Parquet 原始行号一致)"""
+    columns = [c for c in expr.columns if c not in ALLOWED_FUNCTIONS]
+    if columns:
+        # 经由进程级 Vault 内存缓存取列，已加载过的列不再读盘
+        df = pd.DataFrame(VAULT_CACHE.get_columns(data_path, columns), copy=False)
+    else:
+        # 常量表达式 (如 "False") 只需要行数
+        df = pd.DataFrame(index=pd.RangeIndex(pq.read_metadata(data_path).num_rows))
+    # 与撮合内核同口径：按 Python 真值折算成布尔
+    return expr.evaluate(df).to_numpy().astype(bool)
+
+
+def invalidate_vault(data_path, keep_fingerprint=None, cache_dir=SIGNAL_CACHE_DIR):
+    """删除某个 Vault 文件的全部缓存条目 (可保留当前指纹的条目)，重建 Vault 后调用"""
+    if not os.path.isdir(cache_dir):
+        return 0
+    prefix = _vault_prefix(data_path) + "_"
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if not name.startswith(prefix):
+            continue
+        if keep_fingerprint is not None and name.startswith(prefix + keep_fingerprint[:16] + "_"):
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def enforce_size_limit(cache_dir=SIGNAL_CACHE_DIR, max_bytes=SIGNAL_CACHE_MAX_BYTES):
+    """总容量超限时按最近使用时间 (命中会刷新 mtime) 从旧到新淘汰"""
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npy"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, path))
+        total += st.st_size
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes:
+            break
+
+
+def get_signal(data_path, expr, cache_dir=SIGNAL_CACHE_DIR, max_bytes=SIGNAL_CACHE_MAX_BYTES):
+    """
+    取整张 Vault 上某条表达式的布尔信号 (按 Parquet 原始行号排列)。
+    命中时直接读盘，完全跳过表达式求值；未命中时只读相关列算一次并落盘。
+    表达式是逐行计算的，调用方按自己的时间窗口用原始行号切片即可。
+    """
+    fingerprint = vault_fingerprint(data_path)
+    path = _entry_path(data_path, fingerprint, expr, cache_dir)
+
+    if os.path.exists(path):
+        try:
+            signal = np.load(path, allow_pickle=False)
+            os.utime(path)  # 刷新最近使用时间，供 LRU 淘汰参考
+            return signal
+        except (OSError, ValueError):
+            # 条目损坏或恰好被其他进程淘汰，当作未命中重算
+            pass
+
+    signal = _evaluate_full_file(data_path, expr)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Vault 重建后旧指纹的条目已无用，顺手清掉
+        invalidate_vault(data_path, keep_fingerprint=fingerprint, cache_dir=cache_dir)
+        # 先写临时文件再原子替换，多进程并发写同一条目也不会读到半截文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, signal, allow_pickle=False)
+        os.replace(tmp_path, path)
+        enforce_size_limit(cache_dir, max_bytes)
+    except OSError as e:
+        # 缓存目录不可写 (如只读部署) 不影响回测本身
+        print(f"⚠️ 信号缓存写入失败，本次直接使用现算结果: {e}")
+    return signal
+
+
+def clear_signal_cache(cache_dir=SIGNAL_CACHE_DIR):
+    """清空全部信号缓存"""
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
@@ -0,0 +1,137 @@
+import time
+import tracemalloc
+import contextlib
+import pandas as pd
+
+# 回测各阶段的展示名 (数据里统一用英文键，方便跨股票汇总)
+STAGE_LABELS = {
+    "compile": "表达式编译与校验",
+    "load": "读取行情 (Parquet + 时间窗口)",
+    "signals": "信号计算 (eval / 信号缓存)",
+    "loop": "逐日撮合大循环",
+    "checkpoint_load": "读取断点",
+    "checkpoint_save": "保存断点",
+    "report": "生成战报"
+}
+COUNTER_LABELS = {
+    "buy_attempted": "买单提交",
+    "buy_rejected": "买单被拒",
+    "sell_attempted": "卖单提交",
+    "sell_rejected": "卖单被拒"
+}
+
+
+class StageProfiler:
+    """
+    按阶段记录回测的墙钟耗时、处理行数，以及 (可选的) 阶段内 Python 侧峰值内存。
+    同名阶段多次进入时累加耗时与行数，峰值内存取最大值。
+    内存统计依赖 tracemalloc，会拖慢纯 Python 的大循环，所以默认关闭。
+    """
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.stages = {}    # 阶段键 -> {"seconds", "rows", "peak_bytes", "calls"}
+        self.counters = {}  # 调用方附加的计数 (如订单提交 / 被拒次数)
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """
+        计时一个阶段。rows 可以在进入时给出，也可以在阶段内通过 yield 出来的 dict 补填 (record["rows"] = n)。
+        """
+        record = {"rows": rows}
+        started_tracing = False
+        base = 0
+        if self.track_memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            else:
+                tracemalloc.start()
+                started_tracing = True
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - t0
+            peak = None
+            if self.track_memory:
+                peak = max(tracemalloc.get_traced_memory()[1] - base, 0)
+                if started_tracing:
+                    tracemalloc.stop()
+            self._accumulate(name, seconds, record["rows"], peak)
+
+    def _accumulate(self, name, seconds, rows, peak):
+        entry = self.stages.setdefault(name, {"seconds": 0.0, "rows": None, "peak_bytes": None, "calls": 0})
+        entry["seconds"] += seconds
+        entry["calls"] += 1
+        if rows is not None:
+            entry["rows"] = (entry["rows"] or 0) + int(rows)
+        if peak is not None:
+            entry["peak_bytes"] = max(entry["peak_bytes"] or 0, peak)
+
+    def summary(self):
+        """可 pickle 的纯数据快照 (跨进程回传给批量回测页)"""
+        return {
+            "stages": {name: dict(entry) for name, entry in self.stages.items()},
+            "counters": dict(self.counters),
+            "total_seconds": sum(entry["seconds"] for entry in self.stages.values()),
+            "track_memory": self.track_memory
+        }
+
+
+def profile_to_frame(summary):
+    """单次回测的分阶段明细表"""
+    rows = []
+    total = summary["total_seconds"] or 1.0
+    for name, entry in summary["stages"].items():
+        rows.append({
+            "阶段": STAGE_LABELS.get(name, name),
+            "耗时(秒)": entry["seconds"],
+            "耗时占比": entry["seconds"] / total,
+            "处理行数": entry["rows"],
+            "吞吐(行/秒)": entry["rows"] / entry["seconds"] if entry["rows"] and entry["seconds"] > 0 else None,
+            "峰值内存(MB)": entry["peak_bytes"] / 1024 / 1024 if entry["peak_bytes"] is not None else None
+        })
+    return pd.DataFrame(rows)
+
+
+def counters_to_frame(summary):
+    """订单提交 / 被拒计数"""
+    return pd.DataFrame([
+        {"指标": COUNTER_LABELS.get(k, k), "次数": v} for k, v in summary["counters"].items()
+    ])
+
+
+def aggregate_profiles(summaries):
+    """
+    把一批股票的 profile 汇总成一张表：各阶段总耗时、单票平均 / 最大耗时、总行数、单票最大峰值内存。
+    :param summaries: StageProfiler.summary() 的列表
+    :return: (分阶段汇总表, 订单计数汇总表)
+    """
+    records = []
+    for summary in summaries:
+        for name, entry in summary["stages"].items():
+            records.append({"stage": name, "seconds": entry["seconds"], "rows": entry["rows"],
+                            "peak_bytes": entry["peak_bytes"]})
+    if not records:
+        return pd.DataFrame(), pd.DataFrame()
+
+    df = pd.DataFrame(records)
+    order = list(dict.fromkeys(df["stage"]))
+    g = df.groupby("stage", sort=False)
+    agg = pd.DataFrame({
+        "股票数": g.size(),
+        "总耗时(秒)": g["seconds"].sum(),
+        "单票平均(秒)": g["seconds"].mean(),
+        "单票最慢(秒)": g["seconds"].max(),
+        "总处理行数": g["rows"].sum(min_count=1),
+        "单票峰值内存(MB)": g["peak_bytes"].max() / 1024 / 1024
+    }).reindex(order)
+    agg["耗时占比"] = agg["总耗时(秒)"] / agg["总耗时(秒)"].sum()
+    agg.index = [STAGE_LABELS.get(name, name) for name in agg.index]
+    agg.index.name = "阶段"
+
+    counters = {}
+    for summary in summaries:
+        for key, value in summary["counters"].items():
+            counters[key] = counters.get(key, 0) + value
+    return agg.reset_index(), counters_to_frame({"counters": counters})
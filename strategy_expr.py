@@ -0,0 +1,188 @@
+import ast
+import io
+import tokenize
+import functools
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+class StrategyExpressionError(ValueError):
+    """策略表达式语法错误或引用了 Vault 中不存在的字段"""
+
+
+# df.eval 支持的数学函数，编译后直接映射到 numpy 的向量化实现
+ALLOWED_FUNCTIONS = {
+    "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "log": np.log, "log10": np.log10,
+    "log1p": np.log1p, "expm1": np.expm1,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan,
+    "arcsin": np.arcsin, "arccos": np.arccos, "arctan": np.arctan, "arctan2": np.arctan2,
+    "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh,
+    "arcsinh": np.arcsinh, "arccosh": np.arccosh, "arctanh": np.arctanh,
+}
+
+_COMPARE_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+_ARITH_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+              ast.BitAnd, ast.BitOr, ast.BitXor)
+
+
+def _replace_booleans(expr):
+    """
+    与 pandas.eval 的预处理一致：把 & / | 按 and / or 的优先级处理，
+    这样 "MA_5 > MA_10 & RSI_14 < 30" 与 "MA_5 > MA_10 and RSI_14 < 30" 含义相同。
+    """
+    tokens = []
+    for tok in tokenize.generate_tokens(io.StringIO(expr).readline):
+        if tok.type == tokenize.OP and tok.string == "&":
+            tokens.append((tokenize.NAME, "and"))
+        elif tok.type == tokenize.OP and tok.string == "|":
+            tokens.append((tokenize.NAME, "or"))
+        else:
+            tokens.append((tok.type, tok.string))
+    return tokenize.untokenize(tokens)
+
+
+class _Vectorizer(ast.NodeTransformer):
+    """
+    把 Python 布尔语法改写成可以直接作用在整列上的位运算：
+    and/or -> &/|，not -> ~，链式比较 a < b < c -> (a < b) & (b < c)。
+    同时收集引用的字段名，拒绝 df.eval 语义之外的任何语法。
+    """
+    def __init__(self):
+        self.columns = set()
+
+    def generic_visit(self, node):
+        allowed = (ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare,
+                   ast.Name, ast.Constant, ast.Call, ast.Load,
+                   ast.And, ast.Or, ast.Not, ast.USub, ast.UAdd, ast.Invert) + _COMPARE_OPS + _ARITH_OPS
+        if not isinstance(node, allowed):
+            raise StrategyExpressionError(f"不支持的表达式语法: {type(node).__name__}")
+        return super().generic_visit(node)
+
+    def visit_BoolOp(self, node):
+        values = [self.visit(v) for v in node.values]
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = values[0]
+        for v in values[1:]:
+            result = ast.BinOp(left=result, op=op, right=v)
+        return result
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=operand)
+        if not isinstance(node.op, (ast.USub, ast.UAdd, ast.Invert)):
+            raise StrategyExpressionError(f"不支持的一元运算: {type(node.op).__name__}")
+        return ast.UnaryOp(op=node.op, operand=operand)
+
+    def visit_Compare(self, node):
+        for op in node.ops:
+            if not isinstance(op, _COMPARE_OPS):
+                raise StrategyExpressionError(f"不支持的比较运算: {type(op).__name__}")
+        left = self.visit(node.left)
+        comparators = [self.visit(c) for c in node.comparators]
+        result = None
+        for op, right in zip(node.ops, comparators):
+            pair = ast.Compare(left=left, ops=[op], comparators=[right])
+            result = pair if result is None else ast.BinOp(left=result, op=ast.BitAnd(), right=pair)
+            left = right
+        return result
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in ALLOWED_FUNCTIONS or node.keywords:
+            raise StrategyExpressionError(f"不支持的函数调用: {ast.unparse(node)}")
+        node.args = [self.visit(a) for a in node.args]
+        return node
+
+    def visit_Name(self, node):
+        self.columns.add(node.id)
+        return node
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (bool, int, float, str)):
+            raise StrategyExpressionError(f"不支持的常量: {node.value!r}")
+        return node
+
+
+class CompiledExpression:
+    """
+    预编译好的策略表达式。同一个表达式在一批股票上只解析一次，之后对每只股票
+    只做一次列取值 + 向量化运算。对象可以被 pickle 传入子进程 (按源码重新编译)。
+    """
+    def __init__(self, source):
+        self.source = source
+        try:
+            tree = ast.parse(_replace_booleans(source.strip()), mode="eval")
+        except (SyntaxError, tokenize.TokenError, IndentationError) as e:
+            raise StrategyExpressionError(f"表达式语法错误: {source!r} ({e})") from e
+
+        # 规范化文本：去掉多余空格与括号，作为缓存键使用
+        self.normalized = ast.unparse(tree)
+        vectorizer = _Vectorizer()
+        vectorized = ast.fix_missing_locations(vectorizer.visit(tree))
+        self.columns = tuple(sorted(vectorizer.columns))
+        self._code = compile(vectorized, f"<strategy: {self.normalized}>", "eval")
+
+    def __reduce__(self):
+        return (compile_expression, (self.source,))
+
+    def __repr__(self):
+        return f"CompiledExpression({self.normalized!r})"
+
+    def validate(self, available_columns, context=""):
+        """字段校验：表达式里引用的每个字段都必须存在于 Vault 表结构中"""
+        missing = [c for c in self.columns if c not in available_columns]
+        if missing:
+            where = f" ({context})" if context else ""
+            raise StrategyExpressionError(f"表达式 {self.source!r} 引用了不存在的字段{where}: {', '.join(missing)}")
+
+    def evaluate(self, df):
+        """在数据表上求值，返回与 df 行索引对齐的结果序列 (与 df.eval 的输出一致)"""
+        namespace = dict(ALLOWED_FUNCTIONS)
+        for col in self.columns:
+            if col in ALLOWED_FUNCTIONS:
+                continue
+            if col not in df.columns:
+                raise StrategyExpressionError(f"表达式 {self.source!r} 引用了不存在的字段: {col}")
+            namespace[col] = df[col]
+        try:
+            result = eval(self._code, {"__builtins__": {}}, namespace)
+        except Exception as e:
+            raise StrategyExpressionError(f"表达式 {self.source!r} 求值失败: {e}") from e
+        if not isinstance(result, pd.Series):
+            # 常量表达式 (如 "False") 广播成整列
+            result = pd.Series(np.broadcast_to(np.asarray(result), len(df)), index=df.index)
+        return result
+
+
+@functools.lru_cache(maxsize=512)
+def compile_expression(source):
+    """编译 (并进程内缓存) 一条策略表达式；同一字符串在整批回测中只解析一次"""
+    return CompiledExpression(source)
+
+
+def read_vault_columns(data_path):
+    """只读 Parquet 文件尾部的元数据拿到字段列表 (按表结构顺序)，不解码任何数据页"""
+    return list(pq.read_schema(data_path).names)
+
+
+def compile_strategy(buy_logic, sell_logic, data_path=None, schema_columns=None):
+    """
+    编译并校验一组买卖表达式 (可以传字符串，也可以传已编译好的 CompiledExpression)。
+    空表达式返回 None (表示该方向永不触发)。
+    给出 data_path 或 schema_columns 时会在加载任何行情数据之前完成字段校验。
+    :raises StrategyExpressionError: 语法错误或字段不存在
+    """
+    if schema_columns is None and data_path is not None:
+        schema_columns = read_vault_columns(data_path)
+
+    compiled = []
+    for side, logic in (("买入条件", buy_logic), ("卖出条件", sell_logic)):
+        if logic is None or (not isinstance(logic, CompiledExpression) and str(logic).strip() == ""):
+            compiled.append(None)
+            continue
+        expr = logic if isinstance(logic, CompiledExpression) else compile_expression(str(logic).strip())
+        if schema_columns is not None:
+            expr.validate(schema_columns, context=side)
+        compiled.append(expr)
+    return compiled[0], compiled[1]
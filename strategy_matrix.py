@@ -0,0 +1,196 @@
+import os
+import io
+import contextlib
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import signal_cache
+from strategy_expr import StrategyExpressionError, compile_strategy, read_vault_columns
+from strategy_runner import (load_backtest_frame, select_vault_columns, extract_market_arrays,
+                             calc_benchmark_return)
+from param_sweep import evaluate_combo
+
+# 对比矩阵里每个 (策略, 股票) 格子保留的指标
+MATRIX_METRICS = ["Total_Return", "Benchmark_Return", "Alpha", "Win_Rate", "Max_Drawdown",
+                  "Sharpe_Ratio", "Total_Trades_Pairs"]
+
+
+def prepare_strategies(strategies, schema_columns=None):
+    """
+    把一组策略配置编译成统一结构，并 (可选地) 对照表结构校验字段。
+    :param strategies: [{"name", "buy_logic", "sell_logic", "stop_loss_pct", "take_profit_pct", "max_hold_days"}, ...]
+                       风控参数缺省或为 0 视为不启用
+    :return: [{"name", "buy", "sell", "risk": (止损, 止盈, 最长持仓)}, ...]，buy / sell 为 CompiledExpression 或 None
+    :raises StrategyExpressionError: 策略名重复 / 为空，或某条表达式非法 (报错信息带上策略名)
+    """
+    prepared = []
+    seen = set()
+    for spec in strategies:
+        name = str(spec.get("name") or "").strip()
+        if not name:
+            raise StrategyExpressionError("策略名称不能为空")
+        if name in seen:
+            raise StrategyExpressionError(f"策略名称重复: {name}")
+        seen.add(name)
+        try:
+            buy, sell = compile_strategy(spec.get("buy_logic"), spec.get("sell_logic"), schema_columns=schema_columns)
+        except StrategyExpressionError as e:
+            raise StrategyExpressionError(f"[{name}] {e}") from e
+        risk = tuple(spec.get(k) or None for k in ("stop_loss_pct", "take_profit_pct", "max_hold_days"))
+        prepared.append({"name": name, "buy": buy, "sell": sell, "risk": risk})
+    return prepared
+
+
+def evaluate_strategies_on_stock(code, data_path, strategies, broker_kwargs, start_date=None, end_date=None,
+                                 use_signal_cache=True, use_vault_cache=True):
+    """
+    单票一次加载、多策略同场评估：
+      1. 按全部策略引用字段的并集只读一次行情 (列裁剪 + 时间窗口下推)；
+      2. 撮合用的行情序列与基准收益只抽取一次，所有策略共用；
+      3. 同一条表达式在多个策略间只求值一次 (开启信号缓存时直接读盘)；
+      4. 每个策略用独立的 Broker 跑数组内核，口径与 StrategyRunner.run + generate_report 一致。
+
+    :param strategies: prepare_strategies 的返回值
+    :return: 每个策略一行指标的列表
+    """
+    schema_columns = read_vault_columns(data_path)
+    exprs = []
+    for s in strategies:
+        for expr in (s["buy"], s["sell"]):
+            if expr is not None:
+                expr.validate(schema_columns, context=f"[{s['name']}] {code}")
+                exprs.append(expr)
+
+    df, vault_rows = load_backtest_frame(data_path, select_vault_columns(schema_columns, *exprs),
+                                         start_date=start_date, end_date=end_date, use_cache=use_vault_cache)
+    market = extract_market_arrays(df)
+    benchmark_return = calc_benchmark_return(df)
+    n_days = len(df)
+
+    signals = {}
+
+    def signal_of(expr):
+        if expr is None:
+            return [False] * n_days
+        if expr.normalized not in signals:
+            if use_signal_cache:
+                values = signal_cache.get_signal(data_path, expr)[vault_rows]
+            else:
+                values = expr.evaluate(df).to_numpy()
+            signals[expr.normalized] = values.astype(bool).tolist()
+        return signals[expr.normalized]
+
+    rows = []
+    for s in strategies:
+        arrays = dict(market, buy_signal=signal_of(s["buy"]), sell_signal=signal_of(s["sell"]))
+        metrics, _, _ = evaluate_combo(arrays, broker_kwargs, s["risk"])
+        row = {"策略": s["name"], "股票代码": code}
+        row.update({k: metrics[k] for k in MATRIX_METRICS if k in metrics})
+        row["Benchmark_Return"] = benchmark_return
+        row["Alpha"] = metrics["Total_Return"] - benchmark_return
+        rows.append(row)
+    return rows
+
+
+def _run_stock(code, data_path, strategies, broker_kwargs, start_date, end_date):
+    """进程池任务：单票失败只记为该票的错误，不拖垮整批"""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = evaluate_strategies_on_stock(code, data_path, strategies, broker_kwargs, start_date, end_date)
+        return {"code": code, "ok": True, "rows": rows}
+    except Exception as e:
+        return {"code": code, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+def iter_strategy_matrix(codes, vault_dir, strategies, broker_kwargs, start_date=None, end_date=None, max_workers=None):
+    """
+    把“多策略 x 多股票”的对比按股票分发到进程池 (每只股票在一个进程里只加载一次)，
+    按完成先后逐只产出 {"code", "ok", "rows"} 或 {"code", "ok": False, "error"}。
+
+    :param strategies: prepare_strategies 的返回值 (编译后的表达式可 pickle，子进程里按缓存重建)
+    :param broker_kwargs: {"initial_cash", "commission", "stamp_duty", "slippage"}
+    """
+    tasks = [(code, os.path.join(vault_dir, f"{code}.parquet")) for code in codes]
+    workers = min(max_workers or os.cpu_count() or 1, max(len(tasks), 1))
+
+    if workers <= 1:
+        for code, data_path in tasks:
+            yield _run_stock(code, data_path, strategies, broker_kwargs, start_date, end_date)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_run_stock, code, data_path, strategies, broker_kwargs, start_date, end_date): code
+            for code, data_path in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {"code": futures[future], "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+# ------ 后台任务 (job_queue) ------
+def strategy_matrix_job(ctx, codes, vault_dir, strategies, broker_kwargs, start_date=None, end_date=None):
+    """
+    策略全景阅兵场的多策略对比任务 (一块股票)。页面用 batch_runner.split_batch 切块、每块一个后台任务，
+    块内逐只执行，每只股票之后回报进度并检查取消。
+    :return: {"rows": 全部 (策略, 股票) 指标行, "errors": [(代码, 错误)]}
+    """
+    rows, errors = [], []
+    for i, res in enumerate(iter_strategy_matrix(codes, vault_dir, strategies, broker_kwargs,
+                                                 start_date=start_date, end_date=end_date, max_workers=1)):
+        if res["ok"]:
+            rows.extend(res["rows"])
+        else:
+            errors.append((res["code"], res["error"]))
+        ctx.checkpoint(i + 1, len(codes), f"{res['code']} 的 {len(strategies)} 个策略推演完毕")
+    return {"rows": rows, "errors": errors}
+
+
+def pivot_matrix(long_df, metric, strategy_order=None):
+    """长表 -> 策略 x 股票的对比矩阵 (行为策略，列为股票代码)"""
+    matrix = long_df.pivot(index="策略", columns="股票代码", values=metric)
+    if strategy_order is not None:
+        matrix = matrix.reindex([s for s in strategy_order if s in matrix.index])
+    return matrix.sort_index(axis=1)
+
+
+def summarize_strategies(long_df):
+    """每个策略跨股票的汇总：平均收益 / 平均 Alpha / 跑赢基准的股票占比 / 平均胜率 / 平均与最深回撤"""
+    g = long_df.groupby("策略", sort=False)
+    summary = pd.DataFrame({
+        "股票数": g.size(),
+        "平均收益": g["Total_Return"].mean(),
+        "平均 Alpha": g["Alpha"].mean(),
+        "跑赢基准占比": g["Alpha"].apply(lambda a: (a > 0).mean()),
+        "平均胜率": g["Win_Rate"].mean(),
+        "平均回撤": g["Max_Drawdown"].mean(),
+        "最深回撤": g["Max_Drawdown"].min(),
+        "交易对数": g["Total_Trades_Pairs"].sum()
+    })
+    return summary.sort_values("平均 Alpha", ascending=False).reset_index()
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    vault_dir = "backtest_data/final_vault"
+    if os.path.exists(vault_dir):
+        import time
+        codes = sorted(f.replace(".parquet", "") for f in os.listdir(vault_dir) if f.endswith(".parquet"))
+        strategies = prepare_strategies([
+            {"name": f"MA{w} 趋势", "buy_logic": f"Close_Qfq > MA_{w} and MACD_Hist > 0",
+             "sell_logic": "Close_Qfq < MA_10", "stop_loss_pct": 0.08, "max_hold_days": 20}
+            for w in (5, 10, 20, 60, 120)
+        ] + [
+            {"name": f"RSI<{t} 抄底", "buy_logic": f"RSI_14 < {t}", "sell_logic": "RSI_14 > 60", "take_profit_pct": 0.1}
+            for t in (25, 30, 35, 40, 45)
+        ])
+        broker_kwargs = {"initial_cash": 200000, "commission": 0.00025, "stamp_duty": 0.0005, "slippage": 0.001}
+        t0 = time.perf_counter()
+        rows = [r for res in iter_strategy_matrix(codes, vault_dir, strategies, broker_kwargs) if res["ok"] for r in res["rows"]]
+        long_df = pd.DataFrame(rows)
+        print(f"{len(strategies)} 个策略 x {len(codes)} 只股票，耗时 {time.perf_counter() - t0:.2f}s")
+        print(pivot_matrix(long_df, "Alpha", [s["name"] for s in strategies]).round(3).to_string())
+        print(summarize_strategies(long_df).to_string())
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
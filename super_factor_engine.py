@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 import ta
 import warnings
+from vault_io import write_vault
 warnings.filterwarnings('ignore')
 
 VAULT_DIR = "backtest_data/vault"
@@ -143,7 +144,7 @@ def process_all_vaults():
         super_df = calculate_super_features(df)
         
         # 3. 存储为强化的表
-        super_df.to_parquet(super_path, engine="pyarrow", index=False)
+        write_vault(super_df, super_path)
         print(f"  [OK] {f} 指标注入完成！当前列数：{len(super_df.columns)}")
 
 if __name__ == "__main__":
@@ -152,3 +152,31 @@ def render_sidebar():
             
         st.sidebar.markdown("---")
         st.sidebar.caption("💡 Powered by DeepSeek AI")
+
+def render_job_panel(job_ids, running_text, key):
+    """
+    后台任务 (job_queue) 的轮询面板：排队提示或进度条，外加取消按钮。
+    :param job_ids: 单个任务 ID，或拆块提交的一组任务 ID (按 group_status 汇总进度)
+    :param running_text: 进度条前的说明文字，后面接上任务自己回报的进度文本
+    :param key: 取消按钮的控件 key (同一页面有多个后台任务时用来区分)
+    :return: 任务仍在排队 / 运行时返回 None；结束后返回最终状态，由调用方取结果并 forget
+    """
+    from job_queue import JOB_QUEUE
+    single = isinstance(job_ids, str)
+    ids = [job_ids] if single else list(job_ids)
+    job = JOB_QUEUE.status(job_ids) if single else JOB_QUEUE.group_status(ids)
+    if job["state"] not in ("queued", "running"):
+        return job
+
+    col_j1, col_j2 = st.columns([4, 1])
+    if job["state"] == "queued":
+        col_j1.info(f"⏳ {running_text}排队中 (服务器同时最多运行 {JOB_QUEUE.max_workers} 个任务)...")
+    else:
+        text = f"{running_text}: {job['text']}"
+        if not single:
+            text += f" · {job['running']} 块并行 · 总进度 {job['done']}/{job['total']}"
+        col_j1.progress(min(job["done"] / job["total"], 1.0) if job["total"] else 0.0, text=text)
+    if col_j2.button("⛔ 取消任务", use_container_width=True, key=key):
+        for job_id in ids:
+            JOB_QUEUE.cancel(job_id)
+    return None
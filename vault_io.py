@@ -0,0 +1,229 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Vault 写盘时每个 row group 的行数 (约一年的交易日)。
+# 按年切块后，带时间窗口的读取可以凭 row group 的 Date 统计信息整块跳过，不解码窗口外的历史。
+VAULT_ROW_GROUP_SIZE = 250
+# 文件元数据里记录各 row group 内容哈希的键 (断点续跑只读文件尾就能判断哪几段历史被改写过)
+VAULT_DIGEST_KEY = b"vault_row_group_digests"
+
+# 进程级 Vault 内存缓存的容量上限 (字节)，可用环境变量 VAULT_CACHE_MAX_BYTES 覆盖
+VAULT_CACHE_MAX_BYTES = int(os.getenv("VAULT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def write_vault(df, path):
+    """
+    Vault 统一写盘入口：按 VAULT_ROW_GROUP_SIZE 切 row group，保证日后可以按日期裁剪读取；
+    同时把每个 row group 的内容哈希写进文件元数据 (见 read_row_group_digests)。
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    digests = [hashlib.sha1(row_hashes[i:i + VAULT_ROW_GROUP_SIZE].tobytes()).hexdigest()
+               for i in range(0, len(df), VAULT_ROW_GROUP_SIZE)]
+    metadata = dict(table.schema.metadata or {})
+    metadata[VAULT_DIGEST_KEY] = json.dumps(digests).encode("utf-8")
+    pq.write_table(table.replace_schema_metadata(metadata), path, row_group_size=VAULT_ROW_GROUP_SIZE)
+
+
+def read_row_group_digests(meta):
+    """
+    取 write_vault 记录的各 row group 内容哈希。
+    :param meta: pyarrow 的 FileMetaData (只读文件尾，不解码数据)
+    :return: 哈希列表；旧版写出的文件或块划分对不上时返回 None
+    """
+    raw = (meta.metadata or {}).get(VAULT_DIGEST_KEY)
+    if raw is None:
+        return None
+    digests = json.loads(raw)
+    return digests if len(digests) == meta.num_row_groups else None
+
+
+def resolve_date_window(start_date=None, end_date=None):
+    """
+    把回测的起止日期换算成闭区间 [lower, upper]。
+    upper 同时包含“不读未来占位日期”的截断 (不晚于今天)，end_date 当天全天有效。
+    """
+    upper = pd.Timestamp.today()
+    if end_date:
+        upper = min(upper, pd.to_datetime(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))
+    lower = pd.to_datetime(start_date) if start_date else None
+    return lower, upper
+
+
+def _overlapping_row_groups(meta, date_idx, lower, upper):
+    """凭每个 row group 的 Date 列 min/max 统计挑出与时间窗口有交集的块，缺统计信息的块一律保留"""
+    keep = []
+    for i in range(meta.num_row_groups):
+        stats = meta.row_group(i).column(date_idx).statistics
+        if stats is not None and stats.has_min_max:
+            if pd.Timestamp(stats.min) > upper or (lower is not None and pd.Timestamp(stats.max) < lower):
+                continue
+        keep.append(i)
+    return keep
+
+
+def read_vault(data_path, columns=None, start_date=None, end_date=None):
+    """
+    按时间窗口读取 Vault：时间过滤下推到 Parquet 读取层。
+      1. 用 row group 统计信息整块跳过窗口外的历史，不解码；
+      2. 在 Arrow 表上按 Date 精确过滤；
+      3. 最后只转换一次成 DataFrame (整个过程只有这一份 pandas 物化)。
+
+    :param columns: 需要的列 (会自动带上 Date)，为空读全部列
+    :return: DataFrame，行索引为该行在 Parquet 文件中的原始行号 (供信号缓存按行号切片)
+    """
+    pf = pq.ParquetFile(data_path)
+    meta = pf.metadata
+    names = pf.schema_arrow.names
+    if columns is not None and 'Date' not in columns:
+        columns = ['Date'] + list(columns)
+
+    lower, upper = resolve_date_window(start_date, end_date)
+    date_idx = names.index('Date')
+    groups = _overlapping_row_groups(meta, date_idx, lower, upper)
+
+    # 各 row group 在整个文件里的起始行号
+    offsets = np.concatenate([[0], np.cumsum([meta.row_group(i).num_rows for i in range(meta.num_row_groups)])])
+    if groups:
+        table = pf.read_row_groups(groups, columns=columns)
+        base_rows = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in groups])
+    else:
+        table = pf.schema_arrow.empty_table()
+        if columns is not None:
+            table = table.select(columns)
+        base_rows = np.zeros(0, dtype=np.int64)
+
+    dates = pd.to_datetime(table.column('Date').to_numpy())
+    mask = np.asarray(dates <= upper)
+    if lower is not None:
+        mask &= np.asarray(dates >= lower)
+
+    df = table.filter(mask).to_pandas()
+    df.index = pd.Index(base_rows[mask])
+    if not pd.api.types.is_datetime64_any_dtype(df['Date']):
+        df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def _freeze(values):
+    """把缓存里的列数组设为只读，任何页面都无法原地改写共享数据"""
+    if isinstance(values, np.ndarray):
+        values.flags.writeable = False
+    return values
+
+
+class VaultCache:
+    """
+    进程级的 Vault 内存缓存 (Streamlit 所有会话共享同一份)。
+    - 以文件为单位缓存整段历史，列按需增量加载，不同策略共用撮合用的公共列；
+    - 总内存超过 max_bytes 时按最近最少使用 (LRU) 淘汰整个文件；
+    - 每次访问都核对文件的修改时间与大小，Vault 重建后旧条目自动作废；
+    - 交出去的 DataFrame 直接引用缓存里的只读数组 (不复制)，写入会报错或触发写时复制，缓存本身永远不会被改坏。
+    """
+    def __init__(self, max_bytes=VAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # 真实路径 -> {"stamp", "columns": {列名: 数组}, "nbytes"}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load_columns(self, data_path, entry, columns):
+        """把缺失的列从磁盘读进条目 (只读需要的列)"""
+        missing = [c for c in columns if c not in entry["columns"]]
+        if not missing:
+            self.hits += 1
+            return
+        self.misses += 1
+        df = pd.read_parquet(data_path, columns=missing)
+        for col in missing:
+            series = df[col]
+            if col == 'Date' and not pd.api.types.is_datetime64_any_dtype(series):
+                series = pd.to_datetime(series)
+            entry["columns"][col] = _freeze(series.to_numpy() if isinstance(series.dtype, np.dtype) else series.array)
+            entry["nbytes"] += int(series.memory_usage(index=False, deep=True))
+
+    def _evict(self, keep_key):
+        total = sum(e["nbytes"] for e in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, entry = next(iter(self._entries.items()))
+            if key == keep_key:
+                break
+            del self._entries[key]
+            total -= entry["nbytes"]
+
+    def get_columns(self, data_path, columns=None):
+        """
+        取某个 Vault 文件整段历史的若干列。
+        :return: {列名: 只读数组}
+        """
+        real_path = os.path.realpath(data_path)
+        st = os.stat(real_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if columns is None:
+            columns = pq.read_schema(real_path).names
+
+        with self._lock:
+            entry = self._entries.get(real_path)
+            if entry is None or entry["stamp"] != stamp:
+                entry = {"stamp": stamp, "columns": {}, "nbytes": 0}
+                self._entries[real_path] = entry
+            self._load_columns(real_path, entry, columns)
+            self._entries.move_to_end(real_path)
+            self._evict(real_path)
+            return {c: entry["columns"][c] for c in columns}
+
+    def read(self, data_path, columns=None, start_date=None, end_date=None):
+        """
+        与 read_vault 同口径的窗口读取 (行索引为 Parquet 原始行号)，数据来自内存缓存。
+        Vault 按日期升序存放时窗口是一段连续切片，返回的各列都是缓存数组的零拷贝视图。
+        """
+        if columns is not None and 'Date' not in columns:
+            columns = ['Date'] + list(columns)
+        arrays = self.get_columns(data_path, columns)
+
+        dates = pd.DatetimeIndex(arrays['Date'])
+        lower, upper = resolve_date_window(start_date, end_date)
+        if dates.is_monotonic_increasing:
+            lo = dates.searchsorted(lower, side="left") if lower is not None else 0
+            hi = dates.searchsorted(upper, side="right")
+            rows = np.arange(lo, max(hi, lo))
+            picked = {c: v[lo:max(hi, lo)] for c, v in arrays.items()}
+        else:
+            mask = np.asarray(dates <= upper)
+            if lower is not None:
+                mask &= np.asarray(dates >= lower)
+            rows = np.flatnonzero(mask)
+            picked = {c: v[mask] for c, v in arrays.items()}
+        return pd.DataFrame(picked, index=pd.Index(rows), copy=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": sum(e["nbytes"] for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# 全进程共享的唯一实例
+VAULT_CACHE = VaultCache()
+
+
+def load_vault(data_path, columns=None, start_date=None, end_date=None, use_cache=True):
+    """回测引擎的统一读取入口：默认走进程级内存缓存，use_cache=False 时直接按窗口下推读盘"""
+    if use_cache:
+        return VAULT_CACHE.read(data_path, columns=columns, start_date=start_date, end_date=end_date)
+    return read_vault(data_path, columns=columns, start_date=start_date, end_date=end_date)
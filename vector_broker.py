@@ -0,0 +1,363 @@
+import numpy as np
+import pandas as pd
+from ashare_broker import AShareBroker, TradeLog
+
+
+def _per_account(value, n_accounts, dtype=float):
+    """标量或长度为 N 的序列 -> 长度为 N 的数组 (每个账户一份)"""
+    arr = np.asarray(value, dtype=dtype)
+    if arr.ndim == 0:
+        return np.full(n_accounts, arr.item(), dtype=dtype)
+    if arr.shape != (n_accounts,):
+        raise ValueError(f"参数长度 {arr.shape} 与账户数 {n_accounts} 不一致")
+    return arr.copy()
+
+
+def risk_line(values, n_accounts):
+    """
+    风控参数 -> 长度为 N 的 float 数组，None / NaN 表示该账户不启用 (统一为 NaN，任何比较都为 False)。
+    :param values: 标量、None，或每个账户一个值的序列
+    """
+    if values is None:
+        return np.full(n_accounts, np.nan)
+    if np.ndim(values) == 0:
+        values = [values] * n_accounts
+    return _per_account([np.nan if v is None else v for v in values], n_accounts)
+
+
+class VectorBroker:
+    """
+    N 个相互独立的 AShareBroker 账户，状态全部按账户存成数组，一次撮合整批账户。
+    规则与 AShareBroker 逐位一致 (100 股整手、最低 5 元佣金、印花税、滑点、T+1、涨跌停封板)，
+    只是每个账户的判断与记账都换成了对整批数组的一次运算，多一个账户几乎不增加耗时。
+    典型用法是同一只股票、同一份行情上的大量风控参数组合 (见 run_vector_kernel)。
+
+    与单票 Broker 的区别：
+      - 持仓成本 cost_price 与持仓天数 holding_days 也作为账户状态保存在这里 (单票时由 Runner 保管)；
+      - 行情对所有账户相同，所以 last_close 是一个标量；
+      - 成交流水按日成块记录 (带账户号)，需要时用 trade_frame() / trade_log(k) 取出。
+    """
+    LOT_SIZE = AShareBroker.LOT_SIZE
+    MIN_COMMISSION = AShareBroker.MIN_COMMISSION
+    LIMIT_UP_TOLERANCE = AShareBroker.LIMIT_UP_TOLERANCE
+    LIMIT_DOWN_TOLERANCE = AShareBroker.LIMIT_DOWN_TOLERANCE
+
+    def __init__(self, n_accounts, initial_cash=200000.0, commission=0.00025, stamp_duty=0.0005, slippage=0.001):
+        """各费率参数可以是标量 (所有账户相同)，也可以是长度为 n_accounts 的序列"""
+        self.n_accounts = n_accounts
+        self.initial_cash = _per_account(initial_cash, n_accounts)
+        self.cash = self.initial_cash.copy()
+        self.total_shares = np.zeros(n_accounts, dtype=np.int64)
+        self.available_shares = np.zeros(n_accounts, dtype=np.int64)
+        self.cost_price = np.zeros(n_accounts)
+        self.holding_days = np.zeros(n_accounts, dtype=np.int64)
+
+        self.commission_rate = _per_account(commission, n_accounts)
+        self.stamp_duty_rate = _per_account(stamp_duty, n_accounts)
+        self.slippage = _per_account(slippage, n_accounts)
+
+        self.last_close = None
+        self.order_stats = {key: np.zeros(n_accounts, dtype=np.int64)
+                            for key in ("buy_attempted", "buy_rejected", "sell_attempted", "sell_rejected")}
+        self._trade_chunks = []   # 每次有成交的撮合追加一块 (账户号, 日期, 类型码, 价格, 股数, 金额, 佣金, 印花税, 余额)
+
+    def daily_update_t1_lock(self):
+        """跨日解锁：所有账户昨日买入的份额今日可卖"""
+        self.available_shares[:] = self.total_shares
+
+    def record_last_price(self, price):
+        if not pd.isna(price):
+            self.last_close = price
+
+    def evaluate_portfolio(self, current_price):
+        """全部账户的净值 (停牌时沿用最后有效价)"""
+        if pd.isna(current_price):
+            current_price = self.last_close if self.last_close is not None else 0
+        return self.cash + self.total_shares * current_price
+
+    def _calc_commission(self, trade_amount, accounts):
+        """A 股佣金 (最低 5 元)，accounts 为 trade_amount 各元素对应的账户号"""
+        return np.maximum(trade_amount * self.commission_rate[accounts], self.MIN_COMMISSION)
+
+    def _log(self, date, trade_type, accounts, price, shares, amount, comm, stamp):
+        self._trade_chunks.append((accounts, np.datetime64(pd.Timestamp(date), "ns"), TradeLog._TYPE_CODES[trade_type],
+                                   price, shares, amount, comm, stamp, self.cash[accounts]))
+
+    def submit_buy_orders(self, date, accounts, trigger_price, limit_up_price, current_high, is_open_auction=False):
+        """
+        对 accounts (账户号数组) 同时提交全仓买入，口径同 AShareBroker._execute_buy_order。
+        :return: 成交的账户号数组
+        """
+        if len(accounts) == 0:
+            return accounts
+        self.order_stats["buy_attempted"][accounts] += 1
+
+        # 涨停封板对同一天的所有账户相同，直接整批作废
+        limit_line = limit_up_price * self.LIMIT_UP_TOLERANCE
+        if trigger_price >= limit_line or (not is_open_auction and current_high >= limit_line):
+            self.order_stats["buy_rejected"][accounts] += 1
+            return accounts[:0]
+
+        cash = self.cash[accounts]
+        execution_price = trigger_price * (1 + self.slippage[accounts])
+        shares = np.floor(cash / execution_price / self.LOT_SIZE) * self.LOT_SIZE
+        trade_amount = shares * execution_price
+        comm = self._calc_commission(trade_amount, accounts)
+        stamp = trade_amount * self.stamp_duty_rate[accounts]
+        total_cost = trade_amount + comm + stamp
+
+        # 加上手续费与印花税后超支的账户退一手重算
+        over = cash < total_cost
+        if over.any():
+            shares[over] -= self.LOT_SIZE
+            trade_amount[over] = shares[over] * execution_price[over]
+            comm[over] = self._calc_commission(trade_amount[over], accounts[over])
+            stamp[over] = trade_amount[over] * self.stamp_duty_rate[accounts][over]
+            total_cost[over] = trade_amount[over] + comm[over] + stamp[over]
+
+        ok = (cash > 0) & (shares >= self.LOT_SIZE)
+        self.order_stats["buy_rejected"][accounts[~ok]] += 1
+        if not ok.any():
+            return accounts[:0]
+        filled = accounts[ok]
+        self.cash[filled] -= total_cost[ok]
+        self.total_shares[filled] += shares[ok].astype(np.int64)
+        self._log(date, "BUY", filled, execution_price[ok], shares[ok].astype(np.int64),
+                  trade_amount[ok], comm[ok], stamp[ok])
+        return filled
+
+    def submit_sell_orders(self, date, accounts, trigger_price, limit_down_price, current_low, is_open_auction=False):
+        """
+        对 accounts 同时提交清仓卖出，口径同 AShareBroker._execute_sell_order。
+        :return: 成交的账户号数组
+        """
+        if len(accounts) == 0:
+            return accounts
+        self.order_stats["sell_attempted"][accounts] += 1
+
+        limit_line = limit_down_price * self.LIMIT_DOWN_TOLERANCE
+        if trigger_price <= limit_line or (not is_open_auction and current_low <= limit_line):
+            self.order_stats["sell_rejected"][accounts] += 1
+            return accounts[:0]
+
+        ok = self.available_shares[accounts] > 0
+        self.order_stats["sell_rejected"][accounts[~ok]] += 1
+        filled = accounts[ok]
+        if len(filled) == 0:
+            return filled
+
+        execution_price = trigger_price * (1 - self.slippage[filled])
+        shares = self.available_shares[filled]
+        trade_amount = shares * execution_price
+        comm = self._calc_commission(trade_amount, filled)
+        stamp = trade_amount * self.stamp_duty_rate[filled]
+        self.cash[filled] += trade_amount - comm - stamp
+        self.total_shares[filled] -= shares
+        self.available_shares[filled] -= shares
+        self._log(date, "SELL", filled, execution_price, shares, trade_amount, comm, stamp)
+        return filled
+
+    # ------ 成交流水 ------
+    def _trade_columns(self):
+        if not self._trade_chunks:
+            return None
+        lengths = [len(chunk[0]) for chunk in self._trade_chunks]
+        columns = {
+            "Account": np.concatenate([chunk[0] for chunk in self._trade_chunks]),
+            "Date": np.repeat(np.array([chunk[1] for chunk in self._trade_chunks]), lengths),
+            "_type": np.repeat(np.array([chunk[2] for chunk in self._trade_chunks], dtype=np.int8), lengths),
+        }
+        for k, name in enumerate(("Price", "Shares", "Amount", "Commission", "Stamp_Duty", "Cash_Left")):
+            columns[name] = np.concatenate([chunk[3 + k] for chunk in self._trade_chunks])
+        # 按账户稳定排序，同一账户内保持成交先后
+        order = np.argsort(columns["Account"], kind="stable")
+        return {name: values[order] for name, values in columns.items()}
+
+    def trade_counts(self):
+        """每个账户的成交笔数"""
+        counts = np.zeros(self.n_accounts, dtype=np.int64)
+        for chunk in self._trade_chunks:
+            counts[chunk[0]] += 1
+        return counts
+
+    def trade_frame(self):
+        """全部账户的成交流水 (Account 列 + TradeLog.to_frame() 的各列)，按账户、时间排序"""
+        columns = self._trade_columns()
+        if columns is None:
+            return pd.DataFrame(columns=["Account"] + TradeLog.COLUMNS)
+        columns["Type"] = np.array(TradeLog.TYPE_NAMES, dtype=object)[columns.pop("_type")]
+        return pd.DataFrame(columns)[["Account"] + TradeLog.COLUMNS]
+
+    def trade_log(self, account):
+        """单个账户的成交流水 (TradeLog，与单票 Broker 的 trades 同结构)"""
+        frame = self.trade_frame()
+        return TradeLog.from_frame(frame[frame["Account"] == account].reset_index(drop=True))
+
+    def round_trip_stats(self):
+        """
+        每个账户的配对交易数与盈利笔数 (口径同 calc_core_metrics：第 k 笔买与第 k 笔卖配对，卖价 > 买价记为盈利)。
+        :return: (配对数数组, 盈利笔数数组)
+        """
+        pairs = np.zeros(self.n_accounts, dtype=np.int64)
+        wins = np.zeros(self.n_accounts, dtype=np.int64)
+        columns = self._trade_columns()
+        if columns is None:
+            return pairs, wins
+        account, types, price = columns["Account"], columns["_type"], columns["Price"]
+        is_buy, is_sell = types == 0, types == 1
+        n_buy = np.bincount(account[is_buy], minlength=self.n_accounts)
+        n_sell = np.bincount(account[is_sell], minlength=self.n_accounts)
+        pairs = np.minimum(n_buy, n_sell)
+
+        # 账户内的买 / 卖序号：各自在账户内的第几笔
+        def rank_within(mask, counts):
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            return np.arange(mask.sum()) - np.repeat(starts, counts)
+
+        buy_rank, sell_rank = rank_within(is_buy, n_buy), rank_within(is_sell, n_sell)
+        buy_start = np.concatenate([[0], np.cumsum(n_buy)[:-1]])
+        sell_account = account[is_sell]
+        paired = sell_rank < pairs[sell_account]
+        buy_price = price[is_buy][buy_start[sell_account[paired]] + sell_rank[paired]]
+        won = price[is_sell][paired] > buy_price
+        wins = np.bincount(sell_account[paired][won], minlength=self.n_accounts)
+        return pairs, wins
+
+    def account(self, k):
+        """把第 k 个账户还原成一个普通的 AShareBroker (可接着单独撮合或做断点)"""
+        broker = AShareBroker(float(self.initial_cash[k]), float(self.commission_rate[k]),
+                              float(self.stamp_duty_rate[k]), float(self.slippage[k]))
+        broker.cash = float(self.cash[k])
+        broker.total_shares = int(self.total_shares[k])
+        broker.available_shares = int(self.available_shares[k])
+        broker.last_close = self.last_close
+        broker.trades = self.trade_log(k)
+        for key, counts in self.order_stats.items():
+            broker.order_stats[key] = int(counts[k])
+        return broker
+
+
+def run_vector_kernel(arrays, broker, stop_loss_pct=None, take_profit_pct=None, max_hold_days=None):
+    """
+    N 账户版的数组内核：与 strategy_runner.run_array_kernel 的逐日状态机完全同构
+    (T+1 解锁 -> 净值清点 -> 止损/止盈/最长持仓/策略卖点 -> 涨跌停撮合)，
+    每天对全部账户做一次数组运算，N 组参数的耗时与 1 组相差无几。
+
+    :param arrays: extract_kernel_arrays 的结果；buy_signal / sell_signal 也可以是 (交易日数, N) 的矩阵 (每个账户一套信号)
+    :param broker: VectorBroker
+    :param stop_loss_pct / take_profit_pct / max_hold_days: 标量、None，或每个账户一个值的序列 (None 表示不启用)
+    :return: (每日净值, 每日现金)，均为 (N, 交易日数) 的矩阵，每行是一个账户的曲线
+    """
+    n = broker.n_accounts
+    dates = arrays["dates"]
+    is_trading = arrays["is_trading"]
+    closes = arrays["close"]
+    highs = arrays["high"]
+    lows = arrays["low"]
+    limit_ups = arrays["limit_up"]
+    limit_downs = arrays["limit_down"]
+    buy_signal = np.asarray(arrays["buy_signal"], dtype=bool)
+    sell_signal = np.asarray(arrays["sell_signal"], dtype=bool)
+    per_account_buy = buy_signal.ndim == 2
+    per_account_sell = sell_signal.ndim == 2
+
+    stop_line = -np.abs(risk_line(stop_loss_pct, n))
+    profit_line = np.abs(risk_line(take_profit_pct, n))
+    hold_limit = risk_line(max_hold_days, n)
+    use_stop = not np.isnan(stop_line).all()
+    use_profit = not np.isnan(profit_line).all()
+    use_hold = not np.isnan(hold_limit).all()
+
+    n_days = len(closes)
+    equity_arr = np.empty((n, n_days), dtype=float)
+    cash_arr = np.empty((n, n_days), dtype=float)
+    all_accounts = np.arange(n)
+
+    for i in range(n_days):
+        trading = is_trading[i]
+        close = closes[i]
+        close_missing = close != close
+
+        if trading and not close_missing:
+            broker.last_close = close
+        broker.daily_update_t1_lock()
+
+        if not trading or close_missing:
+            # 不做决策的日子只清点净值 (停牌日沿用最后有效价)
+            if close_missing:
+                mark = broker.last_close if broker.last_close is not None else 0
+            else:
+                mark = close
+            equity_arr[:, i] = broker.cash + broker.total_shares * mark
+            cash_arr[:, i] = broker.cash
+            continue
+
+        holding = broker.total_shares > 0
+        if holding.any():
+            holders = all_accounts[holding]
+            broker.holding_days[holders] += 1
+            cost = broker.cost_price[holders]
+            current_return_pct = (close - cost) / cost
+            triggered = sell_signal[i, holders] if per_account_sell else np.full(len(holders), sell_signal[i])
+            if use_stop:
+                triggered = triggered | (current_return_pct <= stop_line[holders])
+            if use_profit:
+                triggered = triggered | (current_return_pct >= profit_line[holders])
+            if use_hold:
+                triggered = triggered | (broker.holding_days[holders] >= hold_limit[holders])
+            if triggered.any():
+                sold = broker.submit_sell_orders(pd.Timestamp(dates[i]), holders[triggered],
+                                                 trigger_price=close, limit_down_price=limit_downs[i], current_low=lows[i])
+                if len(sold):
+                    broker.holding_days[sold] = 0
+                    broker.cost_price[sold] = 0.0
+
+        flat = ~holding
+        wants_buy = flat & buy_signal[i] if per_account_buy else (flat if buy_signal[i] else None)
+        if wants_buy is not None and wants_buy.any():
+            bought = broker.submit_buy_orders(pd.Timestamp(dates[i]), all_accounts[wants_buy],
+                                              trigger_price=close, limit_up_price=limit_ups[i], current_high=highs[i])
+            if len(bought):
+                broker.cost_price[bought] = close * (1 + broker.slippage[bought])
+                broker.holding_days[bought] = 1
+
+        # 当日净值按收盘价清点 (与单票内核成交后重算的结果相同)
+        equity_arr[:, i] = broker.cash + broker.total_shares * close
+        cash_arr[:, i] = broker.cash
+
+    return equity_arr, cash_arr
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    import os
+    import io
+    import time
+    import itertools
+    import contextlib
+    from strategy_runner import StrategyRunner, extract_kernel_arrays, run_array_kernel
+
+    test_file = "backtest_data/final_vault/600519.parquet"
+    if os.path.exists(test_file):
+        runner = StrategyRunner(test_file, buy_logic="Close_Qfq > MA_20 and MACD_Hist > 0", sell_logic="Close_Qfq < MA_10")
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner.pre_calculate_signals()
+        arrays = extract_kernel_arrays(runner.df)
+        combos = list(itertools.product([None, 0.03, 0.05, 0.08, 0.1, 0.15], [None, 0.1, 0.2, 0.3, 0.5], [None, 5, 10, 20, 40, 60]))
+        sl, tp, md = zip(*combos)
+
+        t0 = time.perf_counter()
+        vb = VectorBroker(len(combos))
+        equity, cash = run_vector_kernel(arrays, vb, sl, tp, md)
+        t_vec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        mismatches = 0
+        for k, combo in enumerate(combos):
+            broker = AShareBroker()
+            eq, _, _, _ = run_array_kernel(arrays, broker, *combo)
+            mismatches += not (np.array_equal(eq, equity[k]) and broker.trades == vb.trade_log(k))
+        t_loop = time.perf_counter() - t0
+        print(f"{len(combos)} 组参数：向量内核 {t_vec:.2f}s，逐组数组内核 {t_loop:.2f}s，不一致 {mismatches} 组")
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")
@@ -0,0 +1,228 @@
+import os
+import io
+import itertools
+import contextlib
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from strategy_runner import StrategyRunner, extract_kernel_arrays, calc_core_metrics
+from param_sweep import evaluate_combo, evaluate_combos
+
+# 子进程内的只读共享上下文 (整段行情数组 + 参数网格)，由 initializer 一次性注入
+_WORKER_CONTEXT = {}
+
+
+def slice_kernel_arrays(arrays, lo, hi):
+    """按行号区间 [lo, hi) 截取数组内核的行情切片 (不复制底层大表)"""
+    return {key: values[lo:hi] for key, values in arrays.items()}
+
+
+def build_walk_forward_windows(dates, train_months=36, test_months=6):
+    """
+    在交易日历上切出滚动的 (训练窗, 测试窗)。
+    每个测试窗紧跟在训练窗之后，整体按测试窗长度向前滚动，测试窗首尾相接、互不重叠。
+    :return: [(train_lo, train_hi, test_lo, test_hi), ...] 行号均为左闭右开
+    """
+    dates = pd.DatetimeIndex(dates)
+    windows = []
+    if len(dates) == 0:
+        return windows
+
+    train_start = dates[0]
+    while True:
+        train_end = train_start + pd.DateOffset(months=train_months)
+        test_end = train_end + pd.DateOffset(months=test_months)
+        train_lo = dates.searchsorted(train_start)
+        train_hi = dates.searchsorted(train_end)
+        test_hi = dates.searchsorted(test_end)
+        if train_hi >= len(dates):
+            break
+        if train_hi > train_lo:
+            windows.append((int(train_lo), int(train_hi), int(train_hi), int(test_hi)))
+        train_start = train_start + pd.DateOffset(months=test_months)
+    return windows
+
+
+def _init_worker(arrays, broker_kwargs, combos, rank_by):
+    _WORKER_CONTEXT["arrays"] = arrays
+    _WORKER_CONTEXT["broker_kwargs"] = broker_kwargs
+    _WORKER_CONTEXT["combos"] = combos
+    _WORKER_CONTEXT["rank_by"] = rank_by
+
+
+def _run_window(window):
+    """单个滚动窗口：训练窗内网格寻优，挑出最优参数后在测试窗里样本外实跑"""
+    train_lo, train_hi, test_lo, test_hi = window
+    arrays = _WORKER_CONTEXT["arrays"]
+    broker_kwargs = _WORKER_CONTEXT["broker_kwargs"]
+    rank_by = _WORKER_CONTEXT["rank_by"]
+
+    # 训练窗内的整张参数网格在向量内核里一遍跑完
+    train_arrays = slice_kernel_arrays(arrays, train_lo, train_hi)
+    train_rows, _, _ = evaluate_combos(train_arrays, broker_kwargs, _WORKER_CONTEXT["combos"])
+    best_row, best_combo = None, None
+    for combo, row in zip(_WORKER_CONTEXT["combos"], train_rows):
+        if best_row is None or row[rank_by] > best_row[rank_by]:
+            best_row, best_combo = row, combo
+
+    test_arrays = slice_kernel_arrays(arrays, test_lo, test_hi)
+    test_row, test_equity, test_broker = evaluate_combo(test_arrays, broker_kwargs, best_combo)
+    return {
+        "window": window,
+        "combo": best_combo,
+        "train_score": best_row[rank_by],
+        "test_row": test_row,
+        "test_equity": test_equity,
+        "test_trades": test_broker.trades
+    }
+
+
+def run_walk_forward(data_path, buy_logic, sell_logic,
+                     stop_loss_list=(None,), take_profit_list=(None,), max_hold_list=(None,),
+                     train_months=36, test_months=6,
+                     initial_cash=200000, commission=0.00025, stamp_duty=0.0005, slippage=0.001,
+                     start_date=None, end_date=None, rank_by="Sharpe_Ratio", max_workers=None, progress=None):
+    """
+    滚动前推 (Walk-Forward) 优化。
+    行情只读一次、信号只 eval 一次 (表达式是逐行计算的，整段算好后按窗口切片与逐窗重算等价)，
+    各窗口在多进程中并行：训练窗内按 rank_by 选出最优风控参数，直接套用到紧随其后的测试窗。
+    各测试窗都以初始资金空仓起步，样本外净值按收益率首尾复利拼接成一条曲线。
+
+    :param train_months: 训练窗长度 (自然月)
+    :param test_months: 测试窗长度 (自然月)，同时也是窗口滚动步长
+    :param max_workers: 进程数，默认使用全部 CPU 核心；为 1 时在当前进程里逐窗执行
+    :param progress: 可选的回调 progress(done, total, text)，逐窗执行时每完成一个窗口调用一次 (后台任务里用来回报进度并检查取消)
+    :return: {"windows": 每窗选参与样本外表现, "equity_df": 拼接后的样本外净值, "report": 样本外核心指标}
+    """
+    runner = StrategyRunner(
+        data_path=data_path,
+        initial_cash=initial_cash,
+        commission=commission,
+        stamp_duty=stamp_duty,
+        slippage=slippage,
+        buy_logic=buy_logic,
+        sell_logic=sell_logic,
+        start_date=start_date,
+        end_date=end_date
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner.pre_calculate_signals()
+    arrays = extract_kernel_arrays(runner.df)
+    dates = pd.DatetimeIndex(runner.df['Date'])
+
+    broker_kwargs = {
+        "initial_cash": initial_cash,
+        "commission": commission,
+        "stamp_duty": stamp_duty,
+        "slippage": slippage,
+    }
+    combos = list(itertools.product(stop_loss_list, take_profit_list, max_hold_list))
+    windows = build_walk_forward_windows(dates, train_months, test_months)
+    if not windows:
+        raise ValueError("回测区间太短，连一个完整的训练窗都切不出来")
+
+    workers = min(max_workers or os.cpu_count() or 1, len(windows))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(arrays, broker_kwargs, combos, rank_by)) as pool:
+            outputs = list(pool.map(_run_window, windows))
+    else:
+        _init_worker(arrays, broker_kwargs, combos, rank_by)
+        outputs = []
+        for window in windows:
+            outputs.append(_run_window(window))
+            if progress is not None:
+                progress(len(outputs), len(windows), f"第 {len(outputs)}/{len(windows)} 个滚动窗口寻优与样本外实跑完毕")
+
+    # 样本外净值首尾复利拼接
+    window_rows = []
+    curve_parts = []
+    all_trades = []
+    level = float(initial_cash)
+    pairs, wins = 0, 0.0
+    for k, out in enumerate(outputs):
+        train_lo, train_hi, test_lo, test_hi = out["window"]
+        stop_loss_pct, take_profit_pct, max_hold_days = out["combo"]
+        test_row = out["test_row"]
+
+        if test_hi > test_lo:
+            seg_curve = level * out["test_equity"] / initial_cash
+            curve_parts.append(pd.DataFrame({
+                "Date": dates[test_lo:test_hi],
+                "Equity": seg_curve,
+                "Is_Trading": arrays["is_trading"][test_lo:test_hi],
+                "Segment": k
+            }))
+            level = float(seg_curve[-1])
+        all_trades.extend(out["test_trades"])
+        pairs += test_row["Total_Trades_Pairs"]
+        wins += test_row["Total_Trades_Pairs"] * test_row["Win_Rate"]
+
+        window_rows.append({
+            "训练窗": f"{dates[train_lo].date()} ~ {dates[train_hi - 1].date()}",
+            "测试窗": f"{dates[test_lo].date()} ~ {dates[test_hi - 1].date()}" if test_hi > test_lo else "-",
+            "止损线": stop_loss_pct,
+            "止盈线": take_profit_pct,
+            "最长持仓天数": max_hold_days,
+            f"训练窗 {rank_by}": out["train_score"],
+            "样本外收益": test_row["Total_Return"],
+            "样本外回撤": test_row["Max_Drawdown"],
+            "样本外交易次数": test_row["Total_Trades_Pairs"]
+        })
+
+    equity_df = pd.concat(curve_parts, ignore_index=True) if curve_parts else pd.DataFrame(
+        columns=["Date", "Equity", "Is_Trading", "Segment"])
+
+    report = {"Initial_Cash": initial_cash}
+    if equity_df.empty:
+        report.update({"Final_Equity": initial_cash, "Total_Return": 0.0, "Annual_Return": 0.0,
+                       "Max_Drawdown": 0.0, "Sharpe_Ratio": 0.0, "Calmar_Ratio": 0.0})
+    else:
+        core = calc_core_metrics(equity_df['Equity'], equity_df['Is_Trading'], initial_cash, [])
+        core.pop("Total_Trades_Pairs")
+        core.pop("Win_Rate")
+        report.update(core)
+    # 各测试窗独立起步，胜率按窗口内配对汇总
+    report["Total_Trades_Pairs"] = int(pairs)
+    report["Win_Rate"] = wins / pairs if pairs > 0 else 0.0
+
+    return {
+        "windows": pd.DataFrame(window_rows),
+        "equity_df": equity_df,
+        "trades": all_trades,
+        "report": report
+    }
+
+
+# ------ 后台任务 (job_queue) ------
+def walk_forward_job(ctx, data_path, buy_logic, sell_logic, **wf_kwargs):
+    """
+    专业回测舱的滚动前推任务 (在 job_queue 的工作进程里执行)。
+    各窗口在本进程内逐个执行，不再另开进程池 (并发度统一由 JOB_MAX_WORKERS 控制)；每个窗口之后回报进度并检查取消。
+    :param wf_kwargs: 透传给 run_walk_forward 的网格、窗口长度、资金、费率与时间窗口
+    :return: run_walk_forward 的返回值
+    """
+    ctx.progress(0, 1, "编译表达式并加载行情")
+    return run_walk_forward(data_path, buy_logic, sell_logic, max_workers=1, progress=ctx.checkpoint, **wf_kwargs)
+
+
+# --- 测试入口 ---
+if __name__ == "__main__":
+    test_file = "backtest_data/final_vault/600519.parquet"
+    if os.path.exists(test_file):
+        from param_sweep import build_param_grid
+        wf = run_walk_forward(
+            test_file,
+            buy_logic="Close_Qfq > MA_20 and MACD_Hist > 0",
+            sell_logic="Close_Qfq < MA_10",
+            stop_loss_list=build_param_grid(0.03, 0.15, 0.03),
+            take_profit_list=build_param_grid(0.0, 0.4, 0.1),
+            max_hold_list=build_param_grid(0, 60, 20),
+            train_months=36,
+            test_months=6
+        )
+        print(wf["windows"].to_string())
+        print("\n🏆 === 样本外拼接战报 ===")
+        for k, v in wf["report"].items():
+            print(f"  {k}: {v}")
+    else:
+        print("未找到测试数据，请先运行数据引擎脚本！")